@@ -11,12 +11,13 @@ import requests
 import uuid
 import datetime
 import shutil
+import json
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 try:
-    from database import Base, ModelsTable
+    from database import Base, ModelsTable, ExportsTable
 except (SystemError, ImportError):
-    from .database import Base, ModelsTable
+    from .database import Base, ModelsTable, ExportsTable
 
 
 # CONFIG
@@ -26,9 +27,10 @@ UPLOAD_FOLDER = os.path.join(CURRENT_FOLDER, 'static', 'models')
 TEMP_FOLDER = os.path.join(CURRENT_FOLDER, os.pardir, 'temp')
 DB_PATH = os.path.join(CURRENT_FOLDER, 'database', 'database.db')
 FBX2GLTF_PATH = os.path.abspath(os.path.join(CURRENT_FOLDER, os.pardir, 'lib', 'fbx2gltf', 'fbx2gltf.py'))
-ALLOWED_EXTENSIONS = (['fbx', 'obj', 'zip', 'dae'])
+ALLOWED_EXTENSIONS = (['fbx', 'obj', 'zip', 'dae', 'gltf', 'glb'])
 MAX_UPLOAD_SIZE_MB = 100  # in MB
 MAX_UPLOAD_SIZE_B = MAX_UPLOAD_SIZE_MB * 1024 * 1024
+CONVERTER_MEMORY_BUDGET_MB = 1024  # in MB, buffers above it are spilled to TEMP_FOLDER. 0 to keep everything in memory
 DOWNLOAD_URL_BASE = "http://localhost:5022"  # CHANGE TO YOUR OWN SERVER ADDRESS!!
 API_KEY = 'xxxxxxxx'  # TODO(Nick) Use os.environ['API_KEY'] instead of a hard-coded key  
 
@@ -185,13 +187,16 @@ def make_error(status_code, error_code, message='', help_url=''):
     return response
 
 
-def make_url(url_type, unique_id, filename):
+def make_url(url_type, unique_id, filename, lod_level=0, export_id=None):
     """Create a URL to a file on the server.
 
     Args:
-        type (string): `source`, `glb`, or `gltf`.
+        type (string): `source`, `glb`, `gltf`, `zip`, `lod`, or `animation`.
         unique_id (string): Unique ID of the model we are creating links for.
-        filename (string): Filename of the model we are creating links for.
+        filename (string): Filename of the model we are creating links for, or of the animation file for the
+            `animation` type.
+        lod_level (int): Level of the low-poly GLB, starting at 1. Only used by the `lod` type.
+        export_id (string): Unique ID of the export, None for the files converted on upload.
 
     Returns:
         string: URL to file on server.
@@ -200,6 +205,8 @@ def make_url(url_type, unique_id, filename):
                             'static',
                             os.path.basename(app.config['UPLOAD_FOLDER']),
                             unique_id)
+    if export_id:
+        url_base = os.path.join(url_base, 'exports', export_id)
     filename_base = os.path.splitext(filename)[0]
 
     if url_type == 'source':
@@ -214,14 +221,205 @@ def make_url(url_type, unique_id, filename):
     elif url_type == 'zip':
         url = os.path.join(url_base, filename_base + '.zip')
 
+    elif url_type == 'lod':
+        url = os.path.join(url_base, 'lod', '%s_lod%d.glb' % (filename_base, lod_level))
+
+    elif url_type == 'animation':
+        url = os.path.join(url_base, 'processed', filename)
+
     else:
         raise CustomError(400,
                           'bad_request',
-                          'You used %s as the type in make_url(). Please use `source`, `glb`, `gltf`, or `zip`.' % url_type)
+                          'You used %s as the type in make_url(). Please use `source`, `glb`, `gltf`, `zip`, `lod`, or '
+                          '`animation`.' % url_type)
 
     return url
 
 
+def parse_lod_ratios(lod):
+    """Parse the triangle ratios of the levels of detail passed to the converter.
+
+    Args:
+        lod (str): Comma separated ratios between 0 and 1, e.g. `0.5,0.25`.
+
+    Returns:
+        list: Ratios as floats, or raises an exception if one of them is not valid.
+    """
+    try:
+        ratios = [float(ratio) for ratio in lod.split(',')]
+    except ValueError:
+        ratios = []
+    if not ratios or not all(0 < ratio < 1 for ratio in ratios):
+        raise CustomError(400,
+                          'bad_request',
+                          'The lod parameter %s is not valid. Please use comma separated triangle ratios between 0 '
+                          'and 1, e.g. `0.5,0.25`.' % lod)
+    return ratios
+
+
+def run_converter(command):
+    """Run the converter and wait for it to finish.
+
+    Args:
+        command (list): Converter path followed by its arguments.
+    """
+    # Large models are spilled to temp files instead of being killed for running out of memory
+    command = command[:1] + ['--memory-budget', str(CONVERTER_MEMORY_BUDGET_MB), '--temp-dir', TEMP_FOLDER] + command[1:]
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True
+    )
+    #output = process.stdout.read()
+    #print(output)
+    process.communicate()  # Wait for conversion to finish before continuing
+
+
+def convert_model(unique_id, source_path, filename, form, export_id=None):
+    """Convert a model with the options of a request, including its levels of detail.
+
+    Args:
+        unique_id (str): Unique ID of the model.
+        source_path (str): Path of the uploaded file, or of the cached scene of the model.
+        filename (str): Original filename of the model, used to name the converted files.
+        form (dict): Form of the request, with the optional `compress`, `binary`, `lod` and `split_animations`
+            parameters.
+        export_id (str): Unique ID of the export, None when converting on upload.
+
+    Returns:
+        dict: Urls of the converted files, `compressed`, `lod_files`, `animation_files` and the `stats` JSON
+        string, or raises an exception if a parameter is not valid.
+    """
+    # Check the parameters before any directory is created
+    lod_ratios = []
+    if 'lod' in form and form.get('lod'):
+        lod_ratios = parse_lod_ratios(form.get('lod'))
+
+    model_directory = os.path.join(app.config['UPLOAD_FOLDER'], unique_id)
+    if export_id:
+        model_directory = os.path.join(model_directory, 'exports', export_id)
+    processed_directory = os.path.join(model_directory, 'processed')
+    if not os.path.exists(processed_directory):
+        os.makedirs(processed_directory)
+
+    filename_base = os.path.splitext(filename)[0]
+
+    # Convert uploaded file to glTF
+    command = [FBX2GLTF_PATH]
+
+    # Default is don't compress
+    compressed = False
+    if 'compress' in form and form.get('compress'):
+        compress = '--mesh-quantization'
+        command.append(compress)
+        compressed = True
+
+    # Levels of detail, in the converted file and as separate low-poly GLB files
+    if lod_ratios:
+        command.append('--lod')
+        command.append(','.join(str(ratio) for ratio in lod_ratios))
+
+    # Export as glTF or as GLB
+    processed_format = 'gltf'
+    if 'binary' in form and form.get('binary'):
+        binary = '-b'
+        command.append(binary)
+        processed_format = 'glb'
+
+    # Animations in their own files, converted in the same run as the scene so node indices match
+    if 'split_animations' in form and form.get('split_animations'):
+        command.append('--split-animations')
+
+    processed_path = os.path.join(processed_directory, filename_base + '.' + processed_format)
+    command.append('-o' + processed_path)
+
+    # Bounds and statistics of the scene, outside the processed directory so they're not zipped
+    stats_path = os.path.join(model_directory, 'stats.json')
+    command.append('--stats')
+    command.append(stats_path)
+
+    command.append(source_path)
+
+    run_converter(command)
+
+    # The converter names animation files after the processed file and the animation
+    animation_files = []
+    for animation_filename in sorted(os.listdir(processed_directory)):
+        if animation_filename.startswith(filename_base + '_') and animation_filename.endswith('.' + processed_format):
+            animation_files.append(make_url('animation', unique_id, animation_filename, 0, export_id))
+
+    stats = None
+    if os.path.isfile(stats_path):
+        with open(stats_path) as stats_file:
+            stats = stats_file.read()
+
+    # Low-poly only GLB of each level of detail
+    lod_files = []
+    lod_directory = os.path.join(model_directory, 'lod')
+    for lod_level, lod_ratio in enumerate(lod_ratios, 1):
+        if not os.path.exists(lod_directory):
+            os.makedirs(lod_directory)
+        lod_command = [FBX2GLTF_PATH, '-b', '--simplify', str(lod_ratio)]
+        if compressed:
+            lod_command.append('--mesh-quantization')
+        lod_command.append('-o' + os.path.join(lod_directory, '%s_lod%d.glb' % (filename_base, lod_level)))
+        lod_command.append(source_path)
+        run_converter(lod_command)
+        lod_files.append(make_url('lod', unique_id, filename, lod_level, export_id))
+
+    # Zip glTF and related files from processed directory
+    # See: https://stackoverflow.com/a/25650295
+    download_format = processed_format
+    if processed_format == 'gltf':
+        shutil.make_archive(os.path.join(model_directory, filename_base),
+                            'zip',
+                            processed_directory)
+        download_format = 'zip'
+
+    return {'processed_file': make_url(processed_format, unique_id, filename, 0, export_id),
+            'downloadable_file': make_url(download_format, unique_id, filename, 0, export_id),
+            'compressed': compressed,
+            'lod_files': lod_files,
+            'animation_files': animation_files,
+            'stats': stats}
+
+
+def get_cached_scene(unique_id):
+    """Get the path of the scene cached by the converter on upload.
+
+    Args:
+        unique_id (str): Unique ID of the model.
+
+    Returns:
+        str: Path of the scene JSON, or None if the scene could not be cached.
+    """
+    scene_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_id, 'cache', 'scene.json')
+    if os.path.isfile(scene_path):
+        return scene_path
+    return None
+
+
+def make_export(export):
+    """Create the JSON of an export.
+
+    Args:
+        export (object): Row of the `exports` table.
+
+    Returns:
+        dict: Metadata and urls of the files of the export.
+    """
+    return {'export_id': export.export_id,
+            'created_date': export.created_date.isoformat(),
+            'processed_file': export.processed_file,
+            'downloadable_file': export.downloadable_file,
+            'compressed': export.compressed,
+            'lod_files': json.loads(export.lod_files) if export.lod_files else [],
+            'animation_files': json.loads(export.animation_files) if export.animation_files else [],
+            'stats': json.loads(export.stats) if export.stats else None}
+
+
 def authenticate():
     """Check if user is allowed to execute this request.
 
@@ -280,6 +478,14 @@ class Models(Resource):
         destination_directory = os.path.join(app.config['UPLOAD_FOLDER'], unique_id, 'source')
         processed_directory = os.path.join(app.config['UPLOAD_FOLDER'], unique_id, 'processed')
 
+        # Check the parameters before any directory is created or file is saved, the cleanup of old models only
+        # finds the directories of models in the database
+        if 'lod' in request.form and request.form.get('lod'):
+            try:
+                parse_lod_ratios(request.form.get('lod'))
+            except CustomError as e:
+                return make_error(e.status_code, e.type, e.message, e.help_url)
+
         # TODO(Nick): Refactor the IF statement below to remove duplicate code
         if 'file' in request.files:
             # File data uploaded
@@ -310,7 +516,7 @@ class Models(Resource):
             else:
                 return make_error(415,
                                   'unsupported_file',
-                                  'The %s extension is not allowed, please upload an fbx, obj, or zip file' % extension)
+                                  'The %s extension is not allowed, please upload an fbx, obj, gltf, glb, or zip file' % extension)
 
         elif 'source_path' in request.form:
             # URL sent, no file data uploaded
@@ -338,7 +544,7 @@ class Models(Resource):
             else:
                 return make_error(415,
                                   'unsupported_file',
-                                  'The %s extension is not allowed, please upload an fbx, obj, or zip file' % extension)
+                                  'The %s extension is not allowed, please upload an fbx, obj, gltf, glb, or zip file' % extension)
 
         else:
             return make_error(400,
@@ -348,61 +554,30 @@ class Models(Resource):
         if not allowed:
             return make_error(415,
                               'unsupported_file',
-                              'The %s extension is not allowed, please upload an fbx, obj, or zip file' % extension)
-
-        filename_base = os.path.splitext(filename)[0]
+                              'The %s extension is not allowed, please upload an fbx, obj, gltf, glb, or zip file' % extension)
 
-        # Convert uploaded file to glTF
+        # Load the source file once and cache its scene, every conversion of the model starts from the cache.
         # WARNING: Conversion runs on separate thread, and takes longer to finish than the upload!
-        command = [FBX2GLTF_PATH]
-
-        # Default is don't compress
-        compressed=False
-        if 'compress' in request.form and request.form.get('compress'):
-            compress = '-q'
-            command.append(compress)
-            compressed = True
-
-        # Export as glTF or as GLB
-        processed_format = 'gltf'
-        if 'binary' in request.form and request.form.get('binary'):
-            binary = '-b'
-            command.append(binary)
-            processed_format = 'glb'
-
-        processed_path = os.path.join(processed_directory, filename_base + '.' + processed_format)
-        command.append('-o' + processed_path)
-        
-        command.append(destination_path)  # Source file path
-        
-        process = subprocess.Popen(
-            command,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True
-        )
-        #output = process.stdout.read()
-        #print(output)
-        process.communicate()  # Wait for conversion to finish before continuing
-
-        # Zip glTF and related files from processed directory
-        # See: https://stackoverflow.com/a/25650295
-        download_format = processed_format
-        if processed_format == 'gltf':
-            shutil.make_archive(os.path.join(app.config['UPLOAD_FOLDER'], unique_id, filename_base),
-                                'zip', 
-                                processed_directory)
-            download_format = 'zip'
+        cache_directory = os.path.join(app.config['UPLOAD_FOLDER'], unique_id, 'cache')
+        run_converter([FBX2GLTF_PATH, '--save-cache', cache_directory, destination_path])
+        source_path = get_cached_scene(unique_id) or destination_path
+
+        try:
+            result = convert_model(unique_id, source_path, filename, request.form)
+        except CustomError as e:
+            return make_error(e.status_code, e.type, e.message, e.help_url)
 
         # Store metadata of upload in database
         new_model = ModelsTable(model_id=unique_id,
                                 filename=filename,
                                 created_date=datetime.datetime.now(),
                                 source_file=make_url('source', unique_id, filename),
-                                processed_file=make_url(processed_format, unique_id, filename),
-                                downloadable_file=make_url(download_format, unique_id, filename),
-                                compressed=compressed)
+                                processed_file=result['processed_file'],
+                                downloadable_file=result['downloadable_file'],
+                                compressed=result['compressed'],
+                                lod_files=json.dumps(result['lod_files']),
+                                animation_files=json.dumps(result['animation_files']),
+                                stats=result['stats'])
         db_session.add(new_model)
         db_session.commit()
 
@@ -462,7 +637,9 @@ class Models(Resource):
                 print('Folder with name %s could not be deleted, because it could not be found.' % model_id[0])
                 pass
 
-        # Remove old models from database
+        # Remove old models and their exports from database
+        db_session.query(ExportsTable).filter(ExportsTable.model_id.in_([model_id[0] for model_id in models])).delete(
+            synchronize_session=False)
         db_session.query(ModelsTable.model_id).filter(ModelsTable.created_date < x_hours_ago).delete()
         db_session.commit()
 
@@ -488,13 +665,23 @@ class Model(Resource):
                               'not_found',
                               'The model you requested with id %s does not exist.' % model_id)
 
+        # Exports stored with the model by older versions, then the rows of the exports table
+        exports = json.loads(model.exports) if model.exports else []
+        for export in db_session.query(ExportsTable).filter(ExportsTable.model_id == model_id).order_by(
+                ExportsTable.created_date):
+            exports.append(make_export(export))
+
         result = {'model_id': model.model_id,
                   'filename': model.filename,
                   'created_date': model.created_date,
                   'source_file': model.source_file,
                   'processed_file': model.processed_file,
                   'downloadable_file': model.downloadable_file,
-                  'compressed': model.compressed}
+                  'compressed': model.compressed,
+                  'lod_files': json.loads(model.lod_files) if model.lod_files else [],
+                  'animation_files': json.loads(model.animation_files) if model.animation_files else [],
+                  'stats': json.loads(model.stats) if model.stats else None,
+                  'exports': exports}
 
         return jsonify(result)
 
@@ -522,8 +709,9 @@ class Model(Resource):
                               'Model with id %s cannot be deleted, because it could not be found.' % model_id
                               )
 
-        # Remove model from database
+        # Remove model and its exports from database
         model = db_session.query(ModelsTable).filter(ModelsTable.model_id == model_id).first()
+        db_session.query(ExportsTable).filter(ExportsTable.model_id == model_id).delete()
         db_session.delete(model)
         db_session.commit()
 
@@ -531,6 +719,54 @@ class Model(Resource):
         return jsonify(result)
 
 
+class Exports(Resource):
+
+    def post(self, model_id):
+        """Convert a model again with other options, from the scene cached on upload.
+
+        Args:
+            model_id (str): The ID of the model you want to export.
+
+        Returns:
+            string: JSON result of the export, or error if one or more of the checks fail.
+        """
+        model = db_session.query(ModelsTable).filter(ModelsTable.model_id == model_id).first()
+        if not model:
+            return make_error(404,
+                              'not_found',
+                              'The model you requested with id %s does not exist.' % model_id)
+
+        # Models uploaded before scenes were cached are converted from their source file
+        source_path = get_cached_scene(model_id)
+        if not source_path:
+            source_path = os.path.join(app.config['UPLOAD_FOLDER'], model_id, 'source', model.filename)
+        if not os.path.isfile(source_path):
+            return make_error(404,
+                              'not_found',
+                              'The source file of model with id %s could not be found.' % model_id)
+
+        export_id = uuid.uuid4().hex
+        try:
+            result = convert_model(model_id, source_path, model.filename, request.form, export_id)
+        except CustomError as e:
+            return make_error(e.status_code, e.type, e.message, e.help_url)
+
+        # Store the export in its own row, concurrent exports of the model don't read and write the same row
+        export = ExportsTable(export_id=export_id,
+                              model_id=model_id,
+                              created_date=datetime.datetime.now(),
+                              processed_file=result['processed_file'],
+                              downloadable_file=result['downloadable_file'],
+                              compressed=result['compressed'],
+                              lod_files=json.dumps(result['lod_files']),
+                              animation_files=json.dumps(result['animation_files']),
+                              stats=result['stats'])
+        db_session.add(export)
+        db_session.commit()
+
+        return jsonify(make_export(export))
+
+
 class Web(Resource):
 
     def get(self):
@@ -542,6 +778,7 @@ class Web(Resource):
 
 api.add_resource(Models, '/v1/models')
 api.add_resource(Model, '/v1/models/<model_id>')
+api.add_resource(Exports, '/v1/models/<model_id>/exports')
 api.add_resource(Web, '/')
 
 if __name__ == '__main__':
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, String, DateTime, Boolean
+from sqlalchemy import Column, String, DateTime, Boolean, Text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 import os
 
 """This script creates an sqlite database with the schema defined below."""
@@ -33,16 +33,54 @@ class ModelsTable(Base):
     processed_file = Column(String(250))
     downloadable_file = Column(String(250))
     compressed = Column(Boolean)
+    lod_files = Column(Text)  # JSON array of urls to the low-poly GLB of each level of detail
+    animation_files = Column(Text)  # JSON array of urls to the file of each animation, when they are split from the scene
+    stats = Column(Text)  # JSON object with bounds and statistics of the scene, written by the converter
+    exports = Column(Text)  # JSON array of the exports made before they were stored in ExportsTable
 
     # Allows result of query to be converted to a dict, making it serializable
     # Usage: ModelTable.as_dict()
     # def as_dict(self):
         # return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
+class ExportsTable(Base):
+    __tablename__ = 'exports'
+    # Conversions of a model made again with other options, one row each so concurrent exports don't overwrite
+    # each other.
+    export_id = Column(String(32), primary_key=True)
+    model_id = Column(String(32), index=True, nullable=False)
+    created_date = Column(DateTime, nullable=False)
+    processed_file = Column(String(250))
+    downloadable_file = Column(String(250))
+    compressed = Column(Boolean)
+    lod_files = Column(Text)  # JSON array of urls to the low-poly GLB of each level of detail
+    animation_files = Column(Text)  # JSON array of urls to the file of each animation, when they are split from the scene
+    stats = Column(Text)  # JSON object with bounds and statistics of the scene, written by the converter
+
 # Create an engine that stores data in the local directory's
 # sqlalchemy_example.db file.
 db = create_engine('sqlite:///' + DB_PATH)
 
 # Create all tables in the engine. This is equivalent to "Create Table"
 # statements in raw SQL.
-Base.metadata.create_all(db)
\ No newline at end of file
+Base.metadata.create_all(db)
+
+
+def add_missing_columns(engine, table):
+    """Add the columns of a table that are missing from an existing database.
+
+    `create_all` only creates missing tables, so columns added to the schema later are added here.
+
+    Args:
+        engine (object): Engine of the database.
+        table (object): Table of the schema, e.g. `ModelsTable.__table__`.
+    """
+    with engine.begin() as connection:
+        existing_columns = [row[1] for row in connection.execute(text('PRAGMA table_info(%s)' % table.name))]
+        for column in table.columns:
+            if column.name not in existing_columns:
+                connection.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    table.name, column.name, column.type.compile(dialect=engine.dialect))))
+
+
+add_missing_columns(db, ModelsTable.__table__)
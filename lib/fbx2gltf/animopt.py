@@ -0,0 +1,90 @@
+# ############################################
+# Keyframe reduction of sampled animation channels, independent from the FBX SDK.
+# Times are numpy arrays of n seconds, values n x 3 arrays (translation, scale)
+# or n x 4 arrays of xyzw quaternions (rotation).
+# ############################################
+import numpy as np
+
+def QuatSlerpArray(pFrom, pTo, pT):
+    # Slerp between two quaternions at all the factors in pT
+    lTo = np.array(pTo, dtype=np.float64)
+    lCos = float(np.dot(pFrom, lTo))
+    if lCos < 0:
+        lCos = -lCos
+        lTo = -lTo
+    lT = pT.reshape(-1, 1)
+    if 1.0 - lCos > 1e-6:
+        lOmega = np.arccos(min(lCos, 1.0))
+        lSin = np.sin(lOmega)
+        return (np.sin((1.0 - lT) * lOmega) * pFrom + np.sin(lT * lOmega) * lTo) / lSin
+    # Quaternions are very close, linear interpolation is enough
+    return (1.0 - lT) * pFrom + lT * lTo
+
+def QuatAngleArray(pA, pB):
+    lLength = np.sqrt((pA * pA).sum(axis=1) * (pB * pB).sum(axis=1))
+    lDot = np.abs((pA * pB).sum(axis=1)) / np.maximum(lLength, 1e-12)
+    return 2 * np.arccos(np.minimum(lDot, 1.0))
+
+def InterpolationError(pTimes, pValues, pStart, pEnd, pIsRotation):
+    # Error of every key in [pStart, pEnd] when linearly interpolated between the two ends
+    lTimes = pTimes[pStart:pEnd + 1]
+    lValues = pValues[pStart:pEnd + 1]
+    lDuration = lTimes[-1] - lTimes[0]
+    if lDuration > 0:
+        lT = (lTimes - lTimes[0]) / lDuration
+    else:
+        lT = np.zeros(len(lTimes))
+    if pIsRotation:
+        return QuatAngleArray(QuatSlerpArray(lValues[0], lValues[-1], lT), lValues)
+    lInterpolated = lValues[0] + lT.reshape(-1, 1) * (lValues[-1] - lValues[0])
+    return np.sqrt(((lInterpolated - lValues) ** 2).sum(axis=1))
+
+def ValueError(pA, pB, pIsRotation):
+    if pIsRotation:
+        return QuatAngleArray(pA, pB)
+    return np.sqrt(((pA - pB) ** 2).sum(axis=1))
+
+def ReduceLinear(pTimes, pValues, pTolerance, pIsRotation):
+    # Douglas-Peucker, keep the key of max error of a segment until all segments are within tolerance
+    lKeep = np.zeros(len(pTimes), dtype=bool)
+    lKeep[0] = lKeep[-1] = True
+    lSegments = [(0, len(pTimes) - 1)]
+    while len(lSegments) > 0:
+        lStart, lEnd = lSegments.pop()
+        if lEnd - lStart < 2:
+            continue
+        lError = InterpolationError(pTimes, pValues, lStart, lEnd, pIsRotation)
+        lMax = int(np.argmax(lError))
+        if lError[lMax] > pTolerance:
+            lSplit = lStart + lMax
+            lKeep[lSplit] = True
+            lSegments.append((lStart, lSplit))
+            lSegments.append((lSplit, lEnd))
+    return np.flatnonzero(lKeep)
+
+def ReduceStep(pTimes, pValues, pTolerance, pIsRotation):
+    # Keys where the value changes, if holding the value of the previous key is within tolerance.
+    # The last key is always kept so the channel keeps its duration.
+    lChanged = np.ones(len(pTimes), dtype=bool)
+    lChanged[1:] = ValueError(pValues[1:], pValues[:-1], pIsRotation) > pTolerance
+    lHeldKey = np.maximum.accumulate(np.where(lChanged, np.arange(len(pTimes)), 0))
+    if ValueError(pValues[lHeldKey], pValues, pIsRotation).max() > pTolerance:
+        return None
+    lChanged[-1] = True
+    return np.flatnonzero(lChanged)
+
+# Remove the keys that can be interpolated from their neighbours within the tolerance.
+# Returns the kept times, values, and the glTF interpolation to use ('LINEAR' or 'STEP').
+def ReduceKeyframes(pTimes, pValues, pTolerance, pIsRotation=False):
+    lTimes = np.asarray(pTimes, dtype=np.float64)
+    lValues = np.asarray(pValues, dtype=np.float64)
+    if len(lTimes) < 3:
+        return lTimes, lValues, 'LINEAR'
+
+    lKeys = ReduceLinear(lTimes, lValues, pTolerance, pIsRotation)
+    lInterpolation = 'LINEAR'
+    lStepKeys = ReduceStep(lTimes, lValues, pTolerance, pIsRotation)
+    if lStepKeys is not None and len(lStepKeys) < len(lKeys):
+        lKeys = lStepKeys
+        lInterpolation = 'STEP'
+    return lTimes[lKeys], lValues[lKeys], lInterpolation
@@ -6,22 +6,35 @@
 # TODO: texture flipY?
 # http://github.com/pissang/
 # ############################################
-import sys, struct, json, os.path, math, argparse, shutil
-
+import sys, struct, json, os.path, math, argparse, hashlib, re, tempfile
+import numpy as np
+import meshopt
+import meshgen
+import scenegraph
+import animopt
+import glbwriter
+import textures
+import stats
+import objreader
+import gltfreader
+import scenecache
+import spillbuffer
+
+# OBJ and glTF files are read without the FBX SDK, it's only required to convert other formats
+HAS_FBX_SDK = True
 try:
     from FbxCommon import *
 except ImportError:
     import platform
-    msg = 'You need to copy the content in compatible subfolder under /lib/python<version> into your python install folder such as '
+    HAS_FBX_SDK = False
+    FBX_SDK_MESSAGE = 'You need to copy the content in compatible subfolder under /lib/python<version> into your python install folder such as '
     if platform.system() == 'Windows' or platform.system() == 'Microsoft':
-        msg += '"Python33/Lib/site-packages"'
+        FBX_SDK_MESSAGE += '"Python33/Lib/site-packages"'
     elif platform.system() == 'Linux':
-        msg += '"/usr/local/lib/python3.3/site-packages"'
+        FBX_SDK_MESSAGE += '"/usr/local/lib/python3.3/site-packages"'
     elif platform.system() == 'Darwin':
-        msg += '"/Library/Frameworks/Python.framework/Versions/3.3/lib/python3.3/site-packages"'
-    msg += ' folder.'
-    print(msg)
-    sys.exit(1)
+        FBX_SDK_MESSAGE += '"/Library/Frameworks/Python.framework/Versions/3.3/lib/python3.3/site-packages"'
+    FBX_SDK_MESSAGE += ' folder.'
 
 lib_materials = []
 
@@ -34,6 +47,9 @@ lib_attributes_accessors = []
 lib_indices_accessors = []
 lib_animation_accessors = []
 lib_ibm_accessors = []
+lib_instance_accessors = []
+# indices and values of sparse accessors
+lib_sparse_accessors = []
 lib_accessors = []
 
 lib_buffer_views = []
@@ -51,10 +67,23 @@ lib_animations = []
 
 # Only python 3 support bytearray ?
 # http://dabeaz.blogspot.jp/2010/01/few-useful-bytearray-tricks.html
-attributeBuffer = bytearray()
-indicesBuffer = bytearray()
-invBindMatricesBuffer = bytearray()
-animationBuffer = bytearray()
+# Buffers move to temp files above the memory budget, see spillbuffer
+attributeBuffer = spillbuffer.SpillBuffer()
+indicesBuffer = spillbuffer.SpillBuffer()
+invBindMatricesBuffer = spillbuffer.SpillBuffer()
+animationBuffer = spillbuffer.SpillBuffer()
+instancesBuffer = spillbuffer.SpillBuffer()
+sparseBuffer = spillbuffer.SpillBuffer()
+# Vertex attributes whose element size is not a multiple of 4 are padded and kept in their own strided buffer view
+# byteStride -> [buffer, accessors]
+stridedAttributeBuffers = {}
+# Interleaved vertices of each primitive, [buffer, accessors, byteStride]
+interleavedAttributeBuffers = []
+
+lib_extensions_used = []
+lib_extensions_required = []
+# Extensions of the glTF root, carried over from glTF input files
+lib_extensions = {}
 
 GL_RGBA = 0x1908
 
@@ -65,6 +94,10 @@ GL_UNSIGNED_SHORT = 5123
 GL_UNSIGNED_INT = 5125
 GL_FLOAT = 5126
 
+GL_TRIANGLES = 4
+GL_TRIANGLE_STRIP = 5
+GL_TRIANGLE_FAN = 6
+
 GL_REPEAT = 0x2901
 
 
@@ -84,7 +117,47 @@ GL_ELEMENT_ARRAY_BUFFER = 0x8893
 
 
 ENV_QUANTIZE = False
+ENV_MESH_QUANTIZATION = False
+ENV_INTERLEAVE = False
+ENV_OPTIMIZE_VERTEX_CACHE = False
+# Generate smooth normals for meshes without normals, split on edges sharper than the crease angle (in degrees)
+ENV_GENERATE_NORMALS = False
+ENV_CREASE_ANGLE = 60
+# Generate tangents for primitives of normal mapped materials
+ENV_GENERATE_TANGENTS = False
+# Split primitives with too many vertices for 16 bits indices
+ENV_SPLIT_INDICES = False
+# Triangle ratio of each MSFT_lod level
+ENV_LOD_RATIOS = []
+# Triangle ratio of all meshes, for low detail only exports
+ENV_SIMPLIFY_RATIO = 1.0
+# Merge the primitives of static meshes sharing a material, baked in world space
+ENV_BATCH_STATIC_MESHES = False
+# Remove empty nodes and collapse chains of helper nodes
+ENV_COMPACT_SCENE = False
+# Min count of static instances of a mesh to draw them with EXT_mesh_gpu_instancing, 0 to disable
+ENV_GPU_INSTANCING = 0
+# Max error of the interpolation between animation samples and kept keyframes
+ENV_ANIMATION_TRANSLATION_ERROR = 1e-3
+ENV_ANIMATION_ROTATION_ERROR = 1e-3  # In radians
+ENV_ANIMATION_SCALE_ERROR = 1e-4
+ENV_ANIMATION_WEIGHT_ERROR = 1e-3
+# Max position error relative to the bounding box size, and fixed bit depths of other attributes
+ENV_QUANTIZE_POSITION_ERROR = 1e-5
+ENV_QUANTIZE_NORMAL_BITS = 10
+ENV_QUANTIZE_TEXCOORD_BITS = 12
 ENV_FLIP_V = True
+# Max width and height of textures, 0 to keep their size, and resize to powers of two
+ENV_TEXTURE_MAX_SIZE = 0
+ENV_TEXTURE_POWER_OF_TWO = False
+# Resized textures, by hash of the source image
+ENV_TEXTURE_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'fbx2gltf-textures')
+# Path of the JSON file with bounds and statistics of the scene, empty to not write it
+ENV_STATS_PATH = ''
+# Write each animation to its own file next to the scene, see SplitAnimations
+ENV_SPLIT_ANIMATIONS = False
+# (name, start second, duration) of the animations sampled from each fbx anim stack, empty to sample them with the time range
+ENV_ANIMATION_RANGES = []
 
 _id = 0
 def GetId():
@@ -102,97 +175,94 @@ def MatGetOpacity(pMaterial):
     return 1.0 - lFactor * (lColor[0] + lColor[1] + lColor[2]) / 3;
 
 
-def quantize(pList, pStride, pMin, pMax):
-    lRange = range(pStride)
-    lMultiplier = []
-    lDivider = []
-    # TODO dynamic precision? may lose info?
-    lPrecision = 1e6
-    for i in lRange:
-        pMax[i] = math.ceil(pMax[i] * lPrecision) / lPrecision;
-        pMin[i] = math.floor(pMin[i] * lPrecision) / lPrecision;
-        if pMax[i] == pMin[i]:
-            lMultiplier.append(0)
-            lDivider.append(0)
-        else:
-            lDividerTmp = (pMax[i] - pMin[i]) / 65535;
-            lDividerTmp = math.ceil(lDividerTmp * lPrecision) / lPrecision
-            lDivider.append(lDividerTmp)
-            lMultiplier.append(1 / lDividerTmp)
-
-    lNewList = []
-    for item in pList:
-        if pStride == 1:
-            lNewList.append(int((item - pMin[0]) * lMultiplier[0]))
-        else:
-            lNewItem = []
-            for i in lRange:
-                lNewItem.append(int((item[i] - pMin[i]) * lMultiplier[i]))
-            lNewList.append(lNewItem)
-
-    # TODO
+def GetQuantizeBits(pSemantic):
+    if pSemantic == 'POSITION':
+        # Enough levels to keep the rounding error under ENV_QUANTIZE_POSITION_ERROR * bounding box size
+        lLevels = math.ceil(0.5 / max(ENV_QUANTIZE_POSITION_ERROR, 1e-12))
+        # Signed positions need 2 bits for a non zero level on each side of the center
+        return int(min(max(math.ceil(math.log(lLevels + 1, 2)), 2), 16))
+    elif pSemantic in ('NORMAL', 'TANGENT'):
+        return ENV_QUANTIZE_NORMAL_BITS
+    elif pSemantic is not None and pSemantic.startswith('TEXCOORD_'):
+        return ENV_QUANTIZE_TEXCOORD_BITS
+    return 16
+
+def quantize(pArray, pBits, pMin, pMax):
+    lMin = np.asarray(pMin, dtype=np.float64)
+    lMax = np.asarray(pMax, dtype=np.float64)
+    lStride = len(lMin)
+    lLevels = (1 << pBits) - 1
+    lDivider = (lMax - lMin) / lLevels
+    lMultiplier = np.zeros(lStride)
+    np.divide(1.0, lDivider, out=lMultiplier, where=lDivider > 0)
+
+    lArray = pArray.astype(np.float64)
+    lQuantized = np.clip(np.rint((lArray - lMin) * lMultiplier), 0, lLevels).astype(np.uint16)
+    lError = 0.0
+    if len(lArray) > 0:
+        lError = float(np.abs(lQuantized * lDivider + lMin - lArray).max())
+
+    # Column major decode matrix with the scale on the diagonal and the offset in the last column
+    lDecodeMatrix = np.identity(lStride + 1)
+    lDecodeMatrix[range(lStride), range(lStride)] = lDivider
+    lDecodeMatrix[lStride, :lStride] = lMin
+
+    return lQuantized, lDecodeMatrix.ravel().tolist(), lError
+
+
+def ListToArray(pList, pStride):
+    if isinstance(pList, np.ndarray):
+        return pList.reshape(len(pList), pStride)
     if pStride == 1:
-        lDecodeMatrix = [
-            lDivider[0], 0,
-            pMin[0], 1
-        ]
-    elif pStride == 2:
-        lDecodeMatrix = [
-            lDivider[0], 0, 0,
-            0, lDivider[1], 0,
-            pMin[0], pMin[1], 1
-        ]
-    elif pStride == 3:
-        lDecodeMatrix = [
-            lDivider[0], 0, 0, 0,
-            0, lDivider[1], 0, 0,
-            0, 0, lDivider[2], 0,
-            pMin[0], pMin[1], pMin[2], 1
-        ]
-    elif pStride == 4:
-        lDecodeMatrix = [
-            lDivider[0], 0, 0, 0, 0,
-            0, lDivider[1], 0, 0, 0,
-            0, 0, lDivider[2], 0, 0,
-            0, 0, 0, lDivider[3], 0,
-            pMin[0], pMin[1], pMin[2], pMin[3], 1
-        ]
-
-    return lNewList, lDecodeMatrix, pMin, pMax
-
-
-def CreateAccessorBuffer(pList, pType, pStride, pMinMax=False, pQuantize=False):
+        return np.asarray(pList).reshape(len(pList), 1)
+    # Items may be longer than the stride, e.g. FbxVector4 control points
+    return np.array([tuple(item)[:pStride] for item in pList]).reshape(len(pList), pStride)
+
+_componentTypes = {
+    'b': GL_BYTE,
+    'B': GL_UNSIGNED_BYTE,
+    'h': GL_SHORT,
+    'H': GL_UNSIGNED_SHORT,
+    'I': GL_UNSIGNED_INT,
+    'f': GL_FLOAT
+}
+_accessorTypes = {
+    1: 'SCALAR',
+    2: 'VEC2',
+    3: 'VEC3',
+    4: 'VEC4',
+    9: 'MAT3',
+    16: 'MAT4'
+}
+_componentSizes = {
+    GL_BYTE: 1,
+    GL_UNSIGNED_BYTE: 1,
+    GL_SHORT: 2,
+    GL_UNSIGNED_SHORT: 2,
+    GL_UNSIGNED_INT: 4,
+    GL_FLOAT: 4
+}
+
+def UseExtension(pName, pRequired=False):
+    if not pName in lib_extensions_used:
+        lib_extensions_used.append(pName)
+    if pRequired and not pName in lib_extensions_required:
+        lib_extensions_required.append(pName)
+
+def CreateAccessorBuffer(pList, pType, pStride, pMinMax=False, pQuantizeBits=0):
     lGLTFAcessor = {}
 
-    if pMinMax:
-        if len(pList) > 0:
-            if pStride == 1:
-                lMin = [pList[0]]
-                lMax = [pList[0]]
-            elif pStride == 16:
-                lMin = ListFromM4(pList[0])
-                lMax = ListFromM4(pList[0])
-            else:
-                lMin = list(pList[0])[:pStride]
-                lMax = list(pList[0])[:pStride]
+    lArray = ListToArray(pList, pStride).astype('<' + pType)
+
+    if pQuantizeBits and pType == 'f' and pStride <= 4:
+        if len(lArray) > 0:
+            lDecodedMin = lArray.min(axis=0).tolist()
+            lDecodedMax = lArray.max(axis=0).tolist()
         else:
-            lMax = [0] * pStride
-            lMin = [0] * pStride
-        lRange = range(pStride)
-        for item in pList:
-            if pStride == 1:
-                for i in lRange:
-                    lMin[i] = min(lMin[i], item)
-                    lMax[i] = max(lMax[i], item)
-            else:
-                if pStride == 16:
-                    item = ListFromM4(item)
-                for i in lRange:
-                    lMin[i] = min(lMin[i], item[i])
-                    lMax[i] = max(lMax[i], item[i])
-
-    if pQuantize and pType == 'f' and pStride <= 4:
-        pList, lDecodeMatrix, lDecodedMin, lDecodedMax = quantize(pList, pStride, lMin[0:], lMax[0:])
+            lDecodedMin = [0] * pStride
+            lDecodedMax = [0] * pStride
+        lArray, lDecodeMatrix, lError = quantize(lArray, pQuantizeBits, lDecodedMin, lDecodedMax)
+        lArray = lArray.astype('<H')
         pType = 'H'
         # https://github.com/KhronosGroup/glTF/blob/master/extensions/Vendor/WEB3D_quantized_attributes
         lGLTFAcessor['extensions'] = {
@@ -202,80 +272,130 @@ def CreateAccessorBuffer(pList, pType, pStride, pMinMax=False, pQuantize=False):
                 'decodeMatrix': lDecodeMatrix
             }
         }
+        lGLTFAcessor['_quantizationError'] = lError
 
-    lPackType = '<' + pType * pStride
-    lData = []
-    #TODO: Other method to write binary buffer ?
-    for item in pList:
-        if pStride == 1:
-            lData.append(struct.pack(lPackType, item))
-        elif pStride == 2:
-            lData.append(struct.pack(lPackType, item[0], item[1]))
-        elif pStride == 3:
-            lData.append(struct.pack(lPackType, item[0], item[1], item[2]))
-        elif pStride == 4:
-            lData.append(struct.pack(lPackType, item[0], item[1], item[2], item[3]))
-        elif pStride == 16:
-            m = item
-            lData.append(struct.pack(lPackType, m[0][0], m[0][1], m[0][2], m[0][3], m[1][0], m[1][1], m[1][2], m[1][3], m[2][0], m[2][1], m[2][2], m[2][3], m[3][0], m[3][1], m[3][2], m[3][3]))
-
-    if pType == 'f':
-        lGLTFAcessor['componentType'] = GL_FLOAT
-    # Unsigned Int
-    elif pType == 'I':
-        lGLTFAcessor['componentType'] = GL_UNSIGNED_INT
-
-    # Unsigned Short
-    elif pType == 'H':
-        lGLTFAcessor['componentType'] = GL_UNSIGNED_SHORT
-
-    if pStride == 1:
-        lGLTFAcessor['type'] = 'SCALAR'
-    elif pStride == 2:
-        lGLTFAcessor['type'] = 'VEC2'
-    elif pStride == 3:
-        lGLTFAcessor['type'] = 'VEC3'
-    elif pStride == 4:
-        lGLTFAcessor['type'] = 'VEC4'
-    elif pStride == 9:
-        lGLTFAcessor['type'] = 'MAT3'
-    elif pStride == 16:
-        lGLTFAcessor['type'] = 'MAT4'
-
+    lGLTFAcessor['componentType'] = _componentTypes[pType]
+    lGLTFAcessor['type'] = _accessorTypes[pStride]
     lGLTFAcessor['byteOffset'] = 0
-    lGLTFAcessor['count'] = len(pList)
+    lGLTFAcessor['count'] = len(lArray)
 
     if pMinMax:
-        lGLTFAcessor['max'] = lMax
-        lGLTFAcessor['min'] = lMin
+        if len(lArray) > 0:
+            lGLTFAcessor['max'] = lArray.max(axis=0).tolist()
+            lGLTFAcessor['min'] = lArray.min(axis=0).tolist()
+        else:
+            lGLTFAcessor['max'] = [0] * pStride
+            lGLTFAcessor['min'] = [0] * pStride
 
-    return b''.join(lData), lGLTFAcessor
+    return lArray.tobytes(), lGLTFAcessor
 
 def appendToBuffer(pType, pBuffer, pData, pObj):
     lByteOffset = len(pBuffer)
-    if pType == 'f' or pType == 'I':
-        # should be a multiple of 4 for alignment
-        if lByteOffset % 4 == 2:
-            pBuffer.extend(b'\x00\x00')
-            lByteOffset += 2
+    # should be a multiple of the component size for alignment
+    lPadding = -lByteOffset % struct.calcsize('<' + pType)
+    if lPadding:
+        pBuffer.extend(b'\x00' * lPadding)
+        lByteOffset += lPadding
 
     pObj['byteOffset'] = lByteOffset
     pBuffer.extend(pData)
 
-def CreateAttributeBuffer(pList, pType, pStride):
-    lData, lGLTFAttribute = CreateAccessorBuffer(pList, pType, pStride, True, ENV_QUANTIZE)
-    appendToBuffer(pType, attributeBuffer, lData, lGLTFAttribute)
+# Accessors with the same content are written once, see GetAccessorHashKey
+_accessorHashMap = {}
+
+def GetAccessorHashKey(pCategory, pData, pGLTFAccessor):
+    lExtensions = None
+    if 'extensions' in pGLTFAccessor:
+        lExtensions = json.dumps(pGLTFAccessor['extensions'], sort_keys=True)
+    return (
+        pCategory,
+        hashlib.sha1(pData).digest(),
+        pGLTFAccessor['componentType'],
+        pGLTFAccessor['type'],
+        pGLTFAccessor['count'],
+        pGLTFAccessor.get('normalized', False),
+        lExtensions
+    )
+
+def ReportQuantizationError(pAccessorIdx, pSemantic, pBits, pError):
+    print('Quantized accessor %d (%s) to %d bits, max error %g' % (pAccessorIdx, pSemantic, pBits, pError))
+
+# Attributes are collected in pInterleaved instead of written when it's given, see CreateInterleavedBuffer
+def CreateAttributeBuffer(pList, pType, pStride, pSemantic=None, pNormalized=False, pInterleaved=None):
+    lQuantizeBits = 0
+    if ENV_QUANTIZE and not ENV_MESH_QUANTIZATION:
+        lQuantizeBits = GetQuantizeBits(pSemantic)
+    lData, lGLTFAttribute = CreateAccessorBuffer(pList, pType, pStride, True, lQuantizeBits)
+    if pNormalized:
+        lGLTFAttribute['normalized'] = True
+    # Interleaved vertices are deduplicated as a whole in CreateInterleavedBuffer
+    if pInterleaved is None:
+        lHashKey = GetAccessorHashKey('attribute', lData, lGLTFAttribute)
+        if lHashKey in _accessorHashMap:
+            return _accessorHashMap[lHashKey]
+        _accessorHashMap[lHashKey] = len(lib_accessors)
     idx = len(lib_accessors)
-    lib_attributes_accessors.append(lGLTFAttribute)
+    if '_quantizationError' in lGLTFAttribute:
+        UseExtension('WEB3D_quantized_attributes', True)
+        ReportQuantizationError(idx, pSemantic, lQuantizeBits, lGLTFAttribute.pop('_quantizationError'))
+
+    lCount = lGLTFAttribute['count']
+    lElementSize = _componentSizes[lGLTFAttribute['componentType']] * pStride
+    if pInterleaved is not None:
+        pInterleaved.append((lData, lGLTFAttribute, lElementSize))
+    elif lElementSize % 4 == 0:
+        appendToBuffer(pType, attributeBuffer, lData, lGLTFAttribute)
+        lib_attributes_accessors.append(lGLTFAttribute)
+    else:
+        # Each element of a vertex attribute must be aligned to 4 bytes
+        lByteStride = lElementSize + (-lElementSize % 4)
+        lPadded = np.zeros((lCount, lByteStride), dtype=np.uint8)
+        lPadded[:, :lElementSize] = np.frombuffer(lData, dtype=np.uint8).reshape(lCount, lElementSize)
+        lBuffer, lAccessors = stridedAttributeBuffers.setdefault(lByteStride, [spillbuffer.SpillBuffer(), []])
+        lGLTFAttribute['byteOffset'] = len(lBuffer)
+        lBuffer.extend(lPadded.tobytes())
+        lAccessors.append(lGLTFAttribute)
     lib_accessors.append(lGLTFAttribute)
     return idx
 
 
+def CreateInterleavedBuffer(pAttributes):
+    lByteStride = 0
+    for lData, lGLTFAttribute, lElementSize in pAttributes:
+        # Each attribute in the vertex must be aligned to 4 bytes
+        lGLTFAttribute['byteOffset'] = lByteStride
+        lByteStride += lElementSize + (-lElementSize % 4)
+
+    lCount = pAttributes[0][1]['count']
+    lVertices = np.zeros((lCount, lByteStride), dtype=np.uint8)
+    for lData, lGLTFAttribute, lElementSize in pAttributes:
+        lByteOffset = lGLTFAttribute['byteOffset']
+        lVertices[:, lByteOffset:lByteOffset + lElementSize] = np.frombuffer(lData, dtype=np.uint8).reshape(lCount, lElementSize)
+    lVertices = lVertices.tobytes()
+    lAccessors = [lGLTFAttribute for lData, lGLTFAttribute, lElementSize in pAttributes]
+
+    # Same vertices with the same layout, the accessors can point to the existing buffer view
+    lHashKey = ('interleaved', hashlib.sha1(lVertices).digest(), lByteStride, tuple(
+        (lGLTFAttribute['byteOffset'], lGLTFAttribute['componentType'], lGLTFAttribute['type']) for lGLTFAttribute in lAccessors
+    ))
+    if lHashKey in _accessorHashMap:
+        interleavedAttributeBuffers[_accessorHashMap[lHashKey]][1].extend(lAccessors)
+        return
+    _accessorHashMap[lHashKey] = len(interleavedAttributeBuffers)
+    lBuffer = spillbuffer.SpillBuffer()
+    lBuffer.extend(lVertices)
+    interleavedAttributeBuffers.append([lBuffer, lAccessors, lByteStride])
+
+
 def CreateIndicesBuffer(pList, pType):
     # Sketchfab needs all accessor have min, max?
     lData, lGLTFIndices = CreateAccessorBuffer(pList, pType, 1, True)
+    lHashKey = GetAccessorHashKey('indices', lData, lGLTFIndices)
+    if lHashKey in _accessorHashMap:
+        return _accessorHashMap[lHashKey]
     appendToBuffer(pType, indicesBuffer, lData, lGLTFIndices)
     idx = len(lib_accessors)
+    _accessorHashMap[lHashKey] = idx
     lib_indices_accessors.append(lGLTFIndices)
     lib_accessors.append(lGLTFIndices)
     return idx
@@ -292,28 +412,89 @@ def CreateAnimationBuffer(pList, pType, pStride):
     # if lAllSame:
     #     return -1
 
+    lHashKey = GetAccessorHashKey('animation', lData, lGLTFAnimSampler)
+    if lHashKey in _accessorHashMap:
+        return _accessorHashMap[lHashKey]
+
     appendToBuffer(pType, animationBuffer, lData, lGLTFAnimSampler)
 
     idx = len(lib_accessors)
+    _accessorHashMap[lHashKey] = idx
     lib_animation_accessors.append(lGLTFAnimSampler)
     lib_accessors.append(lGLTFAnimSampler)
     return idx
 
 def CreateIBMBuffer(pList):
-    lData, lGLTFIBM = CreateAccessorBuffer(pList, 'f', 16, True)
+    # min and max are not required for inverse bind matrices
+    lData, lGLTFIBM = CreateAccessorBuffer(pList, 'f', 16)
+    lHashKey = GetAccessorHashKey('ibm', lData, lGLTFIBM)
+    if lHashKey in _accessorHashMap:
+        return _accessorHashMap[lHashKey]
     appendToBuffer('f', invBindMatricesBuffer, lData, lGLTFIBM)
     idx = len(lib_accessors)
+    _accessorHashMap[lHashKey] = idx
     lib_ibm_accessors.append(lGLTFIBM)
     lib_accessors.append(lGLTFIBM)
     return idx
 
+def CreateInstanceBuffer(pList, pStride):
+    lData, lGLTFInstance = CreateAccessorBuffer(pList, 'f', pStride)
+    appendToBuffer('f', instancesBuffer, lData, lGLTFInstance)
+    idx = len(lib_accessors)
+    lib_instance_accessors.append(lGLTFInstance)
+    lib_accessors.append(lGLTFInstance)
+    return idx
+
+# Morph target deltas, stored as a sparse accessor when it's smaller than the dense one.
+# Deltas of unmoved vertices are zero, an accessor without bufferView is all zeros.
+def CreateMorphTargetBuffer(pDeltas):
+    lDeltas = ListToArray(pDeltas, 3).astype('<f')
+    lCount = len(lDeltas)
+    lMoved = np.flatnonzero(np.any(lDeltas != 0, axis=1))
+    if len(lMoved) == lCount:
+        return CreateAttributeBuffer(lDeltas, 'f', 3)
+
+    lGLTFTarget = {
+        'componentType': GL_FLOAT,
+        'type': 'VEC3',
+        'count': lCount,
+        'min': np.minimum(lDeltas.min(axis=0), 0).tolist() if lCount > 0 else [0, 0, 0],
+        'max': np.maximum(lDeltas.max(axis=0), 0).tolist() if lCount > 0 else [0, 0, 0]
+    }
+    if len(lMoved) > 0:
+        if lCount <= 0xff:
+            lIndicesType = 'B'
+        elif lCount <= 0xffff:
+            lIndicesType = 'H'
+        else:
+            lIndicesType = 'I'
+        if len(lMoved) * (struct.calcsize(lIndicesType) + 12) >= lCount * 12:
+            return CreateAttributeBuffer(lDeltas, 'f', 3)
+        # https://github.com/KhronosGroup/glTF/tree/master/specification/2.0#sparse-accessors
+        lGLTFIndices = {'componentType': _componentTypes[lIndicesType]}
+        lGLTFValues = {}
+        appendToBuffer(lIndicesType, sparseBuffer, lMoved.astype('<' + lIndicesType).tobytes(), lGLTFIndices)
+        appendToBuffer('f', sparseBuffer, lDeltas[lMoved].tobytes(), lGLTFValues)
+        lib_sparse_accessors.append(lGLTFIndices)
+        lib_sparse_accessors.append(lGLTFValues)
+        lGLTFTarget['sparse'] = {
+            'count': len(lMoved),
+            'indices': lGLTFIndices,
+            'values': lGLTFValues
+        }
+
+    idx = len(lib_accessors)
+    lib_accessors.append(lGLTFTarget)
+    return idx
+
 
+_imageIdxMap = {}
 def CreateImage(pPath):
-    lImageIndices = [idx for idx in range(len(lib_images)) if lib_images[idx]['uri'] == pPath]
-    if len(lImageIndices):
-        return lImageIndices[0]
+    if pPath in _imageIdxMap:
+        return _imageIdxMap[pPath]
 
     lImageIdx = len(lib_images)
+    _imageIdxMap[pPath] = lImageIdx
     lib_images.append({
         'uri' : pPath
     })
@@ -350,7 +531,32 @@ def CreateSampler(pTexture):
         _samplerHashMap[lHashKey] = lSamplerIdx
         return lSamplerIdx
 
+def CreateRepeatSampler():
+    lHashKey = 'repeat'
+    if not lHashKey in _samplerHashMap:
+        _samplerHashMap[lHashKey] = len(lib_samplers)
+        lib_samplers.append({
+            'wrapS' : GL_REPEAT,
+            'wrapT' : GL_REPEAT,
+            'minFilter' : GL_LINEAR_MIPMAP_LINEAR,
+            'magFilter' : GL_LINEAR
+        })
+    return _samplerHashMap[lHashKey]
+
 _textureHashMap = {}
+def CreateImageTexture(pImageIdx, pSamplerIdx):
+    lHashKey = (pImageIdx, pSamplerIdx)
+    if not lHashKey in _textureHashMap:
+        _textureHashMap[lHashKey] = len(lib_textures)
+        lib_textures.append({
+            'format' : GL_RGBA,
+            'internalFormat' : GL_RGBA,
+            'sampler' : pSamplerIdx,
+            'source' : pImageIdx,
+            'target' : GL_TEXTURE_2D
+        })
+    return _textureHashMap[lHashKey]
+
 def CreateTexture(pProperty):
     lTextureList = []
 
@@ -390,27 +596,22 @@ def CreateTexture(pProperty):
 
         lImageIdx = CreateImage(lTextureFileName)
         lSamplerIdx = CreateSampler(lTexture)
-        lHashKey = (lImageIdx, lSamplerIdx)
-        if lHashKey in _textureHashMap:
-            lTextureList.append(_textureHashMap[lHashKey])
-        else:
-            lTextureIdx = len(lib_textures)
-            lib_textures.append({
-                'format' : GL_RGBA,
-                'internalFormat' : GL_RGBA,
-                'sampler' : lSamplerIdx,
-                'source' : lImageIdx,
-                'target' : GL_TEXTURE_2D
-            })
-            _textureHashMap[lHashKey] = lTextureIdx
-            lTextureList.append(lTextureIdx)
+        lTextureList.append(CreateImageTexture(lImageIdx, lSamplerIdx))
     # PENDING Return the first texture ?
     if len(lTextureList) > 0:
         return lTextureList[0], lScaleU, lScaleV, lTranslationU, lTranslationV
     else:
         return None, lScaleU, lScaleV, lTranslationU, lTranslationV
 
+# Materials converted by fbx material, primitives using the same fbx material share the glTF material.
+_materialHashMap = {}
 def ConvertToPBRMaterial(pMaterial):
+    lHashKey = pMaterial.GetUniqueID()
+    if not lHashKey in _materialHashMap:
+        _materialHashMap[lHashKey] = CreatePBRMaterial(pMaterial)
+    return _materialHashMap[lHashKey]
+
+def CreatePBRMaterial(pMaterial):
     lMaterialName = pMaterial.GetName()
     lShading = str(pMaterial.ShadingModel.Get()).lower()
 
@@ -478,13 +679,21 @@ def ConvertToPBRMaterial(pMaterial):
     return lMaterialIdx, lScaleU, lScaleV, lTranslationU, lTranslationV
 
 
-def CreateSkin():
+# Skins by joints and inverse bind matrices, meshes bound the same way to the same skeleton share their skin.
+_skinHashMap = {}
+def CreateSkin(pJoints, pIBM):
+    lIBM = np.asarray(pIBM, dtype=np.float32).reshape(-1, 16)
+    lHashKey = (tuple(pJoints), hashlib.sha1(lIBM.tobytes()).digest())
+    if lHashKey in _skinHashMap:
+        return _skinHashMap[lHashKey]
+
     lSkinIdx = len(lib_skins)
     # https://github.com/KhronosGroup/glTF/issues/100
     lib_skins.append({
-        'joints' : [],
+        'joints' : list(pJoints),
+        'inverseBindMatrices': CreateIBMBuffer(lIBM)
     })
-
+    _skinHashMap[lHashKey] = lSkinIdx
     return lSkinIdx
 
 _defaultMaterialName = 'DEFAULT_MAT_'
@@ -494,14 +703,11 @@ def CreateDefaultMaterial(pScene):
     return lMat
 
 def ProcessUV(uv, scaleU, scaleV, translationU, translationV):
-    for i in range(len(uv)):
-        uv[i] = [
-            uv[i][0] * scaleU + translationU,
-            uv[i][1] * scaleV + translationV
-        ]
-        if ENV_FLIP_V:
-            # glTF2.0 don't flipY. So flip the uv.
-            uv[i][1] = 1.0 - uv[i][1]
+    uv = uv * [scaleU, scaleV] + [translationU, translationV]
+    if ENV_FLIP_V:
+        # glTF2.0 don't flipY. So flip the uv.
+        uv[:, 1] = 1.0 - uv[:, 1]
+    return uv
 
 def GetSkinningData(pMesh, pSkin, pClusters, pNode):
     moreThanFourJoints = False
@@ -562,12 +768,15 @@ def GetSkinningData(pMesh, pSkin, pClusters, pNode):
 def CreatePrimitiveRaw(matIndex, useTexcoords1=False, scaleU=1, scaleV=1,translationU=0, translationV=1):
     return {
         "normals": [],
+        "tangents": [],
         "texcoords0": [],
         "texcoords1": [],
         "indices": [],
         "positions": [],
         "joints": [],
         "weights": [],
+        # Control point of each vertex, to map the blend shapes
+        "controlPoints": [],
         "material": matIndex,
         # Should use texcoord in layer2 if material is in layer2
         # PENDING
@@ -595,6 +804,56 @@ def GetVertexAttribute(pLayer, pControlPointIdx, pPolygonVertexIndex):
         pass
         # Unknown
 
+def GetLayerElementIndices(pLayerElement, pCount):
+    lIndexArray = pLayerElement.GetIndexArray()
+    return np.fromiter((lIndexArray.GetAt(k) for k in range(pCount)), dtype=np.int32, count=pCount)
+
+def GetPolygonMaterialIndices(pMesh, pSecondMaterialLayer):
+    lPolygonCount = pMesh.GetPolygonCount()
+    lMaterialIndices = np.full(lPolygonCount, -1, dtype=np.int32)
+    lIsMaterialInSecondLayer = {}
+    for i in range(pMesh.GetElementMaterialCount()):
+        lMaterialLayer = pMesh.GetElementMaterial(i)
+        lIsInSecondLayer = lMaterialLayer == pSecondMaterialLayer
+        if lMaterialLayer.GetMappingMode() == FbxLayerElement.eByPolygon:
+            lLayerIndices = GetLayerElementIndices(lMaterialLayer, lPolygonCount)
+            # index in top material layer will overwrite the bottom material layer
+            lMask = lLayerIndices >= 0
+            lMaterialIndices[lMask] = lLayerIndices[lMask]
+            for lIdx in np.unique(lLayerIndices).tolist():
+                lIsMaterialInSecondLayer[lIdx] = lIsInSecondLayer
+        elif lMaterialLayer.GetMappingMode() == FbxLayerElement.eAllSame:
+            lIdx = lMaterialLayer.GetIndexArray().GetAt(0)
+            if lIdx >= 0:
+                lMaterialIndices.fill(lIdx)
+            lIsMaterialInSecondLayer[lIdx] = lIsInSecondLayer
+
+    return lMaterialIndices, lIsMaterialInSecondLayer
+
+def GetBlendShapeChannels(pMesh):
+    lChannels = []
+    for i in range(pMesh.GetDeformerCount(FbxDeformer.eBlendShape)):
+        lBlendShape = pMesh.GetDeformer(i, FbxDeformer.eBlendShape)
+        for j in range(lBlendShape.GetBlendShapeChannelCount()):
+            lChannels.append((i, j, lBlendShape.GetBlendShapeChannel(j)))
+    return lChannels
+
+# Control point deltas of each blend shape channel
+def GetBlendShapeDeltas(pMesh):
+    lBase = ListToArray(pMesh.GetControlPoints(), 3).astype(np.float64)
+    lDeltas = []
+    for i, j, lChannel in GetBlendShapeChannels(pMesh):
+        lShapeCount = lChannel.GetTargetShapeCount()
+        lShape = None
+        if lShapeCount > 0:
+            # PENDING In-between shapes are not supported, use the shape of full weight
+            lShape = lChannel.GetTargetShape(lShapeCount - 1)
+        if lShape and lShape.GetControlPointsCount() == len(lBase):
+            lDeltas.append(ListToArray(lShape.GetControlPoints(), 3).astype(np.float64) - lBase)
+        else:
+            lDeltas.append(np.zeros_like(lBase))
+    return lDeltas
+
 def ConvertMesh(pScene, pMesh, pNode, pSkin, pClusters):
     lPrimitivesList = []
     lWeights = []
@@ -617,65 +876,30 @@ def ConvertMesh(pScene, pMesh, pNode, pSkin, pClusters):
         lJoints, lWeights = GetSkinningData(pMesh, pSkin, pClusters, pNode)
     lPositions = pMesh.GetControlPoints()
     # Prepare materials
-    lAllSameMaterial = True
-    lAllSameMaterialIndex = -1
-    for i in range(pMesh.GetElementMaterialCount()):
-        lMaterialLayer = pMesh.GetElementMaterial(i)
-        if not lMaterialLayer.GetMappingMode() == FbxLayerElement.eAllSame:
-            lIndexArray = lMaterialLayer.GetIndexArray()
-            for k in range(pMesh.GetPolygonCount()):
-                if not lIndexArray.GetAt(k) == lIndexArray.GetAt(0):
-                    lAllSameMaterial = False
-                    break
-
-        if lAllSameMaterial:
-            lAllSameMaterialIndex = lMaterialLayer.GetIndexArray().GetAt(0)
-
-    if lAllSameMaterial:
-        lMaterial = pNode.GetMaterial(lAllSameMaterialIndex)
+    lMaterialIndices, lIsMaterialInSecondLayer = GetPolygonMaterialIndices(pMesh, lSecondMaterialLayer)
+
+    # Group polygons by material with a stable sort so each primitive is a contiguous run of polygons.
+    # Primitives are kept in the order their material is first used.
+    lPolygonsOrder = np.argsort(lMaterialIndices, kind='mergesort')
+    lSortedMaterialIndices = lMaterialIndices[lPolygonsOrder]
+    lUsedMaterialIndices, lFirstUse = np.unique(lMaterialIndices, return_index=True)
+    lGroupStarts = np.searchsorted(lSortedMaterialIndices, lUsedMaterialIndices, 'left')
+    lGroupEnds = np.searchsorted(lSortedMaterialIndices, lUsedMaterialIndices, 'right')
+
+    lPrimitivesPolygons = []
+    for g in np.argsort(lFirstUse, kind='mergesort'):
+        lIdx = int(lUsedMaterialIndices[g])
+        lMaterial = pNode.GetMaterial(lIdx)
         if not lMaterial:
             lMaterial = CreateDefaultMaterial(pScene)
-
-        lTmpIndex, lScaleU, lScaleV, lTranslationU, lTranslationV = ConvertToPBRMaterial(lMaterial)
+        lGLTFMaterialIdx, lScaleU, lScaleV, lTranslationU, lTranslationV = ConvertToPBRMaterial(lMaterial)
         lPrimitivesList.append(CreatePrimitiveRaw(
-            lTmpIndex, False,
+            lGLTFMaterialIdx, lIsMaterialInSecondLayer.get(lIdx, False),
             lScaleU, lScaleV, lTranslationU, lTranslationV
         ))
-    else:
-        lMaterialIndices = [-1]*pMesh.GetPolygonCount()
-        lMaterialsPrimitivesMap = {}
-        lIsMaterialInSecondLayer = {}
-        for i in range(pMesh.GetElementMaterialCount()):
-            lMaterialLayer = pMesh.GetElementMaterial(i)
-            lIndexArray = lMaterialLayer.GetIndexArray()
-            lIsInSecondLayer = lMaterialLayer == lSecondMaterialLayer
-            if lMaterialLayer.GetMappingMode() == FbxLayerElement.eByPolygon:
-                for k in range(len(lMaterialIndices)):
-                    if lIndexArray.GetAt(k) >= 0:
-                        # index in top material layer will overwrite the bottom material layer
-                        lMaterialIndices[k] = lIndexArray.GetAt(k)
-                    lIsMaterialInSecondLayer[lIndexArray.GetAt(k)] = lIsInSecondLayer
-            elif lMaterialLayer.GetMappingMode() == FbxLayerElement.eAllSame:
-                lIdx = lIndexArray.GetAt(0)
-                if lIdx:
-                    if lIdx >= 0:
-                        for k in range(len(lMaterialIndices)):
-                            lMaterialIndices[k] = lIdx
-                lIsMaterialInSecondLayer[lIdx] = lIsInSecondLayer
-        for lIdx in lMaterialIndices:
-            if not lIdx in lMaterialsPrimitivesMap:
-                lMaterial = pNode.GetMaterial(lIdx)
-                if not lMaterial:
-                    lMaterial = CreateDefaultMaterial(pScene)
-                lGLTFMaterialIdx, lScaleU, lScaleV, lTranslationU, lTranslationV = ConvertToPBRMaterial(lMaterial)
-                lMaterialsPrimitivesMap[lIdx] = len(lPrimitivesList)
-                lPrimitivesList.append(CreatePrimitiveRaw(
-                    lGLTFMaterialIdx, lIsMaterialInSecondLayer[lIdx],
-                    lScaleU, lScaleV, lTranslationU, lTranslationV
-                ))
+        lPrimitivesPolygons.append(lPolygonsOrder[lGroupStarts[g]:lGroupEnds[g]].tolist())
 
     range3 = range(3)
-    lVertexCount = 0
 
     lNeedHash = False
     if lNormalLayer:
@@ -688,103 +912,348 @@ def ConvertMesh(pScene, pMesh, pNode, pSkin, pClusters):
         if lUv2Layer.GetMappingMode() == FbxLayerElement.eByPolygonVertex:
             lNeedHash = True
 
-    for i in range(pMesh.GetPolygonCount()):
-        if lAllSameMaterial:
-            lPrimitive = lPrimitivesList[0]
-        else:
-            lMaterialIndex = lMaterialIndices[i]
-            lPrimitive = lPrimitivesList[lMaterialsPrimitivesMap[lMaterialIndex]]
-        # Mesh should be triangulated
-        for j in range3:
-            lControlPointIndex = pMesh.GetPolygonVertex(i, j)
-            if lNeedHash:
-                vertexKeyList = []
-                vertexKeyList += lPositions[lControlPointIndex]
-            if lNormalLayer:
-                lNormal = GetVertexAttribute(lNormalLayer, lControlPointIndex, lVertexCount)
-                if lNeedHash:
-                    vertexKeyList += lNormal
-            if lUvLayer:
-                # PENDING GetTextureUVIndex?
-                lUv = GetVertexAttribute(lUvLayer, lControlPointIndex, lVertexCount)
+    for lPrimitive, lPolygons in zip(lPrimitivesList, lPrimitivesPolygons):
+        for i in lPolygons:
+            # Mesh should be triangulated
+            lVertexCount = i * 3
+            for j in range3:
+                lControlPointIndex = pMesh.GetPolygonVertex(i, j)
                 if lNeedHash:
-                    vertexKeyList += lUv
-            if lUv2Layer:
-                lUv2 = GetVertexAttribute(lUv2Layer, lControlPointIndex, lVertexCount)
-                if lNeedHash:
-                    vertexKeyList += lUv2
-
-            lVertexCount += 1
-
-            if lNeedHash:
-                vertexKey = tuple(vertexKeyList)
-            else:
-                vertexKey = lControlPointIndex
-
-            if not vertexKey in lPrimitive['indicesMap']:
-                lIndex = len(lPrimitive['positions'])
-                lPrimitive['positions'].append(lPositions[lControlPointIndex])
+                    vertexKeyList = []
+                    vertexKeyList += lPositions[lControlPointIndex]
                 if lNormalLayer:
-                    lPrimitive['normals'].append(lNormal)
-                # PENDING
-                if lPrimitive['useTexcoords1']:
-                    if lUv2Layer:
-                        lPrimitive['texcoords0'].append(lUv2)
+                    lNormal = GetVertexAttribute(lNormalLayer, lControlPointIndex, lVertexCount)
+                    if lNeedHash:
+                        vertexKeyList += lNormal
+                if lUvLayer:
+                    # PENDING GetTextureUVIndex?
+                    lUv = GetVertexAttribute(lUvLayer, lControlPointIndex, lVertexCount)
+                    if lNeedHash:
+                        vertexKeyList += lUv
+                if lUv2Layer:
+                    lUv2 = GetVertexAttribute(lUv2Layer, lControlPointIndex, lVertexCount)
+                    if lNeedHash:
+                        vertexKeyList += lUv2
+
+                lVertexCount += 1
+
+                if lNeedHash:
+                    vertexKey = tuple(vertexKeyList)
+                else:
+                    vertexKey = lControlPointIndex
+
+                if not vertexKey in lPrimitive['indicesMap']:
+                    lIndex = len(lPrimitive['positions'])
+                    lPrimitive['positions'].append(lPositions[lControlPointIndex])
+                    lPrimitive['controlPoints'].append(lControlPointIndex)
+                    if lNormalLayer:
+                        lPrimitive['normals'].append(lNormal)
+                    # PENDING
+                    if lPrimitive['useTexcoords1']:
+                        if lUv2Layer:
+                            lPrimitive['texcoords0'].append(lUv2)
+                        else:
+                            lPrimitive['texcoords0'].append(lUv)
                     else:
-                        lPrimitive['texcoords0'].append(lUv)
+                        if lUvLayer:
+                            lPrimitive['texcoords0'].append(lUv)
+                        if lUv2Layer:
+                            lPrimitive['texcoords1'].append(lUv2)
+                    if hasSkin:
+                        lPrimitive['joints'].append(lJoints[lControlPointIndex])
+                        lPrimitive['weights'].append(lWeights[lControlPointIndex])
+
+                    lPrimitive['indicesMap'][vertexKey] = lIndex
                 else:
-                    if lUvLayer:
-                        lPrimitive['texcoords0'].append(lUv)
-                    if lUv2Layer:
-                        lPrimitive['texcoords1'].append(lUv2)
-                if hasSkin:
-                    lPrimitive['joints'].append(lJoints[lControlPointIndex])
-                    lPrimitive['weights'].append(lWeights[lControlPointIndex])
-
-                lPrimitive['indicesMap'][vertexKey] = lIndex
-            else:
-                lIndex = lPrimitive['indicesMap'][vertexKey]
-
-            lPrimitive['indices'].append(lIndex)
-
-
+                    lIndex = lPrimitive['indicesMap'][vertexKey]
+
+                lPrimitive['indices'].append(lIndex)
+
+
+    lBlendShapeDeltas = GetBlendShapeDeltas(pMesh)
+    for lPrimitive in lPrimitivesList:
+        PrimitiveRawToArrays(lPrimitive)
+        lControlPoints = lPrimitive.pop('controlPoints')
+        lPrimitive['targets'] = [lDeltas[lControlPoints] for lDeltas in lBlendShapeDeltas]
+        ProcessPrimitive(lPrimitive)
+
+    return lPrimitivesList
+
+def PrimitiveRawToArrays(pPrimitive):
+    del pPrimitive['indicesMap']
+    pPrimitive['positions'] = ListToArray(pPrimitive['positions'], 3).astype(np.float64)
+    pPrimitive['normals'] = ListToArray(pPrimitive['normals'], 3).astype(np.float64)
+    pPrimitive['tangents'] = ListToArray(pPrimitive['tangents'], 4).astype(np.float64)
+    pPrimitive['texcoords0'] = ListToArray(pPrimitive['texcoords0'], 2).astype(np.float64)
+    pPrimitive['texcoords1'] = ListToArray(pPrimitive['texcoords1'], 2).astype(np.float64)
+    pPrimitive['joints'] = ListToArray(pPrimitive['joints'], 4).astype(np.uint16)
+    pPrimitive['weights'] = ListToArray(pPrimitive['weights'], 4).astype(np.float64)
+    pPrimitive['indices'] = np.array(pPrimitive['indices'], dtype=np.uint32)
+    pPrimitive['controlPoints'] = np.array(pPrimitive['controlPoints'], dtype=np.int64)
+
+_vertexAttributeKeys = ['positions', 'normals', 'tangents', 'texcoords0', 'texcoords1', 'joints', 'weights']
+
+def RemapPrimitiveVertices(pPrimitive, pRemap):
+    lOrder = np.argsort(pRemap)
+    for lKey in _vertexAttributeKeys:
+        if len(pPrimitive[lKey]) > 0:
+            pPrimitive[lKey] = pPrimitive[lKey][lOrder]
+    pPrimitive['targets'] = [lDeltas[lOrder] for lDeltas in pPrimitive['targets']]
+    pPrimitive['indices'] = pRemap[pPrimitive['indices']].astype(np.uint32)
+
+def OptimizePrimitiveVertexCache(pPrimitive):
+    lVertexCount = len(pPrimitive['positions'])
+    lACMR = meshopt.ComputeACMR(pPrimitive['indices'])
+    pPrimitive['indices'] = meshopt.OptimizeVertexCache(pPrimitive['indices'], lVertexCount)
+    RemapPrimitiveVertices(pPrimitive, meshopt.OptimizeVertexFetchRemap(pPrimitive['indices'], lVertexCount))
+    print('Vertex cache ACMR %.3f -> %.3f, %d triangles' % (lACMR, meshopt.ComputeACMR(pPrimitive['indices']), len(pPrimitive['indices']) // 3))
+
+def GetSkinCollapsePenalty(pPrimitive):
+    # Extra collapse cost for vertices bound differently, a full weight difference costs
+    # as much as moving the vertex by a tenth of the primitive size.
+    if len(pPrimitive['joints']) == 0:
+        return None
+    lPositions = pPrimitive['positions']
+    lScale = (0.1 * np.linalg.norm(lPositions.max(axis=0) - lPositions.min(axis=0))) ** 2
+    # Weights of a joint listed several times by a vertex are summed on its first slot
+    lJoints = pPrimitive['joints'].astype(np.int64)
+    lWeights = pPrimitive['weights'].astype(np.float64)
+    for i in range(1, 4):
+        for j in range(i):
+            lSame = lJoints[:, i] == lJoints[:, j]
+            lWeights[lSame, j] += lWeights[lSame, i]
+            lWeights[lSame, i] = 0
+            lJoints[lSame, i] = -1
+    def CollapsePenalty(pFrom, pTo):
+        # Half the L1 distance between the joint weights of the vertices, for arrays of vertices
+        lMatches = lJoints[pFrom][:, :, None] == lJoints[pTo][:, None, :]
+        lToWeights = lWeights[pTo]
+        lMatched = (lMatches * lToWeights[:, None, :]).sum(axis=2)
+        lDifference = np.abs(lWeights[pFrom] - lMatched).sum(axis=1) + (lToWeights * ~lMatches.any(axis=1)).sum(axis=1)
+        return lScale * lDifference / 2
+    return CollapsePenalty
+
+def SimplifyPrimitive(pPrimitive, pRatio):
+    lTriangleCount = len(pPrimitive['indices']) // 3
+    # Vertices split only by normals or tangents are moved together, texcoords seams are kept
+    lSeamAttributes = [pPrimitive[lKey] for lKey in ('texcoords0', 'texcoords1') if len(pPrimitive[lKey]) > 0]
+    lIndices = meshopt.SimplifyMesh(
+        pPrimitive['positions'], pPrimitive['indices'],
+        int(lTriangleCount * pRatio), GetSkinCollapsePenalty(pPrimitive), lSeamAttributes
+    )
+    print('Simplified primitive from %d to %d triangles' % (lTriangleCount, len(lIndices) // 3))
+    return SubsetPrimitive(pPrimitive, lIndices)
+
+# Lower detail meshes of the primitives at each of ENV_LOD_RATIOS
+def CreateMeshLODs(pMeshName, pPrimitivesList, pDequantization=None):
+    lLODMeshes = []
+    for i in range(len(ENV_LOD_RATIOS)):
+        lLODPrimitives = []
+        for lPrimitive in pPrimitivesList:
+            lLODPrimitive = SimplifyPrimitive(lPrimitive, ENV_LOD_RATIOS[i])
+            if ENV_OPTIMIZE_VERTEX_CACHE:
+                OptimizePrimitiveVertexCache(lLODPrimitive)
+            lLODPrimitives.append(lLODPrimitive)
+        lLODMeshes.append(len(lib_meshes))
+        lib_meshes.append({
+            'name': pMeshName + '_LOD%d' % (i + 1),
+            'primitives': CreateMeshPrimitives(lLODPrimitives, pDequantization)
+        })
+    return lLODMeshes
+
+def GeneratePrimitiveNormals(pPrimitive):
+    lVertexCount = len(pPrimitive['positions'])
+    lVertices, lNormals, lIndices = meshgen.GenerateNormals(pPrimitive['positions'], pPrimitive['indices'], math.radians(ENV_CREASE_ANGLE))
+    pPrimitive.update(RemapPrimitive(pPrimitive, lVertices, lIndices))
+    pPrimitive['normals'] = lNormals
+    print('Generated normals of %d vertices, %d after splitting creases' % (lVertexCount, len(lVertices)))
+
+def GeneratePrimitiveTangents(pPrimitive):
+    # Tangents follow the texcoords as they are written to the glTF
+    lTexcoords = ProcessUV(
+        pPrimitive['texcoords0'],
+        pPrimitive['scaleU'], pPrimitive['scaleV'],
+        pPrimitive['translationU'], pPrimitive['translationV']
+    )
+    lVertexCount = len(pPrimitive['positions'])
+    lVertices, lTangents, lIndices = meshgen.GenerateTangents(pPrimitive['positions'], pPrimitive['normals'], lTexcoords, pPrimitive['indices'])
+    pPrimitive.update(RemapPrimitive(pPrimitive, lVertices, lIndices))
+    pPrimitive['tangents'] = lTangents
+    print('Generated tangents of %d vertices, %d after splitting mirrored UVs' % (lVertexCount, len(lVertices)))
+
+def IsNormalMapped(pPrimitive):
+    lGLTFMaterial = lib_materials[pPrimitive['material']]
+    return 'normalTexture' in lGLTFMaterial and lGLTFMaterial['normalTexture'].get('texCoord', 0) == 0
+
+# Optional processing stages on the arrays of a primitive before its buffers are created
+def ProcessPrimitive(pPrimitive):
+    if ENV_SIMPLIFY_RATIO < 1:
+        pPrimitive.update(SimplifyPrimitive(pPrimitive, ENV_SIMPLIFY_RATIO))
+    lNeedTangents = ENV_GENERATE_TANGENTS and len(pPrimitive['tangents']) == 0 \
+        and len(pPrimitive['texcoords0']) > 0 and IsNormalMapped(pPrimitive)
+    # glTF tangents are only valid with normals
+    if len(pPrimitive['normals']) == 0 and (ENV_GENERATE_NORMALS or lNeedTangents):
+        GeneratePrimitiveNormals(pPrimitive)
+    if lNeedTangents:
+        GeneratePrimitiveTangents(pPrimitive)
+    if ENV_OPTIMIZE_VERTEX_CACHE:
+        OptimizePrimitiveVertexCache(pPrimitive)
+
+# Positions of a mesh are quantized to int16 in a box shared by all its primitives.
+# Uniform scale so normals are not skewed by the dequantization transform.
+def GetPositionDequantization(pPrimitivesList):
+    lPositions = [lPrimitive['positions'] for lPrimitive in pPrimitivesList if len(lPrimitive['positions']) > 0]
+    if len(lPositions) == 0:
+        return None
+    lMin = np.min([p.min(axis=0) for p in lPositions], axis=0)
+    lMax = np.max([p.max(axis=0) for p in lPositions], axis=0)
+    lBits = GetQuantizeBits('POSITION')
+    lHalfLevels = (1 << (lBits - 1)) - 1
+    lScale = float((lMax - lMin).max()) / 2 / lHalfLevels
+    if lScale == 0:
+        lScale = 1.0
+    return (lMin + lMax) / 2, lScale, lBits
+
+# Transform applied to the quantized positions, in the same layout as ListFromM4
+def DequantizationMatrix(pDequantization):
+    lOffset, lScale, lBits = pDequantization
+    lMatrix = np.identity(4)
+    lMatrix[[0, 1, 2], [0, 1, 2]] = lScale
+    lMatrix[3, :3] = lOffset
+    return lMatrix
+
+def QuantizeNormalized(pArray, pType):
+    lLevels = np.iinfo(np.dtype(pType)).max
+    lQuantized = np.rint(np.clip(pArray, -1, 1) * lLevels).astype(pType)
+    lError = 0.0
+    if len(pArray) > 0:
+        lError = float(np.abs(lQuantized / float(lLevels) - pArray).max())
+    return lQuantized, lError
+
+def CreateMeshQuantizedAttributeBuffer(pArray, pSemantic, pDequantization=None, pInterleaved=None):
+    # https://github.com/KhronosGroup/glTF/tree/master/extensions/2.0/Khronos/KHR_mesh_quantization
+    lStride = pArray.shape[1]
+    if pSemantic == 'POSITION':
+        lOffset, lScale, lBits = pDequantization
+        lHalfLevels = (1 << (lBits - 1)) - 1
+        lQuantized = np.clip(np.rint((pArray - lOffset) / lScale), -lHalfLevels, lHalfLevels).astype(np.int16)
+        lError = 0.0
+        if len(pArray) > 0:
+            lError = float(np.abs(lQuantized * lScale + lOffset - pArray).max())
+        lIdx = CreateAttributeBuffer(lQuantized, 'h', lStride, pSemantic, False, pInterleaved)
+    elif pSemantic in ('NORMAL', 'TANGENT'):
+        lBits = 8
+        lQuantized, lError = QuantizeNormalized(pArray, 'b')
+        lIdx = CreateAttributeBuffer(lQuantized, 'b', lStride, pSemantic, True, pInterleaved)
+    else:
+        # Texcoords out of [-1, 1] would need KHR_texture_transform, keep them in float
+        lBits = 16
+        if len(pArray) == 0 or pArray.min() < -1 or pArray.max() > 1:
+            return CreateAttributeBuffer(pArray, 'f', lStride, pSemantic, False, pInterleaved)
+        if pArray.min() >= 0:
+            lQuantized = np.rint(pArray * 65535).astype(np.uint16)
+            lError = float(np.abs(lQuantized / 65535.0 - pArray).max())
+            lIdx = CreateAttributeBuffer(lQuantized, 'H', lStride, pSemantic, True, pInterleaved)
+        else:
+            lQuantized, lError = QuantizeNormalized(pArray, 'h')
+            lIdx = CreateAttributeBuffer(lQuantized, 'h', lStride, pSemantic, True, pInterleaved)
+
+    UseExtension('KHR_mesh_quantization', True)
+    ReportQuantizationError(lIdx, pSemantic, lBits, lError)
+    return lIdx
+
+# Smallest index type of a primitive. The max value of each type is reserved for primitive restart.
+def GetIndicesType(pVertexCount):
+    if pVertexCount <= 0xff:
+        return 'B'
+    elif pVertexCount <= 0xffff:
+        return 'H'
+    return 'I'
+
+def RemapPrimitive(pPrimitive, pVertices, pIndices):
+    # Primitive of the vertices pVertices of pPrimitive, which can be repeated, indexed by pIndices
+    lPrimitive = dict(pPrimitive)
+    for lKey in _vertexAttributeKeys:
+        if len(pPrimitive[lKey]) > 0:
+            lPrimitive[lKey] = pPrimitive[lKey][pVertices]
+    lPrimitive['targets'] = [lDeltas[pVertices] for lDeltas in pPrimitive['targets']]
+    lPrimitive['indices'] = pIndices.astype(np.uint32)
+    return lPrimitive
+
+def SubsetPrimitive(pPrimitive, pIndices):
+    # Primitive of the vertices used by pIndices, in their original order
+    lVertices, lIndices = np.unique(pIndices, return_inverse=True)
+    return RemapPrimitive(pPrimitive, lVertices, lIndices)
+
+def SplitPrimitive(pPrimitive):
+    # Split in primitives of at most 0xffff vertices, made of consecutive triangles so each part stays compact
+    lVertexCount = len(pPrimitive['positions'])
+    if lVertexCount <= 0xffff:
+        return [pPrimitive]
+    lTriangles = pPrimitive['indices'].reshape(-1, 3)
+    if not ENV_OPTIMIZE_VERTEX_CACHE:
+        # Triangles are in the fbx polygon order, sort them spatially.
+        # The vertex cache order already keeps neighbour triangles together.
+        lTriangles = lTriangles[meshopt.MortonOrder(pPrimitive['positions'][lTriangles].mean(axis=1))]
+    lIndices = lTriangles.reshape(-1)
+    lPrimitives = []
+    for lStart, lEnd in meshopt.SplitIndices(lIndices, 0xffff):
+        lPrimitives.append(SubsetPrimitive(pPrimitive, lIndices[lStart * 3:lEnd * 3]))
+    print('Split primitive of %d vertices in %d primitives with 16 bits indices' % (lVertexCount, len(lPrimitives)))
+    return lPrimitives
+
+def CreateMeshPrimitives(pPrimitivesList, pDequantization=None):
+    if ENV_SPLIT_INDICES:
+        pPrimitivesList = [lPart for lPrimitive in pPrimitivesList for lPart in SplitPrimitive(lPrimitive)]
     lGLTFPrimitivesList = []
-    for i in range(len(lPrimitivesList)):
-        lPrimitive = lPrimitivesList[i]
-        lGLTFPrimitive = {
-            'attributes': {
-                'POSITION': CreateAttributeBuffer(lPrimitive['positions'], 'f', 3)
-            },
-            "material": lPrimitive['material']
-        }
+    for lPrimitive in pPrimitivesList:
+        lAttributes = {}
+        lInterleaved = None
+        if ENV_INTERLEAVE:
+            lInterleaved = []
+        if pDequantization:
+            lAttributes['POSITION'] = CreateMeshQuantizedAttributeBuffer(lPrimitive['positions'], 'POSITION', pDequantization, lInterleaved)
+        else:
+            lAttributes['POSITION'] = CreateAttributeBuffer(lPrimitive['positions'], 'f', 3, 'POSITION', False, lInterleaved)
         if len(lPrimitive['normals']) > 0:
-            lGLTFPrimitive['attributes']['NORMAL'] = CreateAttributeBuffer(lPrimitive['normals'], 'f', 3)
-        if len(lPrimitive['texcoords0']) > 0:
-            ProcessUV(
-                lPrimitive['texcoords0'],
-                lPrimitive['scaleU'], lPrimitive['scaleV'],
-                lPrimitive['translationU'], lPrimitive['translationV']
-            )
-            lGLTFPrimitive['attributes']['TEXCOORD_0'] = CreateAttributeBuffer(lPrimitive['texcoords0'], 'f', 2)
-        if len(lPrimitive['texcoords1']) > 0:
-            ProcessUV(
-                lPrimitive['texcoords1'],
-                lPrimitive['scaleU'], lPrimitive['scaleV'],
-                lPrimitive['translationU'], lPrimitive['translationV']
-            )
-            lGLTFPrimitive['attributes']['TEXCOORD_1'] = CreateAttributeBuffer(lPrimitive['texcoords1'], 'f', 2)
+            if ENV_MESH_QUANTIZATION:
+                lAttributes['NORMAL'] = CreateMeshQuantizedAttributeBuffer(lPrimitive['normals'], 'NORMAL', None, lInterleaved)
+            else:
+                lAttributes['NORMAL'] = CreateAttributeBuffer(lPrimitive['normals'], 'f', 3, 'NORMAL', False, lInterleaved)
+        if len(lPrimitive['tangents']) > 0:
+            if ENV_MESH_QUANTIZATION:
+                lAttributes['TANGENT'] = CreateMeshQuantizedAttributeBuffer(lPrimitive['tangents'], 'TANGENT', None, lInterleaved)
+            else:
+                lAttributes['TANGENT'] = CreateAttributeBuffer(lPrimitive['tangents'], 'f', 4, 'TANGENT', False, lInterleaved)
+        for lSemantic, lKey in (('TEXCOORD_0', 'texcoords0'), ('TEXCOORD_1', 'texcoords1')):
+            if len(lPrimitive[lKey]) > 0:
+                lTexcoord = ProcessUV(
+                    lPrimitive[lKey],
+                    lPrimitive['scaleU'], lPrimitive['scaleV'],
+                    lPrimitive['translationU'], lPrimitive['translationV']
+                )
+                if ENV_MESH_QUANTIZATION:
+                    lAttributes[lSemantic] = CreateMeshQuantizedAttributeBuffer(lTexcoord, lSemantic, None, lInterleaved)
+                else:
+                    lAttributes[lSemantic] = CreateAttributeBuffer(lTexcoord, 'f', 2, lSemantic, False, lInterleaved)
         if len(lPrimitive['joints']) > 0:
             # PENDING UNSIGNED_SHORT will have bug.
-            lGLTFPrimitive['attributes']['JOINTS_0'] = CreateAttributeBuffer(lPrimitive['joints'], 'H', 4)
+            lAttributes['JOINTS_0'] = CreateAttributeBuffer(lPrimitive['joints'], 'H', 4, 'JOINTS_0', False, lInterleaved)
             # TODO Seems most engines needs VEC4 weights.
-            lGLTFPrimitive['attributes']['WEIGHTS_0'] = CreateAttributeBuffer(lPrimitive['weights'], 'f', 4)
+            lAttributes['WEIGHTS_0'] = CreateAttributeBuffer(lPrimitive['weights'], 'f', 4, 'WEIGHTS_0', False, lInterleaved)
+        if lInterleaved:
+            CreateInterleavedBuffer(lInterleaved)
 
-        if len(lPrimitive['positions']) >= 0xffff:
-            #Use unsigned int in element indices
-            lIndicesType = 'I'
-        else:
-            lIndicesType = 'H'
-        lGLTFPrimitive['indices'] = CreateIndicesBuffer(lPrimitive['indices'], lIndicesType)
+        lGLTFPrimitive = {
+            'attributes': lAttributes,
+            "material": lPrimitive['material']
+        }
+        if len(lPrimitive['targets']) > 0:
+            # Deltas are added to the quantized positions before dequantization
+            lDeltaScale = pDequantization[1] if pDequantization else 1.0
+            lGLTFPrimitive['targets'] = [{'POSITION': CreateMorphTargetBuffer(lDeltas / lDeltaScale)} for lDeltas in lPrimitive['targets']]
+
+        lGLTFPrimitive['indices'] = CreateIndicesBuffer(lPrimitive['indices'], GetIndicesType(len(lPrimitive['positions'])))
 
         lGLTFPrimitivesList.append(lGLTFPrimitive)
 
@@ -814,6 +1283,78 @@ def ConvertCamera(pCamera):
     lib_cameras.append(lGLTFCamera)
     return lCameraIdx
 
+# Nodes holding quantized meshes or mesh LODs, appended after all the fbx nodes to keep node indices.
+# [parent node or None if the mesh node is already in the tree, mesh node, LOD mesh indices]
+_meshNodes = []
+
+# Primitives of the meshes whose buffers are created after batching, by mesh index
+_deferredMeshes = {}
+
+# Deferred primitives are kept until the end of the conversion, their arrays are memory mapped above the memory budget
+def SpillPrimitives(pPrimitivesList):
+    if not spillbuffer.HasBudget():
+        return pPrimitivesList
+    lPrimitivesList = []
+    for lPrimitive in pPrimitivesList:
+        lPrimitive = dict(lPrimitive)
+        for lKey in _vertexAttributeKeys + ['indices']:
+            lPrimitive[lKey] = spillbuffer.SpillArray(lPrimitive[lKey])
+        lPrimitive['targets'] = [spillbuffer.SpillArray(lDeltas) for lDeltas in lPrimitive['targets']]
+        lPrimitivesList.append(lPrimitive)
+    return lPrimitivesList
+
+# Converted meshes by geometry and material bindings, nodes instancing the same geometry share one glTF mesh.
+_meshInstanceMap = {}
+
+def GetMeshInstanceKey(pNode):
+    lGeometryIds = []
+    for i in range(pNode.GetNodeAttributeCount()):
+        lNodeAttribute = pNode.GetNodeAttributeByIndex(i)
+        if lNodeAttribute.GetAttributeType() == FbxNodeAttribute.eMesh:
+            lGeometryIds.append(lNodeAttribute.GetUniqueID())
+    lMaterialIds = []
+    for i in range(pNode.GetMaterialCount()):
+        lMaterial = pNode.GetMaterial(i)
+        lMaterialIds.append(lMaterial.GetUniqueID() if lMaterial else -1)
+    return (tuple(lGeometryIds), tuple(lMaterialIds))
+
+def SetNodeMesh(pGLTFNode, pNodeName, pMeshIdx, pDequantization, pLODMeshes=[]):
+    if pDequantization or len(pLODMeshes) > 0:
+        # Dequantization transform can't go in this node or its children would be scaled too.
+        # LOD nodes replace their base node, so the base node can't have children.
+        lGLTFMeshNode = {
+            'name': pNodeName,
+            'mesh': pMeshIdx
+        }
+        if pDequantization:
+            lGLTFMeshNode['matrix'] = DequantizationMatrix(pDequantization).ravel().tolist()
+        _meshNodes.append((pGLTFNode, lGLTFMeshNode, pLODMeshes))
+    else:
+        pGLTFNode['mesh'] = pMeshIdx
+
+def AppendMeshNodes():
+    for lGLTFNode, lGLTFMeshNode, lLODMeshes in _meshNodes:
+        if lGLTFNode is not None:
+            lGLTFNode.setdefault('children', []).append(len(lib_nodes))
+            lib_nodes.append(lGLTFMeshNode)
+        if len(lLODMeshes) == 0:
+            continue
+        # https://github.com/KhronosGroup/glTF/tree/master/extensions/2.0/Vendor/MSFT_lod
+        lLODNodes = []
+        for i in range(len(lLODMeshes)):
+            lGLTFLODNode = {
+                'name': lGLTFMeshNode['name'] + '_LOD%d' % (i + 1),
+                'mesh': lLODMeshes[i]
+            }
+            for lKey in ('matrix', 'skin'):
+                if lKey in lGLTFMeshNode:
+                    lGLTFLODNode[lKey] = lGLTFMeshNode[lKey]
+            lLODNodes.append(len(lib_nodes))
+            lib_nodes.append(lGLTFLODNode)
+        lGLTFMeshNode['extensions'] = {'MSFT_lod': {'ids': lLODNodes}}
+        UseExtension('MSFT_lod')
+    del _meshNodes[:]
+
 def ConvertSceneNode(pScene, pNode, pPoseTime):
     lGLTFNode = {}
     lNodeName = pNode.GetName()
@@ -825,7 +1366,6 @@ def ConvertSceneNode(pScene, pNode, pPoseTime):
     lGLTFNode['matrix'] = ListFromM4(pNode.EvaluateLocalTransform(pPoseTime, FbxNode.eDestinationPivot))
 
     #PENDING : Triangulate and split all geometry not only the default one ?
-    #PENDING : Multiple node use the same mesh ?
     lMesh = pNode.GetMesh()
     # PENDING If invisible node will have all children invisible.
     if pNode.GetVisibility() and lMesh:
@@ -842,26 +1382,71 @@ def ConvertSceneNode(pScene, pNode, pPoseTime):
         lGLTFSkin = None
         lClusters = {}
 
-        if lHasSkin:
-            lSkinIdx = CreateSkin()
-            lGLTFSkin = lib_skins[lSkinIdx]
-            lGLTFNode['skin'] = lSkinIdx
+        # Skinned meshes are not shared, joint indices of their vertices depend on the skin of the node.
+        lInstanceKey = None
+        if not lHasSkin:
+            lInstanceKey = GetMeshInstanceKey(pNode)
 
-        if lMesh.GetLayer(0):
+        if lHasSkin:
+            # Joints are collected while converting the mesh, the skin is created when its bind matrices are known.
+            lGLTFSkin = {'joints': []}
+
+        lDequantization = None
+        lLODMeshes = []
+        if lInstanceKey in _meshInstanceMap:
+            lMeshIdx, lDequantization, lLODMeshes = _meshInstanceMap[lInstanceKey]
+            SetNodeMesh(lGLTFNode, lNodeName, lMeshIdx, lDequantization, lLODMeshes)
+        elif lMesh.GetLayer(0):
+            lPrimitivesList = []
+            lMorphChannels = []
             for i in range(pNode.GetNodeAttributeCount()):
                 lNodeAttribute = pNode.GetNodeAttributeByIndex(i)
                 if lNodeAttribute.GetAttributeType() == FbxNodeAttribute.eMesh:
-                    lGLTFMesh['primitives'] += ConvertMesh(pScene, lNodeAttribute, pNode, lGLTFSkin, lClusters)
-
-            lMeshIdx = len(lib_meshes)
-            lib_meshes.append(lGLTFMesh)
-            lGLTFNode['mesh'] = lMeshIdx
+                    lAttributePrimitives = ConvertMesh(pScene, lNodeAttribute, pNode, lGLTFSkin, lClusters)
+                    # Targets of all the primitives of a mesh are the blend shape channels of all its mesh attributes
+                    for lPrimitive in lAttributePrimitives:
+                        lZeros = np.zeros_like(lPrimitive['positions'])
+                        lPrimitive['targets'] = [lZeros] * len(lMorphChannels) + lPrimitive['targets']
+                    for lPrimitive in lPrimitivesList:
+                        lZeros = np.zeros_like(lPrimitive['positions'])
+                        lPrimitive['targets'] += [lZeros] * len(GetBlendShapeChannels(lNodeAttribute))
+                    lPrimitivesList += lAttributePrimitives
+                    lMorphChannels += [lChannel for i, j, lChannel in GetBlendShapeChannels(lNodeAttribute)]
+
+            if len(lMorphChannels) > 0:
+                lGLTFMesh['weights'] = [lChannel.DeformPercent.Get() / 100.0 for lChannel in lMorphChannels]
+                lGLTFMesh['extras'] = {'targetNames': [lChannel.GetName() for lChannel in lMorphChannels]}
+
+            # Static meshes are batched after the animations are known, their buffers are created then.
+            lDeferred = ENV_BATCH_STATIC_MESHES and not lHasSkin and len(lMorphChannels) == 0
+            if not lDeferred:
+                # Morph weights are animated on the node of the fbx mesh, it can't move to a dequantization node
+                if ENV_MESH_QUANTIZATION and (lHasSkin or len(lMorphChannels) == 0):
+                    lDequantization = GetPositionDequantization(lPrimitivesList)
+                lGLTFMesh['primitives'] = CreateMeshPrimitives(lPrimitivesList, lDequantization)
+                # Weights of morphed meshes are animated on their fbx node, and LOD nodes replace a skinned node with its children
+                if len(lMorphChannels) == 0 and (not lHasSkin or pNode.GetChildCount() == 0):
+                    lLODMeshes = CreateMeshLODs(lMeshName, lPrimitivesList, lDequantization)
+
+            # Mesh without any polygon
+            if len(lPrimitivesList) > 0:
+                lMeshIdx = len(lib_meshes)
+                lib_meshes.append(lGLTFMesh)
+                if lHasSkin:
+                    lGLTFNode['mesh'] = lMeshIdx
+                    if len(lLODMeshes) > 0:
+                        _meshNodes.append((None, lGLTFNode, lLODMeshes))
+                else:
+                    if lDeferred:
+                        _deferredMeshes[lMeshIdx] = SpillPrimitives(lPrimitivesList)
+                    SetNodeMesh(lGLTFNode, lNodeName, lMeshIdx, lDequantization, lLODMeshes)
+                    _meshInstanceMap[lInstanceKey] = (lMeshIdx, lDequantization, lLODMeshes)
 
         if lHasSkin:
             lClusterGlobalInitMatrix = FbxAMatrix()
             lReferenceGlobalInitMatrix = FbxAMatrix()
 
-            lIBM = []
+            lIBM = np.empty((len(lGLTFSkin['joints']), 16))
             for i in range(len(lGLTFSkin['joints'])):
                 lJointIdx = lGLTFSkin['joints'][i]
                 lCluster = lClusters[lJointIdx]
@@ -874,9 +1459,12 @@ def ConvertSceneNode(pScene, pNode, pPoseTime):
                 # http://blog.csdn.net/bugrunner/article/details/7232291
                 # http://help.autodesk.com/view/FBX/2017/ENU/?guid=__cpp_ref__view_scene_2_draw_scene_8cxx_example_html
                 m = lClusterGlobalInitMatrix.Inverse() * lReferenceGlobalInitMatrix
-                lIBM.append(m)
+                lIBM[i] = ListFromM4(m)
 
-            lGLTFSkin['inverseBindMatrices'] = CreateIBMBuffer(lIBM)
+            if lDequantization:
+                # Node transform is ignored by skinned mesh, dequantize in the inverse bind matrices instead.
+                lIBM = np.einsum('ij,njk->nik', DequantizationMatrix(lDequantization), lIBM.reshape(-1, 4, 4)).reshape(-1, 16)
+            lGLTFNode['skin'] = CreateSkin(lGLTFSkin['joints'], lIBM)
 
     elif pNode.GetCamera():
         # Camera attribute
@@ -905,8 +1493,589 @@ def ConvertScene(pScene, pPoseTime):
         if lNodeIdx >= 0:
             lGLTFScene['nodes'].append(lNodeIdx)
 
+    AppendMeshNodes()
+
+    return lSceneIdx
+
+def ParseOBJNumbers(pValue, pDefault):
+    try:
+        return [float(x) for x in pValue.split()]
+    except ValueError:
+        return pDefault
+
+def CreateOBJTexture(pValue):
+    lPath = objreader.GetTexturePath(pValue)
+    if not lPath:
+        return None
+    return CreateImageTexture(CreateImage(lPath), CreateRepeatSampler())
+
+# Materials converted by OBJ material name, same conventions as CreatePBRMaterial
+def ConvertOBJMaterial(pName, pMTLMaterial):
+    lHashKey = ('obj', pName)
+    if lHashKey in _materialHashMap:
+        return _materialHashMap[lHashKey]
+
+    lGLTFMaterial = {
+        "name" : pName if pName else _defaultMaterialName + str(len(lib_materials)),
+        "pbrMetallicRoughness": {
+            "baseColorFactor": [1, 1, 1, 1],
+            "metallicFactor": 0,
+            "roughnessFactor": 1
+        }
+    }
+    lValues = lGLTFMaterial["pbrMetallicRoughness"]
+    lMaterial = pMTLMaterial or {}
+
+    if 'ke' in lMaterial:
+        lGLTFMaterial['emissiveFactor'] = [min(max(x, 0), 1) for x in ParseOBJNumbers(lMaterial['ke'], [0, 0, 0])[:3]]
+
+    lTransparency = 1
+    if 'd' in lMaterial:
+        lTransparency = ParseOBJNumbers(lMaterial['d'], [1])[0]
+    elif 'tr' in lMaterial:
+        lTransparency = 1 - ParseOBJNumbers(lMaterial['tr'], [0])[0]
+    if lTransparency < 1:
+        lGLTFMaterial['alphaMode'] = 'BLEND'
+        lValues['baseColorFactor'][3] = lTransparency
+
+    lTextureIdx = CreateOBJTexture(lMaterial['map_kd']) if 'map_kd' in lMaterial else None
+    if not lTextureIdx == None:
+        lValues['baseColorTexture'] = {
+            "index": lTextureIdx,
+            "texCoord": 0
+        }
+    elif 'kd' in lMaterial:
+        lValues['baseColorFactor'][0:3] = ParseOBJNumbers(lMaterial['kd'], [1, 1, 1])[:3]
+
+    for lKey in ('map_bump', 'bump', 'norm'):
+        if lKey in lMaterial:
+            lTextureIdx = CreateOBJTexture(lMaterial[lKey])
+            if not lTextureIdx == None:
+                lGLTFMaterial['normalTexture'] = {
+                    "index": lTextureIdx,
+                    "texCoord": 0
+                }
+                break
+
+    if 'map_ke' in lMaterial:
+        lTextureIdx = CreateOBJTexture(lMaterial['map_ke'])
+        if not lTextureIdx == None:
+            lGLTFMaterial['emissiveTexture'] = {
+                "index": lTextureIdx,
+                "texCoord": 0
+            }
+            if not 'ke' in lMaterial:
+                lGLTFMaterial['emissiveFactor'] = [1, 1, 1]
+
+    # Roughness and metallic of the PBR extension of MTL, else from the phong shininess
+    if 'pr' in lMaterial:
+        lValues['roughnessFactor'] = min(max(ParseOBJNumbers(lMaterial['pr'], [1])[0], 0), 1)
+    elif 'ns' in lMaterial:
+        lGLossiness = math.log(max(ParseOBJNumbers(lMaterial['ns'], [1])[0], 1)) / math.log(8192)
+        lValues['roughnessFactor'] = min(max(1 - lGLossiness, 0), 1)
+    if 'pm' in lMaterial:
+        lValues['metallicFactor'] = min(max(ParseOBJNumbers(lMaterial['pm'], [0])[0], 0), 1)
+
+    lMaterialIdx = len(lib_materials)
+    lib_materials.append(lGLTFMaterial)
+    _materialHashMap[lHashKey] = lMaterialIdx
+    return lMaterialIdx
+
+def CreateOBJPrimitive(pCorners, pPositions, pTexcoords, pNormals, pMaterialIdx):
+    # Triangles referencing missing positions are dropped, texcoords and normals are only kept
+    # when all the corners have them.
+    lTriangles = pCorners.reshape(-1, 3, 3)
+    lValid = np.all((lTriangles[:, :, 0] >= 0) & (lTriangles[:, :, 0] < len(pPositions)), axis=1)
+    lCorners = lTriangles[lValid].reshape(-1, 3)
+
+    # A vertex for each distinct (position, texcoord, normal), in order of first use
+    lFirstCorner, lIndices = meshgen.SplitVertices(lCorners[:, 0], lCorners[:, 1:])
+    lVertices = lCorners[lFirstCorner]
+
+    lPrimitive = CreatePrimitiveRaw(pMaterialIdx, False, 1, 1, 0, 0)
+    PrimitiveRawToArrays(lPrimitive)
+    del lPrimitive['controlPoints']
+    lPrimitive['positions'] = pPositions[lVertices[:, 0]]
+    if len(lVertices) > 0 and np.all((lVertices[:, 1] >= 0) & (lVertices[:, 1] < len(pTexcoords))):
+        lPrimitive['texcoords0'] = pTexcoords[lVertices[:, 1]]
+    if len(lVertices) > 0 and np.all((lVertices[:, 2] >= 0) & (lVertices[:, 2] < len(pNormals))):
+        lPrimitive['normals'] = pNormals[lVertices[:, 2]]
+    lPrimitive['indices'] = lIndices.astype(np.uint32)
+    lPrimitive['targets'] = []
+    ProcessPrimitive(lPrimitive)
+    return lPrimitive
+
+# Mesh of nodes without skin or morph targets, the same way as the static meshes of ConvertSceneNode
+def CreateStaticMesh(pGLTFNodes, pMeshName, pPrimitivesList):
+    lGLTFMesh = {'name' : pMeshName, "primitives": []}
+    lDequantization = None
+    lLODMeshes = []
+    if not ENV_BATCH_STATIC_MESHES:
+        if ENV_MESH_QUANTIZATION:
+            lDequantization = GetPositionDequantization(pPrimitivesList)
+        lGLTFMesh['primitives'] = CreateMeshPrimitives(pPrimitivesList, lDequantization)
+        lLODMeshes = CreateMeshLODs(pMeshName, pPrimitivesList, lDequantization)
+    lMeshIdx = len(lib_meshes)
+    lib_meshes.append(lGLTFMesh)
+    if ENV_BATCH_STATIC_MESHES:
+        _deferredMeshes[lMeshIdx] = SpillPrimitives(pPrimitivesList)
+    for lGLTFNode in pGLTFNodes:
+        SetNodeMesh(lGLTFNode, lGLTFNode.get('name', pMeshName), lMeshIdx, lDequantization, lLODMeshes)
+
+# Scene of an OBJ file with a node for each object, read without the FBX SDK
+def ConvertOBJ(pFilePath):
+    lPositions, lTexcoords, lNormals, lGroups, lMaterialLibs = objreader.ReadOBJ(pFilePath)
+    lMTLMaterials = {}
+    for lMaterialLib in lMaterialLibs:
+        if not os.path.isfile(lMaterialLib):
+            lMaterialLib = FindFileInDir(os.path.basename(NormalizeImagePath(lMaterialLib)), os.path.dirname(os.path.abspath(pFilePath)))
+        if lMaterialLib:
+            lMTLMaterials.update(objreader.ReadMTL(lMaterialLib))
+        else:
+            print("Can\'t find material library of " + pFilePath)
+
+    lObjectNames = []
+    lObjectPrimitives = {}
+    for lObjectName, lMaterialName, lCorners in lGroups:
+        lMaterialIdx = ConvertOBJMaterial(lMaterialName, lMTLMaterials.get(lMaterialName))
+        lPrimitive = CreateOBJPrimitive(lCorners, lPositions, lTexcoords, lNormals, lMaterialIdx)
+        if len(lPrimitive['indices']) == 0:
+            continue
+        if not lObjectName in lObjectPrimitives:
+            lObjectNames.append(lObjectName)
+            lObjectPrimitives[lObjectName] = []
+        lObjectPrimitives[lObjectName].append(lPrimitive)
+
+    lGLTFScene = {'nodes' : []}
+    lSceneIdx = len(lib_scenes)
+    lib_scenes.append(lGLTFScene)
+    for lObjectName in lObjectNames:
+        lGLTFNode = {'name': lObjectName}
+        lGLTFScene['nodes'].append(len(lib_nodes))
+        lib_nodes.append(lGLTFNode)
+        CreateStaticMesh([lGLTFNode], lObjectName, lObjectPrimitives[lObjectName])
+    AppendMeshNodes()
+
     return lSceneIdx
 
+# Extensions of the mesh data of glTF input files. Meshes are encoded again, the output declares them when it uses them.
+_meshExtensions = ['KHR_mesh_quantization', 'WEB3D_quantized_attributes', 'EXT_mesh_gpu_instancing', 'KHR_draco_mesh_compression', 'EXT_meshopt_compression']
+
+_gltfAttributeKeys = [
+    ('POSITION', 'positions'),
+    ('NORMAL', 'normals'),
+    ('TANGENT', 'tangents'),
+    ('TEXCOORD_0', 'texcoords0'),
+    ('TEXCOORD_1', 'texcoords1'),
+    ('JOINTS_0', 'joints'),
+    ('WEIGHTS_0', 'weights')
+]
+
+def TriangleListIndices(pIndices, pMode):
+    # Triangles of strips and fans, with the winding order of the glTF spec
+    i = np.arange(max(len(pIndices) - 2, 0))
+    if pMode == GL_TRIANGLE_STRIP:
+        lOdd = i % 2
+        lTriangles = np.stack([pIndices[i], pIndices[i + 1 + lOdd], pIndices[i + 2 - lOdd]], axis=1)
+    else:
+        lTriangles = np.stack([pIndices[i + 1], pIndices[i + 2], np.repeat(pIndices[:1], len(i))], axis=1)
+    return lTriangles.reshape(-1)
+
+# Arrays of a glTF primitive, in the same form as the primitives read from fbx. None if it has no triangles.
+def ReadGLTFPrimitive(pGLTF, pBuffers, pGLTFPrimitive, pMaterialIdx):
+    lMode = pGLTFPrimitive.get('mode', GL_TRIANGLES)
+    lAttributes = pGLTFPrimitive['attributes']
+    if not lMode in (GL_TRIANGLES, GL_TRIANGLE_STRIP, GL_TRIANGLE_FAN) or not 'POSITION' in lAttributes:
+        print('Skipped primitive of mode %d, only triangles are converted' % lMode)
+        return None
+
+    lPrimitive = CreatePrimitiveRaw(pMaterialIdx, False, 1, 1, 0, 0)
+    PrimitiveRawToArrays(lPrimitive)
+    del lPrimitive['controlPoints']
+    for lSemantic, lKey in _gltfAttributeKeys:
+        if lSemantic in lAttributes:
+            lPrimitive[lKey] = gltfreader.ReadAccessor(pGLTF, pBuffers, lAttributes[lSemantic]).astype(lPrimitive[lKey].dtype)
+    # Joints are only written with their weights
+    if len(lPrimitive['joints']) == 0 or len(lPrimitive['weights']) == 0:
+        lPrimitive['joints'] = lPrimitive['joints'][:0]
+        lPrimitive['weights'] = lPrimitive['weights'][:0]
+    if ENV_FLIP_V:
+        # Back to the fbx convention, ProcessUV flips them again when they are written
+        for lKey in ('texcoords0', 'texcoords1'):
+            if len(lPrimitive[lKey]) > 0:
+                lPrimitive[lKey][:, 1] = 1.0 - lPrimitive[lKey][:, 1]
+    lDropped = sorted(lSemantic for lSemantic in lAttributes if not lSemantic in dict(_gltfAttributeKeys))
+    if len(lDropped) > 0:
+        print('Dropped unsupported attributes ' + ', '.join(lDropped))
+
+    lVertexCount = len(lPrimitive['positions'])
+    if 'indices' in pGLTFPrimitive:
+        lIndices = gltfreader.ReadAccessor(pGLTF, pBuffers, pGLTFPrimitive['indices']).reshape(-1).astype(np.uint32)
+    else:
+        lIndices = np.arange(lVertexCount, dtype=np.uint32)
+    if lMode != GL_TRIANGLES:
+        lIndices = TriangleListIndices(lIndices, lMode)
+    lPrimitive['indices'] = lIndices[:len(lIndices) // 3 * 3]
+
+    # Only position deltas are converted, a target without them is kept so the weights still match
+    lPrimitive['targets'] = []
+    for lTarget in pGLTFPrimitive.get('targets', []):
+        if 'POSITION' in lTarget:
+            lPrimitive['targets'].append(gltfreader.ReadAccessor(pGLTF, pBuffers, lTarget['POSITION']).astype(np.float64))
+        else:
+            lPrimitive['targets'].append(np.zeros((lVertexCount, 3)))
+    ProcessPrimitive(lPrimitive)
+    return lPrimitive
+
+# EXT_mesh_gpu_instancing of a glTF node with its accessors created again
+def ConvertGLTFInstancing(pGLTF, pBuffers, pInstancing):
+    lArrays = {}
+    for lSemantic, lAccessorIdx in pInstancing['attributes'].items():
+        lArrays[lSemantic] = gltfreader.ReadAccessor(pGLTF, pBuffers, lAccessorIdx).astype(np.float64)
+    lCount = len(list(lArrays.values())[0]) if len(lArrays) > 0 else 0
+    # Missing transforms are the identity, so the instance matrices can always be read back
+    for lSemantic, lIdentity in (('TRANSLATION', [0, 0, 0]), ('ROTATION', [0, 0, 0, 1]), ('SCALE', [1, 1, 1])):
+        if not lSemantic in lArrays:
+            lArrays[lSemantic] = np.tile(lIdentity, (lCount, 1)).astype(np.float64)
+    lAttributes = {}
+    for lSemantic in sorted(lArrays.keys()):
+        lAttributes[lSemantic] = CreateInstanceBuffer(lArrays[lSemantic], lArrays[lSemantic].shape[1])
+    lGLTFInstancing = dict(pInstancing)
+    lGLTFInstancing['attributes'] = lAttributes
+    return lGLTFInstancing
+
+def ConvertGLTFChannel(pGLTF, pBuffers, pGLTFAnimation, pChannel, pSampler):
+    lTarget = pChannel['target']
+    # Channels targeting something else than a node, from extensions
+    if not 'node' in lTarget:
+        return
+    lPath = lTarget['path']
+    lKeyTimes = gltfreader.ReadAccessor(pGLTF, pBuffers, pSampler['input']).reshape(-1).astype(np.float64)
+    if len(lKeyTimes) == 0:
+        return
+    # Weights of all the targets for each key
+    lKeyValues = gltfreader.ReadAccessor(pGLTF, pBuffers, pSampler['output']).astype(np.float64).reshape(len(lKeyTimes), -1)
+    lInterpolation = pSampler.get('interpolation', 'LINEAR')
+    # Step and cubic spline keys can't be reduced by linear interpolation
+    if lInterpolation == 'LINEAR':
+        lTolerance = {
+            'translation': ENV_ANIMATION_TRANSLATION_ERROR,
+            'rotation': ENV_ANIMATION_ROTATION_ERROR,
+            'scale': ENV_ANIMATION_SCALE_ERROR,
+            'weights': ENV_ANIMATION_WEIGHT_ERROR
+        }[lPath]
+        lKeyTimes, lKeyValues, lInterpolation = animopt.ReduceKeyframes(lKeyTimes, lKeyValues, lTolerance, lPath == 'rotation')
+
+    lSamplerIdx = len(pGLTFAnimation['samplers'])
+    if lPath == 'weights':
+        lOutput = CreateAnimationBuffer(lKeyValues.reshape(-1), 'f', 1)
+    else:
+        # Cubic spline keys are the in tangent, value and out tangent
+        lStride = {'translation': 3, 'rotation': 4, 'scale': 3}[lPath]
+        lOutput = CreateAnimationBuffer(lKeyValues.reshape(-1, lStride), 'f', lStride)
+    pGLTFAnimation['samplers'].append({
+        "input": CreateAnimationBuffer(lKeyTimes, 'f', 1),
+        "interpolation": lInterpolation,
+        "output": lOutput
+    })
+    pGLTFAnimation['channels'].append({
+        "sampler" : lSamplerIdx,
+        "target" : {
+            "node": lTarget['node'],
+            "path" : lPath
+        }
+    })
+
+# Scene of a glTF or GLB file read without the FBX SDK. Materials, textures, cameras and nodes are kept
+# in the same order, meshes, skins and animations go through the same stages as the fbx ones.
+# Returns if the file was converted, and the index of the default scene.
+def ConvertGLTF(pFilePath, pIgnoreAnimation):
+    lGLTF, lBuffers = gltfreader.ReadGLTF(pFilePath)
+    lRequired = lGLTF.get('extensionsRequired', [])
+    for lName in ('KHR_draco_mesh_compression', 'EXT_meshopt_compression'):
+        if lName in lRequired:
+            print('Can\'t decode the %s compressed meshes of %s' % (lName, pFilePath))
+            return False, None
+    for lName in lGLTF.get('extensionsUsed', []):
+        if not lName in _meshExtensions:
+            UseExtension(lName, lName in lRequired)
+    lib_extensions.update(lGLTF.get('extensions', {}))
+
+    for lImage in lGLTF.get('images', []):
+        lData = gltfreader.ReadImageData(lGLTF, lBuffers, lImage)
+        if lData is not None:
+            # Embedded images go through the texture stage as files of the temp directory
+            lPath = textures.CacheImageData(lData, GetEmbeddedImageDir())
+        else:
+            lPath = gltfreader.GetUriPath(pFilePath, lImage['uri'])
+        lGLTFImage = {'uri': lPath}
+        if 'name' in lImage:
+            lGLTFImage['name'] = lImage['name']
+        lib_images.append(lGLTFImage)
+    lib_samplers.extend(lGLTF.get('samplers', []))
+    lib_textures.extend(lGLTF.get('textures', []))
+    lib_materials.extend(lGLTF.get('materials', []))
+    lib_cameras.extend(lGLTF.get('cameras', []))
+
+    lMeshNodes = {}
+    for lNode in lGLTF.get('nodes', []):
+        lGLTFNode = dict(lNode)
+        if 'mesh' in lGLTFNode:
+            lMeshNodes.setdefault(lGLTFNode.pop('mesh'), []).append(lGLTFNode)
+        lInstancing = lGLTFNode.get('extensions', {}).get('EXT_mesh_gpu_instancing')
+        if lInstancing:
+            lGLTFNode['extensions'] = dict(lGLTFNode['extensions'])
+            lGLTFNode['extensions']['EXT_mesh_gpu_instancing'] = ConvertGLTFInstancing(lGLTF, lBuffers, lInstancing)
+            UseExtension('EXT_mesh_gpu_instancing', 'EXT_mesh_gpu_instancing' in lRequired)
+        lib_nodes.append(lGLTFNode)
+
+    for lScene in lGLTF.get('scenes', []):
+        lGLTFScene = dict(lScene)
+        lGLTFScene['nodes'] = list(lScene.get('nodes', []))
+        lib_scenes.append(lGLTFScene)
+    if len(lib_scenes) == 0:
+        lParents = scenegraph.GetParentIndices(lib_nodes)
+        lib_scenes.append({'nodes': [i for i in range(len(lib_nodes)) if lParents[i] < 0]})
+
+    lSkinRemap = []
+    for lSkin in lGLTF.get('skins', []):
+        if 'inverseBindMatrices' in lSkin:
+            lIBM = gltfreader.ReadAccessor(lGLTF, lBuffers, lSkin['inverseBindMatrices'])
+        else:
+            lIBM = np.tile(np.identity(4).reshape(1, 16), (len(lSkin['joints']), 1))
+        lSkinIdx = CreateSkin(lSkin['joints'], lIBM)
+        for lKey in ('name', 'skeleton'):
+            if lKey in lSkin:
+                lib_skins[lSkinIdx].setdefault(lKey, lSkin[lKey])
+        lSkinRemap.append(lSkinIdx)
+    for lGLTFNode in lib_nodes:
+        if 'skin' in lGLTFNode:
+            lGLTFNode['skin'] = lSkinRemap[lGLTFNode['skin']]
+
+    # Primitives without material use the default material of glTF
+    lMeshes = lGLTF.get('meshes', [])
+    lDefaultMaterialIdx = len(lib_materials)
+    if any(not 'material' in lPrimitive for lMeshIdx in lMeshNodes for lPrimitive in lMeshes[lMeshIdx]['primitives']):
+        lib_materials.append({'name': _defaultMaterialName + str(lDefaultMaterialIdx)})
+
+    # Meshes no node uses are dropped
+    for lMeshIdx in sorted(lMeshNodes.keys()):
+        lMesh = lMeshes[lMeshIdx]
+        lMeshName = lMesh.get('name', 'Mesh%d' % lMeshIdx)
+        lPrimitivesList = []
+        for lGLTFPrimitive in lMesh['primitives']:
+            lPrimitive = ReadGLTFPrimitive(lGLTF, lBuffers, lGLTFPrimitive, lGLTFPrimitive.get('material', lDefaultMaterialIdx))
+            if lPrimitive is not None and len(lPrimitive['indices']) > 0:
+                lPrimitivesList.append(lPrimitive)
+        if len(lPrimitivesList) == 0:
+            continue
+
+        lNodes = lMeshNodes[lMeshIdx]
+        if all(len(lPrimitive['targets']) == 0 for lPrimitive in lPrimitivesList) \
+            and not any('skin' in lGLTFNode or 'extensions' in lGLTFNode for lGLTFNode in lNodes):
+            CreateStaticMesh(lNodes, lMeshName, lPrimitivesList)
+            continue
+        # Skinned, morphed and instanced meshes stay on their nodes, with float positions
+        lGLTFMesh = {'name': lMeshName, 'primitives': CreateMeshPrimitives(lPrimitivesList)}
+        for lKey in ('weights', 'extras'):
+            if lKey in lMesh:
+                lGLTFMesh[lKey] = lMesh[lKey]
+        for lGLTFNode in lNodes:
+            lGLTFNode['mesh'] = len(lib_meshes)
+        lib_meshes.append(lGLTFMesh)
+    AppendMeshNodes()
+
+    if not pIgnoreAnimation:
+        for i, lAnimation in enumerate(lGLTF.get('animations', [])):
+            lAnimIdx, lGLTFAnimation = CreateAnimation(lAnimation.get('name', 'Animation%d' % i))
+            for lChannel in lAnimation['channels']:
+                ConvertGLTFChannel(lGLTF, lBuffers, lGLTFAnimation, lChannel, lAnimation['samplers'][lChannel['sampler']])
+            if len(lGLTFAnimation['samplers']) > 0:
+                lib_animations.append(lGLTFAnimation)
+
+    return True, lGLTF.get('scene', 0)
+
+# Vertices of a batched primitive, so its indices stay 16 bits
+BATCH_MAX_VERTICES = 0xffff
+
+def TransformPrimitive(pPrimitive, pMatrix):
+    lPrimitive = dict(pPrimitive)
+    lLinear = pMatrix[:3, :3]
+    lPrimitive['positions'] = np.dot(pPrimitive['positions'], lLinear) + pMatrix[3, :3]
+    if len(pPrimitive['normals']) > 0:
+        lNormals = np.dot(pPrimitive['normals'], np.linalg.inv(lLinear).T)
+        lLength = np.linalg.norm(lNormals, axis=1).reshape(-1, 1)
+        lPrimitive['normals'] = lNormals / np.where(lLength == 0, 1, lLength)
+    if len(pPrimitive['tangents']) > 0:
+        lTangents = np.dot(pPrimitive['tangents'][:, :3], lLinear)
+        lLength = np.linalg.norm(lTangents, axis=1).reshape(-1, 1)
+        lPrimitive['tangents'] = np.hstack([lTangents / np.where(lLength == 0, 1, lLength), pPrimitive['tangents'][:, 3:]])
+    if np.linalg.det(lLinear) < 0:
+        # Mirrored transform, keep the triangles front facing and the tangent frames right handed
+        lPrimitive['indices'] = pPrimitive['indices'].reshape(-1, 3)[:, [0, 2, 1]].reshape(-1)
+        if len(pPrimitive['tangents']) > 0:
+            lPrimitive['tangents'][:, 3] *= -1
+    return lPrimitive
+
+def MergePrimitives(pPrimitivesList):
+    lPrimitive = dict(pPrimitivesList[0])
+    for lKey in _vertexAttributeKeys:
+        lArrays = [p[lKey] for p in pPrimitivesList]
+        if all(len(a) > 0 for a in lArrays):
+            lPrimitive[lKey] = np.concatenate(lArrays)
+    lIndices = []
+    lVertexOffset = 0
+    for p in pPrimitivesList:
+        lIndices.append(p['indices'] + lVertexOffset)
+        lVertexOffset += len(p['positions'])
+    lPrimitive['indices'] = np.concatenate(lIndices).astype(np.uint32)
+    return lPrimitive
+
+def GetBatchKey(pPrimitive):
+    # Primitives can be merged when they have the same material, texture transform and attributes
+    return (
+        pPrimitive['material'],
+        pPrimitive['scaleU'], pPrimitive['scaleV'],
+        pPrimitive['translationU'], pPrimitive['translationV'],
+        tuple(len(pPrimitive[lKey]) > 0 for lKey in _vertexAttributeKeys)
+    )
+
+# Bake the world transform of the static deferred meshes and merge their primitives by material
+# in one mesh, split so each primitive has at most BATCH_MAX_VERTICES vertices.
+# Nodes left empty are removed. Must run after the animations are converted.
+def BatchStaticMeshes(pSceneIdx):
+    lParents = scenegraph.GetParentIndices(lib_nodes)
+    lAnimatedNodes = scenegraph.GetAnimatedNodes(lib_animations)
+    lGLTFScene = lib_scenes[pSceneIdx]
+    lWorldMatrices = scenegraph.GetWorldMatrices(lib_nodes, lGLTFScene['nodes'])
+
+    lMeshUseCount = {}
+    for lGLTFNode in lib_nodes:
+        if 'mesh' in lGLTFNode:
+            lMeshUseCount[lGLTFNode['mesh']] = lMeshUseCount.get(lGLTFNode['mesh'], 0) + 1
+
+    lBatches = {}
+    lBatchKeys = []
+    lBakedNodeCount = 0
+    for i in range(len(lib_nodes)):
+        lGLTFNode = lib_nodes[i]
+        lMeshIdx = lGLTFNode.get('mesh', -1)
+        if not lMeshIdx in _deferredMeshes or lWorldMatrices[i] is None:
+            continue
+        if scenegraph.HasAnimatedAncestor(i, lParents, lAnimatedNodes):
+            continue
+        # Keep the meshes that will be drawn with GPU instancing
+        if ENV_GPU_INSTANCING > 0 and lMeshUseCount[lMeshIdx] >= ENV_GPU_INSTANCING:
+            continue
+        for lPrimitive in _deferredMeshes[lMeshIdx]:
+            lBatchKey = GetBatchKey(lPrimitive)
+            if not lBatchKey in lBatches:
+                lBatches[lBatchKey] = []
+                lBatchKeys.append(lBatchKey)
+            lBatches[lBatchKey].append(TransformPrimitive(lPrimitive, lWorldMatrices[i]))
+        del lGLTFNode['mesh']
+        lBakedNodeCount += 1
+
+    if lBakedNodeCount == 0:
+        return
+
+    lPrimitivesList = []
+    for lBatchKey in lBatchKeys:
+        lChunk = []
+        lChunkVertexCount = 0
+        for lPrimitive in lBatches[lBatchKey]:
+            lVertexCount = len(lPrimitive['positions'])
+            if len(lChunk) > 0 and lChunkVertexCount + lVertexCount > BATCH_MAX_VERTICES:
+                lPrimitivesList.append(MergePrimitives(lChunk))
+                lChunk = []
+                lChunkVertexCount = 0
+            lChunk.append(lPrimitive)
+            lChunkVertexCount += lVertexCount
+        lPrimitivesList.append(MergePrimitives(lChunk))
+
+    lMeshIdx = len(lib_meshes)
+    lib_meshes.append({'name': 'StaticBatch', 'primitives': []})
+    _deferredMeshes[lMeshIdx] = SpillPrimitives(lPrimitivesList)
+    lGLTFScene['nodes'].append(len(lib_nodes))
+    lib_nodes.append({'name': 'StaticBatch', 'mesh': lMeshIdx})
+
+    lRemovedCount = scenegraph.RemoveEmptyNodes(lib_nodes, lib_scenes, lib_skins, lib_animations)
+    print('Batched %d static mesh nodes in %d primitives, removed %d empty nodes' % (lBakedNodeCount, len(lPrimitivesList), lRemovedCount))
+
+# Create the buffers of the deferred meshes still used by a node, and remove the others
+def CreateDeferredMeshes():
+    lMeshNodes = {}
+    for lGLTFNode in lib_nodes:
+        if lGLTFNode.get('mesh', -1) in _deferredMeshes:
+            lMeshNodes.setdefault(lGLTFNode['mesh'], []).append(lGLTFNode)
+
+    for lMeshIdx in sorted(lMeshNodes.keys()):
+        lPrimitivesList = _deferredMeshes[lMeshIdx]
+        lDequantization = None
+        if ENV_MESH_QUANTIZATION:
+            lDequantization = GetPositionDequantization(lPrimitivesList)
+        lib_meshes[lMeshIdx]['primitives'] = CreateMeshPrimitives(lPrimitivesList, lDequantization)
+        lLODMeshes = CreateMeshLODs(lib_meshes[lMeshIdx]['name'], lPrimitivesList, lDequantization)
+        for lGLTFNode in lMeshNodes[lMeshIdx]:
+            del lGLTFNode['mesh']
+            SetNodeMesh(lGLTFNode, lGLTFNode['name'], lMeshIdx, lDequantization, lLODMeshes)
+    _deferredMeshes.clear()
+    spillbuffer.ReleaseArrays()
+
+    AppendMeshNodes()
+    scenegraph.RemoveUnusedMeshes(lib_nodes, lib_meshes)
+
+# Remove the nodes without content and collapse chains of helper nodes. Must run after the animations are converted.
+def CompactSceneGraph():
+    lNodeCount = len(lib_nodes)
+    scenegraph.RemoveEmptyNodes(lib_nodes, lib_scenes, lib_skins, lib_animations)
+    scenegraph.CollapseEmptyNodes(lib_nodes, lib_scenes, lib_skins, lib_animations)
+    print('Compacted scene graph from %d to %d nodes' % (lNodeCount, len(lib_nodes)))
+
+# Replace the static leaf nodes of meshes used at least pMinInstances times by one node
+# drawing all of them with EXT_mesh_gpu_instancing. Must run after the animations are converted.
+def CreateGPUInstances(pSceneIdx, pMinInstances):
+    lParents = scenegraph.GetParentIndices(lib_nodes)
+    lAnimatedNodes = scenegraph.GetAnimatedNodes(lib_animations)
+    lMeshNodes = {}
+    for i in range(len(lib_nodes)):
+        lGLTFNode = lib_nodes[i]
+        if not 'mesh' in lGLTFNode or 'skin' in lGLTFNode or 'children' in lGLTFNode or 'camera' in lGLTFNode or 'extensions' in lGLTFNode:
+            continue
+        if scenegraph.HasAnimatedAncestor(i, lParents, lAnimatedNodes):
+            continue
+        lMeshNodes.setdefault(lGLTFNode['mesh'], []).append(i)
+
+    lGLTFScene = lib_scenes[pSceneIdx]
+    lWorldMatrices = scenegraph.GetWorldMatrices(lib_nodes, lGLTFScene['nodes'])
+    for lMeshIdx in sorted(lMeshNodes.keys()):
+        lNodeIndices = [i for i in lMeshNodes[lMeshIdx] if lWorldMatrices[i] is not None]
+        if len(lNodeIndices) < pMinInstances:
+            continue
+        lTranslations, lRotations, lScales, lValid = scenegraph.DecomposeMatrices([lWorldMatrices[i] for i in lNodeIndices])
+        # Sheared transforms can't be instanced with TRS, keep their nodes
+        if np.count_nonzero(lValid) < pMinInstances:
+            continue
+
+        UseExtension('EXT_mesh_gpu_instancing', True)
+        for i in np.flatnonzero(lValid):
+            del lib_nodes[lNodeIndices[i]]['mesh']
+        lGLTFScene['nodes'].append(len(lib_nodes))
+        lib_nodes.append({
+            'name': lib_meshes[lMeshIdx]['name'] + '_instances',
+            'mesh': lMeshIdx,
+            'extensions': {
+                'EXT_mesh_gpu_instancing': {
+                    'attributes': {
+                        'TRANSLATION': CreateInstanceBuffer(lTranslations[lValid], 3),
+                        'ROTATION': CreateInstanceBuffer(lRotations[lValid], 4),
+                        'SCALE': CreateInstanceBuffer(lScales[lValid], 3)
+                    }
+                }
+            }
+        })
+        print('Instanced mesh %d on %d nodes with EXT_mesh_gpu_instancing' % (lMeshIdx, np.count_nonzero(lValid)))
+
 def CreateAnimation(pName):
     lAnimIdx = len(lib_animations)
     lGLTFAnimation = {
@@ -918,24 +2087,12 @@ def CreateAnimation(pName):
     return lAnimIdx, lGLTFAnimation
 
 _samplerChannels = ['rotation', 'scale', 'translation']
-_timeSamplerHashMap = {}
-
-def GetPropertyAnimationCurveTime(pAnimCurve):
-    lTimeSpan = FbxTimeSpan()
-    pAnimCurve.GetTimeInterval(lTimeSpan)
-    lStartTimeDouble = lTimeSpan.GetStart().GetSecondDouble()
-    lEndTimeDouble = lTimeSpan.GetStop().GetSecondDouble()
-    lDuration = lEndTimeDouble - lStartTimeDouble
-
-    return lStartTimeDouble, lEndTimeDouble, lDuration
 
 EPSILON = 1e-6
-def V3Same(a, b):
-    return abs(a[0] - b[0]) < EPSILON and abs(a[1] - b[1]) < EPSILON and abs(a[2] - b[2]) < EPSILON
-def V4Same(a, b):
-    return abs(a[0] - b[0]) < EPSILON and abs(a[1] - b[1]) < EPSILON and abs(a[2] - b[2]) < EPSILON and abs(a[3] - b[3]) < EPSILON
 def V3Middle(a, b):
     return [(a[0] + b[0]) / 2, (a[1] + b[1]) / 2, (a[2] + b[2]) / 2]
+def V3Lerp(a, b, t):
+    return [a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t, a[2] + (b[2] - a[2]) * t]
 def QuatSlerp(a, b, t):
     [ax, ay, az, aw] = a
     [bx, by, bz, bw] = b
@@ -964,76 +2121,106 @@ def QuatSlerp(a, b, t):
     ## calculate final values
     return [scale0 * ax + scale1 * bx, scale0 * ay + scale1 * by, scale0 * az + scale1 * bz, scale0 * aw + scale1 * bw]
 
-def FitLinearInterpolation(pTime, pTranslationChannel, pRotationChannel, pScaleChannel):
-    lTranslationChannel = []
-    lRotationChannel = []
-    lScaleChannel = []
-    lTime = []
-    lHaveRotation = len(pRotationChannel) > 0
-    lHaveScale = len(pScaleChannel) > 0
-    lHaveTranslation = len(pTranslationChannel) > 0
-    if lHaveRotation:
-        lRotationChannel.append(pRotationChannel[0])
-    if lHaveScale:
-        lScaleChannel.append(pScaleChannel[0])
-    if lHaveTranslation:
-        lTranslationChannel.append(pTranslationChannel[0])
-    lTime.append(pTime[0])
-    for i in range(len(pTime)):
-        lLinearInterpolated = True
-        if i > 1:
-            if lHaveTranslation:
-                if not V3Same(V3Middle(pTranslationChannel[i - 2], pTranslationChannel[i]), pTranslationChannel[i - 1]):
-                    lLinearInterpolated = False
-            if lHaveScale and lLinearInterpolated:
-                if not V3Same(V3Middle(pScaleChannel[i - 2], pScaleChannel[i]), pScaleChannel[i - 1]):
-                    lLinearInterpolated = False
-            if lHaveRotation:
-                if not V4Same(QuatSlerp(pRotationChannel[i - 2], pRotationChannel[i], 0.5), pRotationChannel[i - 1]):
-                    lLinearInterpolated = False
-
-        if not lLinearInterpolated:
-            if lHaveTranslation:
-                lTranslationChannel.append(pTranslationChannel[i - 1])
-            if lHaveRotation:
-                lRotationChannel.append(pRotationChannel[i - 1])
-            if lHaveScale:
-                lScaleChannel.append(pScaleChannel[i - 1])
-            lTime.append(pTime[i - 1])
-
-    if len(pTime) > 1:
-        if lHaveRotation:
-            lRotationChannel.append(pRotationChannel[len(pRotationChannel) - 1])
-        if lHaveScale:
-            lScaleChannel.append(pScaleChannel[len(pScaleChannel) - 1])
-        if lHaveTranslation:
-            lTranslationChannel.append(pTranslationChannel[len(pTranslationChannel) - 1])
-
-        lTime.append(pTime[len(pTime) - 1])
-
-    return lTime, lTranslationChannel, lRotationChannel, lScaleChannel
-
-
-def ConvertNodeAnimation(pGLTFAnimation, pAnimLayer, pNode, pSampleRate, pStartTime, pDuration):
+def GetNodeAnimationCurves(pNode, pAnimLayers):
+    lCurves = []
+    for lAnimLayer in pAnimLayers:
+        for lProperty in [pNode.LclTranslation, pNode.LclRotation, pNode.LclScaling]:
+            for lComponent in ['X', 'Y', 'Z']:
+                lCurves.append(lProperty.GetCurve(lAnimLayer, lComponent))
+    return lCurves
+
+def IsAnimationCurveConstant(pAnimCurve):
+    lKeyCount = pAnimCurve.KeyGetCount()
+    if lKeyCount < 2:
+        return True
+    lFirstValue = pAnimCurve.KeyGetValue(0)
+    for k in range(1, lKeyCount):
+        if abs(pAnimCurve.KeyGetValue(k) - lFirstValue) > EPSILON:
+            return False
+    return True
+
+def GetAnimationCurveKeyTimes(pAnimCurve):
+    return [pAnimCurve.KeyGetTime(k).GetSecondDouble() for k in range(pAnimCurve.KeyGetCount())]
+
+def QuatAngle(a, b):
+    lDot = min(abs(a[0] * b[0] + a[1] * b[1] + a[2] * b[2] + a[3] * b[3]), 1.0)
+    return 2 * math.acos(lDot)
+
+def V3Distance(a, b):
+    return math.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2)
+
+def EvaluateNodeTRS(pNode, pTime, pSecondDouble):
+    pTime.SetSecondDouble(pSecondDouble)
+    lTransform = pNode.EvaluateLocalTransform(pTime, FbxNode.eDestinationPivot)
+    return list(lTransform.GetT())[:3], list(lTransform.GetQ()), list(lTransform.GetS())[:3]
+
+# Interior points of an interval compared to the interpolation of its ends. The middle alone
+# is not enough, ease in and out curves are symmetric and pass through it.
+_refineFractions = [0.25, 0.5, 0.75]
+
+# Sample the node transform at its key times, and in between where interpolating
+# the neighbour samples is off by more than the tolerances.
+# Intervals are not split below pMinInterval.
+def SampleNodeAnimation(pNode, pKeyTimes, pStartTime, pEndTime, pMinInterval):
+    lTime = FbxTime()
+    lSamples = {}
+    for lSecondDouble in [pStartTime, pEndTime] + pKeyTimes:
+        if lSecondDouble >= pStartTime and lSecondDouble <= pEndTime and not lSecondDouble in lSamples:
+            lSamples[lSecondDouble] = EvaluateNodeTRS(pNode, lTime, lSecondDouble)
+
+    lKeyTimes = sorted(lSamples.keys())
+    lIntervals = list(zip(lKeyTimes[:-1], lKeyTimes[1:]))
+    while len(lIntervals) > 0:
+        lStart, lEnd = lIntervals.pop()
+        if lEnd - lStart <= pMinInterval:
+            continue
+        lT0, lQ0, lS0 = lSamples[lStart]
+        lT1, lQ1, lS1 = lSamples[lEnd]
+        lInterior = []
+        lAccepted = True
+        for lFraction in _refineFractions:
+            lSecondDouble = lStart + (lEnd - lStart) * lFraction
+            lT, lQ, lS = EvaluateNodeTRS(pNode, lTime, lSecondDouble)
+            lInterior.append((lSecondDouble, (lT, lQ, lS)))
+            if V3Distance(V3Lerp(lT0, lT1, lFraction), lT) > ENV_ANIMATION_TRANSLATION_ERROR or \
+                V3Distance(V3Lerp(lS0, lS1, lFraction), lS) > ENV_ANIMATION_SCALE_ERROR or \
+                QuatAngle(QuatSlerp(lQ0, lQ1, lFraction), lQ) > ENV_ANIMATION_ROTATION_ERROR:
+                lAccepted = False
+        if lAccepted:
+            continue
+        # The interior samples are kept, each of the sub intervals is checked again
+        lPrevious = lStart
+        for lSecondDouble, lSample in lInterior:
+            lSamples[lSecondDouble] = lSample
+            lIntervals.append((lPrevious, lSecondDouble))
+            lPrevious = lSecondDouble
+        lIntervals.append((lPrevious, lEnd))
+
+    lTimes = sorted(lSamples.keys())
+    return lTimes, [lSamples[t] for t in lTimes]
+
+def ConvertNodeAnimation(pGLTFAnimation, pAnimLayers, pNode, pSampleRate, pStartTime, pDuration):
     lNodeIdx = GetNodeIdx(pNode)
 
-    curves = [
-        pNode.LclTranslation.GetCurve(pAnimLayer, 'X'),
-        pNode.LclTranslation.GetCurve(pAnimLayer, 'Y'),
-        pNode.LclTranslation.GetCurve(pAnimLayer, 'Z'),
-
-        pNode.LclRotation.GetCurve(pAnimLayer, 'X'),
-        pNode.LclRotation.GetCurve(pAnimLayer, 'Y'),
-        pNode.LclRotation.GetCurve(pAnimLayer, 'Z'),
-
-        pNode.LclScaling.GetCurve(pAnimLayer, 'X'),
-        pNode.LclScaling.GetCurve(pAnimLayer, 'Y'),
-        pNode.LclScaling.GetCurve(pAnimLayer, 'Z'),
-    ]
-
-    lHaveTranslation = any(curves[0:3])
-    lHaveRotation = any(curves[3:6])
-    lHaveScaling = any(curves[6:9])
+    # Curves of all layers, the transform evaluated is blended from all of them.
+    curves = GetNodeAnimationCurves(pNode, pAnimLayers)
+
+    lHaveTranslation = False
+    lHaveRotation = False
+    lHaveScaling = False
+    lKeyTimes = []
+    for i in range(len(curves)):
+        curve = curves[i]
+        # Constant curves don't need to be sampled
+        if curve == None or IsAnimationCurveConstant(curve):
+            continue
+        if i % 9 < 3:
+            lHaveTranslation = True
+        elif i % 9 < 6:
+            lHaveRotation = True
+        else:
+            lHaveScaling = True
+        lKeyTimes += GetAnimationCurveKeyTimes(curve)
 
     # Curve time span may much smaller than stack local time span
     # It can reduce a lot of space
@@ -1041,122 +2228,170 @@ def ConvertNodeAnimation(pGLTFAnimation, pAnimLayer, pNode, pSampleRate, pStartT
     lStartTimeDouble = 1000000
     lDuration = 0
     lEndTimeDouble = 0
-    for curve in curves:
-        if not curve == None:
-            lCurveStart, lCurveEnd, lCurveDuration = GetPropertyAnimationCurveTime(curve)
-            lStartTimeDouble = min(lCurveStart, lStartTimeDouble)
-            lEndTimeDouble = max(lCurveEnd, lEndTimeDouble)
-            lDuration = max(lCurveDuration, lDuration)
+    if len(lKeyTimes) > 0:
+        lStartTimeDouble = min(lKeyTimes)
+        lEndTimeDouble = max(lKeyTimes)
+        lDuration = lEndTimeDouble - lStartTimeDouble
 
     lDuration = min(lDuration, pDuration)
     lStartTimeDouble = max(lStartTimeDouble, pStartTime)
+    lEndTimeDouble = min(lEndTimeDouble, lStartTimeDouble + lDuration)
 
-    if lDuration > 0:
-        lNumFrames = math.ceil(lDuration / pSampleRate)
-
-        lTime = FbxTime()
-
+    if lDuration > 0 and lEndTimeDouble > lStartTimeDouble:
         lTimeChannel = []
         lTranslationChannel = []
         lRotationChannel = []
         lScaleChannel = []
 
-        lQuaternion = FbxQuaternion()
-        for i in range(lNumFrames):
-            lSecondDouble = min(lStartTimeDouble + pSampleRate * i, lEndTimeDouble)
-            lTime.SetSecondDouble(lSecondDouble)
-
-            lTransform = pNode.EvaluateLocalTransform(lTime, FbxNode.eDestinationPivot)
-            lTranslation = lTransform.GetT()
-            lQuaternion = lTransform.GetQ()
-            lScale = lTransform.GetS()
-
-            # Convert quaternion to axis angle
+        lSampleTimes, lSamples = SampleNodeAnimation(pNode, lKeyTimes, lStartTimeDouble, lEndTimeDouble, pSampleRate)
+        for lSecondDouble, (lTranslation, lQuaternion, lScale) in zip(lSampleTimes, lSamples):
             # PENDING. minus pStartTime or lStartTimeDouble?
             lTimeChannel.append(lSecondDouble - pStartTime)
 
             if lHaveRotation:
-                lRotationChannel.append(list(lQuaternion))
+                # Keep quaternions in the same hemisphere so the interpolation takes the shortest path
+                if len(lRotationChannel) > 0 and sum(a * b for a, b in zip(lRotationChannel[-1], lQuaternion)) < 0:
+                    lQuaternion = [-c for c in lQuaternion]
+                lRotationChannel.append(lQuaternion)
             if lHaveTranslation:
-                lTranslationChannel.append(list(lTranslation))
+                lTranslationChannel.append(lTranslation)
             if lHaveScaling:
-                lScaleChannel.append(list(lScale))
+                lScaleChannel.append(lScale)
 
-        lTimeChannel, lTranslationChannel, lRotationChannel, lScaleChannel = FitLinearInterpolation(
-            lTimeChannel, lTranslationChannel, lRotationChannel, lScaleChannel
-        )
-
-        # TODO Performance?
-        lTimeAccessorKey = tuple(lTimeChannel)
-        if not lTimeAccessorKey in _timeSamplerHashMap:
-            # TODO use ubyte.
-            _timeSamplerHashMap[lTimeAccessorKey] = CreateAnimationBuffer(lTimeChannel, 'f', 1)
-
-        lSamplerAccessors = {
-            "time": _timeSamplerHashMap[lTimeAccessorKey]
-            # "time": CreateAnimationBuffer(lTimeChannel, 'f', 1)
-        }
+        lTimeChannel = np.array(lTimeChannel)
+        lChannels = {}
         if lHaveTranslation:
-            lAccessorIdx = CreateAnimationBuffer(lTranslationChannel, 'f', 3)
-            if lAccessorIdx >= 0:
-                lSamplerAccessors['translation'] = lAccessorIdx
+            lChannels['translation'] = (lTranslationChannel, ENV_ANIMATION_TRANSLATION_ERROR)
         if lHaveRotation:
-            lAccessorIdx = CreateAnimationBuffer(lRotationChannel, 'f', 4)
-            if lAccessorIdx >= 0:
-                lSamplerAccessors['rotation'] = lAccessorIdx
+            lChannels['rotation'] = (lRotationChannel, ENV_ANIMATION_ROTATION_ERROR)
         if lHaveScaling:
-            lAccessorIdx = CreateAnimationBuffer(lScaleChannel, 'f', 3)
-            if lAccessorIdx >= 0:
-                lSamplerAccessors['scale'] = lAccessorIdx
+            lChannels['scale'] = (lScaleChannel, ENV_ANIMATION_SCALE_ERROR)
 
-        #TODO Other interpolation methods
         for path in _samplerChannels:
-            if path in lSamplerAccessors:
-                lSamplerIdx = len(pGLTFAnimation['samplers'])
-                pGLTFAnimation['samplers'].append({
-                    "input": lSamplerAccessors['time'],
-                    "interpolation": "LINEAR",
-                    "output": lSamplerAccessors[path]
-                })
-                pGLTFAnimation['channels'].append({
-                    "sampler" : lSamplerIdx,
-                    "target" : {
-                        "node": lNodeIdx,
-                        "path" : path
-                    }
-                })
+            if not path in lChannels:
+                continue
+            lChannel, lTolerance = lChannels[path]
+            lKeyTimes, lKeyValues, lInterpolation = animopt.ReduceKeyframes(
+                lTimeChannel, lChannel, lTolerance, path == 'rotation'
+            )
+
+            lSamplerIdx = len(pGLTFAnimation['samplers'])
+            pGLTFAnimation['samplers'].append({
+                # TODO use ubyte.
+                "input": CreateAnimationBuffer(lKeyTimes, 'f', 1),
+                "interpolation": lInterpolation,
+                "output": CreateAnimationBuffer(lKeyValues, 'f', lKeyValues.shape[1])
+            })
+            pGLTFAnimation['channels'].append({
+                "sampler" : lSamplerIdx,
+                "target" : {
+                    "node": lNodeIdx,
+                    "path" : path
+                }
+            })
+
+    ConvertMorphAnimation(pGLTFAnimation, pAnimLayers, pNode, pSampleRate, pStartTime, pDuration)
 
     for i in range(pNode.GetChildCount()):
-        ConvertNodeAnimation(pGLTFAnimation, pAnimLayer, pNode.GetChild(i), pSampleRate, pStartTime, pDuration)
+        ConvertNodeAnimation(pGLTFAnimation, pAnimLayers, pNode.GetChild(i), pSampleRate, pStartTime, pDuration)
 
-def ConvertAnimation(pScene, pSampleRate, pStartTime, pDuration):
+# Animation of the blend shape weights of the node mesh, all channels are sampled together in one 'weights' channel
+def ConvertMorphAnimation(pGLTFAnimation, pAnimLayers, pNode, pSampleRate, pStartTime, pDuration):
+    lMesh = pNode.GetMesh()
+    # Same condition as the mesh export in ConvertSceneNode
+    if not pNode.GetVisibility() or not lMesh or not lMesh.GetLayer(0):
+        return
+
+    lChannels = []
+    lKeyTimes = []
+    for i in range(pNode.GetNodeAttributeCount()):
+        lNodeAttribute = pNode.GetNodeAttributeByIndex(i)
+        if lNodeAttribute.GetAttributeType() != FbxNodeAttribute.eMesh:
+            continue
+        for lBlendShapeIdx, lChannelIdx, lChannel in GetBlendShapeChannels(lNodeAttribute):
+            lCurves = []
+            for lAnimLayer in pAnimLayers:
+                lCurve = lNodeAttribute.GetShapeChannel(lBlendShapeIdx, lChannelIdx, lAnimLayer)
+                if lCurve:
+                    lCurves.append(lCurve)
+                    if not IsAnimationCurveConstant(lCurve):
+                        lKeyTimes += GetAnimationCurveKeyTimes(lCurve)
+            lChannels.append((lChannel, lCurves))
+
+    if len(lChannels) == 0 or len(lKeyTimes) == 0:
+        return
+
+    lDuration = min(max(lKeyTimes) - min(lKeyTimes), pDuration)
+    lStartTimeDouble = max(min(lKeyTimes), pStartTime)
+    lEndTimeDouble = min(max(lKeyTimes), lStartTimeDouble + lDuration)
+    if lEndTimeDouble <= lStartTimeDouble:
+        return
+
+    lTimes = np.arange(lStartTimeDouble, lEndTimeDouble, pSampleRate)
+    lTimes = np.union1d(lTimes, [t for t in lKeyTimes if t >= lStartTimeDouble and t <= lEndTimeDouble] + [lEndTimeDouble])
+    lWeights = np.empty((len(lTimes), len(lChannels)))
+    lTime = FbxTime()
+    for k in range(len(lChannels)):
+        lChannel, lCurves = lChannels[k]
+        for i in range(len(lTimes)):
+            lTime.SetSecondDouble(float(lTimes[i]))
+            if len(lCurves) > 0:
+                # Layers are additive
+                lWeights[i, k] = sum(lCurve.Evaluate(lTime) for lCurve in lCurves) / 100.0
+            else:
+                lWeights[i, k] = lChannel.DeformPercent.Get() / 100.0
+
+    lKeyTimes, lKeyValues, lInterpolation = animopt.ReduceKeyframes(
+        lTimes - pStartTime, lWeights, ENV_ANIMATION_WEIGHT_ERROR
+    )
+    lSamplerIdx = len(pGLTFAnimation['samplers'])
+    pGLTFAnimation['samplers'].append({
+        "input": CreateAnimationBuffer(lKeyTimes, 'f', 1),
+        "interpolation": lInterpolation,
+        # Weights of all the targets for each key
+        "output": CreateAnimationBuffer(lKeyValues.reshape(-1), 'f', 1)
+    })
+    pGLTFAnimation['channels'].append({
+        "sampler" : lSamplerIdx,
+        "target" : {
+            "node": GetNodeIdx(pNode),
+            "path" : 'weights'
+        }
+    })
+
+# Animations of a time range are named pName, followed by the name of the anim stack if there are several
+def ConvertAnimation(pScene, pSampleRate, pStartTime, pDuration, pName=None):
     lRoot = pScene.GetRootNode()
-    for i in range(pScene.GetSrcObjectCount(FbxCriteria.ObjectType(FbxAnimStack.ClassId))):
+    lAnimStackCount = pScene.GetSrcObjectCount(FbxCriteria.ObjectType(FbxAnimStack.ClassId))
+    for i in range(lAnimStackCount):
         lAnimStack = pScene.GetSrcObject(FbxCriteria.ObjectType(FbxAnimStack.ClassId), i)
-        lAnimIdx, lGLTFAnimation = CreateAnimation(lAnimStack.GetName())
+        lName = lAnimStack.GetName()
+        if pName and lAnimStackCount > 1:
+            lName = '%s_%s' % (pName, lName)
+        elif pName:
+            lName = pName
+        lAnimIdx, lGLTFAnimation = CreateAnimation(lName)
+        lAnimLayers = []
         for j in range(lAnimStack.GetSrcObjectCount(FbxCriteria.ObjectType(FbxAnimLayer.ClassId))):
-            lAnimLayer = lAnimStack.GetSrcObject(FbxCriteria.ObjectType(FbxAnimLayer.ClassId), j)
-            # for k in range(lRoot.GetChildCount()):
-            ConvertNodeAnimation(lGLTFAnimation, lAnimLayer, lRoot, pSampleRate, pStartTime, pDuration)
+            lAnimLayers.append(lAnimStack.GetSrcObject(FbxCriteria.ObjectType(FbxAnimLayer.ClassId), j))
+        ConvertNodeAnimation(lGLTFAnimation, lAnimLayers, lRoot, pSampleRate, pStartTime, pDuration)
         if len(lGLTFAnimation['samplers']) > 0:
             lib_animations.append(lGLTFAnimation)
 
 
-def CreateBufferView(pBufferIdx, pBuffer, appendBufferData, lib, pByteOffset, target=GL_ARRAY_BUFFER):
-    if pByteOffset % 4 == 2:
-        pBuffer.extend(b'\x00\x00')
-        pByteOffset += 2
-
-    pBuffer.extend(appendBufferData)
+# Buffer views only reference their data as a segment of the buffer, see glbwriter
+def CreateBufferView(pBufferIdx, pSegments, appendBufferData, lib, target=GL_ARRAY_BUFFER, pByteStride=None):
+    pByteOffset = glbwriter.AddSegment(pSegments, appendBufferData.GetSegmentData(), len(appendBufferData))
     lBufferViewIdx = len(lib_buffer_views)
     lBufferView = {
         "buffer": pBufferIdx,
         "byteLength": len(appendBufferData),
-        "byteOffset": pByteOffset,
-        # PENDING
-        # "byteStride": 0,
-        "target": target
+        "byteOffset": pByteOffset
     }
+    if target:
+        lBufferView['target'] = target
+    if pByteStride:
+        lBufferView['byteStride'] = pByteStride
     lib_buffer_views.append(lBufferView)
     for lAttrib in lib:
         lAttrib['bufferView'] = lBufferViewIdx
@@ -1164,18 +2399,183 @@ def CreateBufferView(pBufferIdx, pBuffer, appendBufferData, lib, pByteOffset, ta
     return lBufferView
 
 
-def CreateBufferViews(pBufferIdx, pBin):
+def CreateBufferViews(pBufferIdx, pSegments):
 
-    lByteOffset = CreateBufferView(pBufferIdx, pBin, attributeBuffer, lib_attributes_accessors, 0)['byteLength']
+    if len(lib_attributes_accessors) > 0:
+        CreateBufferView(pBufferIdx, pSegments, attributeBuffer, lib_attributes_accessors)
+
+    for lByteStride in sorted(stridedAttributeBuffers.keys()):
+        lBuffer, lAccessors = stridedAttributeBuffers[lByteStride]
+        CreateBufferView(pBufferIdx, pSegments, lBuffer, lAccessors, GL_ARRAY_BUFFER, lByteStride)
+
+    for lBuffer, lAccessors, lByteStride in interleavedAttributeBuffers:
+        CreateBufferView(pBufferIdx, pSegments, lBuffer, lAccessors, GL_ARRAY_BUFFER, lByteStride)
 
     if len(lib_ibm_accessors) > 0:
-        lByteOffset += CreateBufferView(pBufferIdx, pBin, invBindMatricesBuffer, lib_ibm_accessors, lByteOffset)['byteLength']
+        CreateBufferView(pBufferIdx, pSegments, invBindMatricesBuffer, lib_ibm_accessors)
 
     if len(lib_animation_accessors) > 0:
-        lByteOffset += CreateBufferView(pBufferIdx, pBin, animationBuffer, lib_animation_accessors, lByteOffset)['byteLength']
+        CreateBufferView(pBufferIdx, pSegments, animationBuffer, lib_animation_accessors)
+
+    if len(lib_instance_accessors) > 0:
+        CreateBufferView(pBufferIdx, pSegments, instancesBuffer, lib_instance_accessors, None)
+
+    # Buffer views of sparse accessors must not have a target
+    if len(lib_sparse_accessors) > 0:
+        CreateBufferView(pBufferIdx, pSegments, sparseBuffer, lib_sparse_accessors, None)
 
     #When creating a Float32Array, which the offset must be multiple of 4
-    CreateBufferView(pBufferIdx, pBin, indicesBuffer, lib_indices_accessors, lByteOffset, GL_ELEMENT_ARRAY_BUFFER)
+    if len(lib_indices_accessors) > 0:
+        CreateBufferView(pBufferIdx, pSegments, indicesBuffer, lib_indices_accessors, GL_ELEMENT_ARRAY_BUFFER)
+
+
+def RemapSceneAccessors(pRemap):
+    for lGLTFMesh in lib_meshes:
+        for lGLTFPrimitive in lGLTFMesh['primitives']:
+            for lSemantic in lGLTFPrimitive['attributes']:
+                lGLTFPrimitive['attributes'][lSemantic] = pRemap[lGLTFPrimitive['attributes'][lSemantic]]
+            if 'indices' in lGLTFPrimitive:
+                lGLTFPrimitive['indices'] = pRemap[lGLTFPrimitive['indices']]
+            for lTarget in lGLTFPrimitive.get('targets', []):
+                for lSemantic in lTarget:
+                    lTarget[lSemantic] = pRemap[lTarget[lSemantic]]
+    for lGLTFSkin in lib_skins:
+        if 'inverseBindMatrices' in lGLTFSkin:
+            lGLTFSkin['inverseBindMatrices'] = pRemap[lGLTFSkin['inverseBindMatrices']]
+    for lGLTFNode in lib_nodes:
+        lInstancing = lGLTFNode.get('extensions', {}).get('EXT_mesh_gpu_instancing')
+        if lInstancing:
+            for lSemantic in lInstancing['attributes']:
+                lInstancing['attributes'][lSemantic] = pRemap[lInstancing['attributes'][lSemantic]]
+
+# Remove the animations and their accessors from the scene, node indices are kept.
+# Returns each animation with the list of its accessors, its samplers index this list.
+def SplitAnimations():
+    lAnimationAccessors = set()
+    for lGLTFAnimation in lib_animations:
+        for lSampler in lGLTFAnimation['samplers']:
+            lAnimationAccessors.add(lSampler['input'])
+            lAnimationAccessors.add(lSampler['output'])
+
+    lSplitAnimations = []
+    for lGLTFAnimation in lib_animations:
+        # Accessors shared by several animations are written to each of their files
+        lAccessors = []
+        lAccessorIdxMap = {}
+        for lSampler in lGLTFAnimation['samplers']:
+            for lKey in ('input', 'output'):
+                if not lSampler[lKey] in lAccessorIdxMap:
+                    lAccessorIdxMap[lSampler[lKey]] = len(lAccessors)
+                    lAccessors.append(lib_accessors[lSampler[lKey]])
+                lSampler[lKey] = lAccessorIdxMap[lSampler[lKey]]
+        lSplitAnimations.append((lGLTFAnimation, lAccessors))
+
+    lRemap = {}
+    lSceneAccessors = []
+    for i in range(len(lib_accessors)):
+        if not i in lAnimationAccessors:
+            lRemap[i] = len(lSceneAccessors)
+            lSceneAccessors.append(lib_accessors[i])
+    lib_accessors[:] = lSceneAccessors
+    RemapSceneAccessors(lRemap)
+    del lib_animation_accessors[:]
+    del lib_animations[:]
+    return lSplitAnimations
+
+# glTF file with only an animation, its channels target the nodes of the scene file
+def WriteAnimationFile(pPath, pGLTFAnimation, pAccessors, binary, beautify):
+    lStrides = {lType: lStride for lStride, lType in _accessorTypes.items()}
+    lSegments = []
+    lGLTFAccessors = []
+    for lGLTFAccessor in pAccessors:
+        lGLTFAccessor = dict(lGLTFAccessor)
+        lByteLength = lGLTFAccessor['count'] * lStrides[lGLTFAccessor['type']] * _componentSizes[lGLTFAccessor['componentType']]
+        lData = animationBuffer.ReadArray(np.uint8, lByteLength, lGLTFAccessor['byteOffset'])
+        lGLTFAccessor['byteOffset'] = glbwriter.AddSegment(lSegments, lData)
+        lGLTFAccessor['bufferView'] = 0
+        lGLTFAccessors.append(lGLTFAccessor)
+
+    lJSON = {
+        'asset': {
+            'generator': 'ClayGL - fbx2gltf',
+            'version': '2.0'
+        },
+        'accessors': lGLTFAccessors,
+        'bufferViews': [{
+            'buffer': 0,
+            'byteLength': glbwriter.GetSegmentsLength(lSegments),
+            'byteOffset': 0
+        }],
+        'buffers': [CreateBuffer(pPath, lSegments, binary)],
+        'animations': [pGLTFAnimation]
+    }
+    WriteGLTF(pPath, lJSON, lSegments, binary, beautify)
+
+# Animation files are named after the output file and the animation
+def GetAnimationFilePath(pOutputFile, pName, pUsedPaths):
+    lBasename, lExt = os.path.splitext(pOutputFile)
+    lName = re.sub(r'[^\w\-]+', '_', pName).strip('_') or 'animation'
+    lPath = '%s_%s%s' % (lBasename, lName, lExt)
+    i = 1
+    while lPath in pUsedPaths:
+        lPath = '%s_%s_%d%s' % (lBasename, lName, i, lExt)
+        i += 1
+    pUsedPaths.add(lPath)
+    return lPath
+
+
+def GetBufferBytes(pImageFiles):
+    return {
+        'attributes': len(attributeBuffer)
+            + sum(len(lBuffer) for lBuffer, lAccessors in stridedAttributeBuffers.values())
+            + sum(len(lBuffer) for lBuffer, lAccessors, lByteStride in interleavedAttributeBuffers),
+        'indices': len(indicesBuffer),
+        'skins': len(invBindMatricesBuffer),
+        'animations': len(animationBuffer),
+        'instances': len(instancesBuffer),
+        'sparse': len(sparseBuffer),
+        'images': sum(os.path.getsize(lImageFile[0]) for lImageFile in pImageFiles if lImageFile)
+    }
+
+
+def ReadInstanceAccessor(pAccessorIdx, pStride):
+    lGLTFAccessor = lib_accessors[pAccessorIdx]
+    lArray = instancesBuffer.ReadArray('<f4', lGLTFAccessor['count'] * pStride, lGLTFAccessor['byteOffset'])
+    return lArray.reshape(-1, pStride).copy()
+
+
+# Instance matrices of the EXT_mesh_gpu_instancing nodes, by node index
+def GetInstanceMatrices():
+    lInstanceMatrices = {}
+    for i in range(len(lib_nodes)):
+        lInstancing = lib_nodes[i].get('extensions', {}).get('EXT_mesh_gpu_instancing')
+        if not lInstancing:
+            continue
+        lAttributes = lInstancing['attributes']
+        lTranslations = ReadInstanceAccessor(lAttributes['TRANSLATION'], 3)
+        lRotations = ReadInstanceAccessor(lAttributes['ROTATION'], 4)
+        lScales = ReadInstanceAccessor(lAttributes['SCALE'], 3)
+        lInstanceMatrices[i] = [scenegraph.ComposeMatrix(lTranslations[k], lRotations[k], lScales[k]) for k in range(len(lTranslations))]
+    return lInstanceMatrices
+
+
+# Inverse bind matrices of the skins, by skin index
+def GetInverseBindMatrices():
+    lInverseBindMatrices = {}
+    for i in range(len(lib_skins)):
+        if not 'inverseBindMatrices' in lib_skins[i]:
+            continue
+        lGLTFAccessor = lib_accessors[lib_skins[i]['inverseBindMatrices']]
+        lArray = invBindMatricesBuffer.ReadArray('<f4', lGLTFAccessor['count'] * 16, lGLTFAccessor['byteOffset'])
+        # Column major matrices, read as the row vector matrices of scenegraph
+        lInverseBindMatrices[i] = lArray.reshape(-1, 4, 4).astype(np.float64)
+    return lInverseBindMatrices
+
+
+def WriteStats(pGLTF, pSceneIdx, pImageFiles, pPath):
+    lStats = stats.ComputeSceneStats(pGLTF, pSceneIdx, GetInstanceMatrices(), GetBufferBytes(pImageFiles), GetInverseBindMatrices())
+    with open(pPath, 'w') as lStatsFile:
+        lStatsFile.write(json.dumps(lStats, sort_keys = True, separators=(',', ':')))
 
 
 # Start from -1 and ignore the root node
@@ -1221,87 +2621,222 @@ def GetNodeIdx(pNode):
     return _nodeIdxMap[lId]
 
 
-def FindFileInDir(pFileName, pDir):
-    for root, dirs, files in os.walk(pDir):
-        for file in files:
-            if file == pFileName:
-                return os.path.join(root, file)
+# Texture paths written on Windows keep their backslashes
+def NormalizeImagePath(pUri):
+    return re.sub(r'[\\/]+', '/', pUri).replace('/', os.path.sep)
 
+# Lower case basename to the paths of all the files in a directory, walked once per directory
+_fileIndexMap = {}
+def GetFileIndex(pDir):
+    if pDir not in _fileIndexMap:
+        lFileIndex = {}
+        for root, dirs, files in os.walk(pDir):
+            for file in files:
+                lFileIndex.setdefault(file.lower(), []).append(os.path.join(root, file))
+        _fileIndexMap[pDir] = lFileIndex
+    return _fileIndexMap[pDir]
 
-def CorrectImagesPaths(pFilePath):
-    lFileFullPath = os.path.join(os.getcwd(), pFilePath)
-    lFileExtension = pFilePath.rsplit('.', 1)[1].lower()
+def FindFileInDir(pFileName, pDir):
+    lPaths = GetFileIndex(pDir).get(pFileName.lower())
+    if not lPaths:
+        return None
+    # Prefer the file with the exact same case, then the first one walked
+    for lPath in lPaths:
+        if os.path.basename(lPath) == pFileName:
+            return lPath
+    return lPaths[0]
+
+
+# Images decoded from glTF inputs, removed at exit with the temp directory
+def GetEmbeddedImageDir():
+    return os.path.join(spillbuffer.GetTempDir(), 'images')
+
+# Images of the texture cache or decoded from glTF inputs, not next to the input file
+def IsCachedImage(pPath):
+    lDir = os.path.dirname(os.path.abspath(pPath))
+    return lDir in (os.path.abspath(ENV_TEXTURE_CACHE_DIR), os.path.abspath(GetEmbeddedImageDir()))
+
+def GetImageFileDir(pUri, pFilePath):
+    # FBX SDK extracts zip input files to temp folder, so use the image uri instead to find temp folder
+    if pFilePath.rsplit('.', 1)[1].lower() == 'zip':
+        return os.path.dirname(NormalizeImagePath(pUri))
+    return os.path.dirname(os.path.join(os.getcwd(), pFilePath))
+
+
+# Remove images with the same content, textures use the first one
+def RemoveDuplicateImages(pImageFiles):
+    lImageIdxMap = {}
+    lRemap = []
+    lImages = []
+    lFiles = []
+    for i in range(len(lib_images)):
+        lDigest = pImageFiles[i][1] if pImageFiles[i] else None
+        if lDigest is not None and lDigest in lImageIdxMap:
+            lRemap.append(lImageIdxMap[lDigest])
+            continue
+        if lDigest is not None:
+            lImageIdxMap[lDigest] = len(lImages)
+        lRemap.append(len(lImages))
+        lImages.append(lib_images[i])
+        lFiles.append(pImageFiles[i])
+
+    if len(lImages) < len(lib_images):
+        print('Removed %d duplicate images' % (len(lib_images) - len(lImages)))
+    lib_images[:] = lImages
+    for lGLTFTexture in lib_textures:
+        if 'source' in lGLTFTexture:
+            lGLTFTexture['source'] = lRemap[lGLTFTexture['source']]
+    return lFiles
+
+
+# Find, hash and resize the files of all images on a thread pool.
+# Returns the (path, content hash, mime type) of each image after duplicates are removed, None if not found.
+def PrepareImages(pFilePath, pBinary):
+    lPaths = []
     for lGLTFImage in lib_images:
         lUri = lGLTFImage['uri']
-        lUri = lUri.replace(r'[\\\/]+', os.path.sep)
-        # FBX SDK extracts zip input files to temp folder, so use lGLTFImage uri instead to find temp folder
-        if lFileExtension == 'zip':
-            lFileDir = os.path.dirname(lGLTFImage['uri'])
+        # Images of the cache directory are used as is, see CorrectImagesPaths
+        if (not pBinary and not IsCachedImage(lUri)) or not os.path.isfile(lUri):
+            lUri = FindFileInDir(os.path.basename(NormalizeImagePath(lUri)), GetImageFileDir(lUri, pFilePath))
+        lPaths.append(lUri)
+
+    lImageFiles = textures.ProcessTextures(lPaths, ENV_TEXTURE_MAX_SIZE, ENV_TEXTURE_POWER_OF_TWO, ENV_TEXTURE_CACHE_DIR)
+    for i in range(len(lib_images)):
+        if lImageFiles[i] is None:
+            print("Can\'t find texture file in the folder, path: " + lib_images[i]['uri'])
+        elif lPaths[i] != lImageFiles[i][0]:
+            print('Resized texture file "' + lPaths[i] + '" to "' + lImageFiles[i][0] + '"')
+    return RemoveDuplicateImages(lImageFiles)
+
+
+def CorrectImagesPaths(pFilePath, pImageFiles):
+    lOutputDir = os.path.dirname(args.output)
+    lCopies = []
+    for lGLTFImage, lImageFile in zip(lib_images, pImageFiles):
+        if not lImageFile:
+            continue
+        lUri, lDigest, lMimeType = lImageFile
+        lFileDir = GetImageFileDir(lGLTFImage['uri'], pFilePath)
+        if IsCachedImage(lUri):
+            # Resized images are always copied next to the output file
+            lRelUri = os.path.join('textures', os.path.basename(lUri))
+            lCopies.append((lUri, os.path.join(lOutputDir, lRelUri)))
         else:
-            lFileDir = os.path.dirname(lFileFullPath)
-        lUri = FindFileInDir(os.path.basename(lUri), lFileDir)
-        if lUri:
             lRelUri = os.path.relpath(lUri, lFileDir)
             # If an alternative output directory is specified, copy all textures to output directory
             if lOutputDirSpecified:
-                lOutputDir = os.path.dirname(args.output)
-                # If textures are in a dir and that dir does not yet exist, create it
-                lRelTextureDir = os.path.dirname(lRelUri)
-                lFullTextureDir = os.path.join(lOutputDir, lRelTextureDir)
-                if not os.path.exists(lFullTextureDir):
-                    os.makedirs(lFullTextureDir)
-                shutil.copyfile(lUri, os.path.join(lOutputDir, lRelUri))
-            if not lRelUri == lGLTFImage['uri']:
-                print('Changed texture file path from "' + lGLTFImage['uri'] + '" to "' + lRelUri + '"')
-            lGLTFImage['uri'] = lRelUri
-        else:
-            print("Can\'t find texture file in the folder, path: " + lGLTFImage['uri'])
-
-
-def EmbedImagesToBinary(pBuffer, pFilePath):
-    lFileFullPath = os.path.join(os.getcwd(), pFilePath)
-    lFileDir = os.path.dirname(lFileFullPath)
-    for lGLTFImage in lib_images:
-        lUri = lGLTFImage['uri']
-        lImgBytes = None
-
-        if not os.path.isfile(lUri):
-            lUri = lUri.replace(r'[\\\/]+', os.path.sep)
-            lUri = FindFileInDir(os.path.basename(lUri), lFileDir)
-        try:
-            f = open(lUri, 'rb')
-            lImgBytes = f.read()
-        except:
-            print("Can\'t find texture file in the folder, path: " + lGLTFImage['uri'])
-
-        if not lImgBytes:
+                lCopies.append((lUri, os.path.join(lOutputDir, lRelUri)))
+        lRelUri = lRelUri.replace(os.path.sep, '/')
+        if not lRelUri == lGLTFImage['uri']:
+            print('Changed texture file path from "' + lGLTFImage['uri'] + '" to "' + lRelUri + '"')
+        lGLTFImage['uri'] = lRelUri
+        if lMimeType:
+            lGLTFImage['mimeType'] = lMimeType
+    textures.CopyFiles(lCopies)
+
+
+def EmbedImagesToBinary(pSegments, pImageFiles):
+    for lGLTFImage, lImageFile in zip(lib_images, pImageFiles):
+        if not lImageFile:
             continue
+        lUri, lDigest, lMimeType = lImageFile
 
         lBufferViewIdx = len(lib_buffer_views)
 
         lGLTFImage['bufferView'] = lBufferViewIdx
         del lGLTFImage['uri']
+        if lMimeType:
+            lGLTFImage['mimeType'] = lMimeType
 
+        # Images are streamed from their file when writing, only their size is needed here
         lBufferView = {
             'buffer': 0,
-            'byteLength': len(lImgBytes),
-            'byteOffset': len(pBuffer)
-            # TODO Mime type
+            'byteLength': os.path.getsize(lUri),
+            'byteOffset': glbwriter.AddFileSegment(pSegments, lUri)
         }
 
         lib_buffer_views.append(lBufferView)
 
-        pBuffer.extend(lImgBytes)
-        # 4-byte-aligned
-        lAlignedLen = (len(lImgBytes) + 3) & ~3
-        for i in range(lAlignedLen - len(lImgBytes)):
-            pBuffer.extend(b' ')
-
-    return pBuffer
-
 # FIXME
 # http://help.autodesk.com/view/FBX/2017/ENU/?guid=__cpp_ref_fbxtime_8h_html
-TIME_INFINITY = FbxTime(0x7fffffffffffffff)
+TIME_INFINITY = FbxTime(0x7fffffffffffffff) if HAS_FBX_SDK else None
+
+# Load a file with the FBX SDK and convert its scene and animations.
+# Returns if the file was loaded, and the index of the scene.
+def ConvertFBX(filePath, ignoreScene, ignoreAnimation, animFrameRate, startTime, duration, poseTime):
+    if not HAS_FBX_SDK:
+        print(FBX_SDK_MESSAGE)
+        sys.exit(1)
+    # Prepare the FBX SDK.
+    lSdkManager, lScene = InitializeSdkObjects()
+    fbxConverter = FbxGeometryConverter(lSdkManager)
+    # Load the scene.
+    lResult = LoadScene(lSdkManager, lScene, filePath)
+
+    if not lResult:
+        print("\n\nAn error occurred while loading the scene...")
+        return False, None
+
+    # PENDING, if it will affect the conversion after.
+    FbxAxisSystem.OpenGL.ConvertScene(lScene)
+
+    # Do it before SplitMeshesPerMaterial or the vertices of split mesh will be wrong.
+    PrepareBakeTransform(lScene.GetRootNode())
+    lScene.GetRootNode().ConvertPivotAnimationRecursive(None, FbxNode.eDestinationPivot, 60)
+
+    # PENDING Triangulate before SplitMeshesPerMaterial or it will not work.
+    fbxConverter.Triangulate(lScene, True)
+
+    # SplitMeshPerMaterial will fail if the mapped material is not per face (FbxLayerElement::eByPolygon) or if a material is multi-layered.
+    # http://help.autodesk.com/view/FBX/2017/ENU/?guid=__cpp_ref_class_fbx_geometry_converter_html
+    # TODO May have bug
+    # if not fbxConverter.SplitMeshesPerMaterial(lScene, True):
+    #     print('SplitMeshesPerMaterial fail')
+
+    PrepareSceneNode(lScene.GetRootNode())
+
+    lSceneIdx = None
+    if not ignoreScene:
+        lSceneIdx = ConvertScene(lScene, poseTime)
+    if not ignoreAnimation and len(ENV_ANIMATION_RANGES) > 0:
+        for lName, lStartTime, lDuration in ENV_ANIMATION_RANGES:
+            ConvertAnimation(lScene, animFrameRate, lStartTime, lDuration, lName)
+    elif not ignoreAnimation:
+        ConvertAnimation(lScene, animFrameRate, startTime, duration)
+    if spillbuffer.HasBudget():
+        # Everything is converted, the fbx scene is not kept in memory while encoding and writing
+        lSdkManager.Destroy()
+    return True, lSceneIdx
+
+# Buffer of the segments, in the GLB or in a .bin file next to the glTF file
+def CreateBuffer(pPath, pSegments, binary):
+    lBinLength = glbwriter.GetSegmentsLength(pSegments)
+    if binary:
+        return {
+            'byteLength' : glbwriter.Align(lBinLength)
+        }
+    return {
+        'byteLength' : lBinLength,
+        'uri' : os.path.basename(os.path.splitext(pPath)[0] + '.bin')
+    }
+
+def WriteGLTF(pPath, pJSON, pSegments, binary, beautify):
+    if binary:
+        lJSONStr = json.dumps(pJSON, sort_keys = True, separators=(',', ':'))
+        glbwriter.WriteGLB(pPath, lJSONStr.encode(encoding='UTF-8'), pSegments)
+
+    else:
+        lOutFile = open(pPath, 'w')
+        glbwriter.WriteBin(os.path.splitext(pPath)[0] + ".bin", pSegments)
+
+        indent = None
+        seperator = ':'
+
+        if beautify:
+            indent = 2
+            seperator = ': '
+        lOutFile.write(json.dumps(pJSON, indent = indent, sort_keys = True, separators=(',', seperator)))
+        lOutFile.close()
 
 def Convert(
     filePath,
@@ -1316,130 +2851,100 @@ def Convert(
 ):
     ignoreScene = 'scene' in excluded
     ignoreAnimation = 'animation' in excluded
-    # Prepare the FBX SDK.
-    lSdkManager, lScene = InitializeSdkObjects()
-    fbxConverter = FbxGeometryConverter(lSdkManager)
-    # Load the scene.
-    lResult = LoadScene(lSdkManager, lScene, filePath)
-
-    if not lResult:
-        print("\n\nAn error occurred while loading the scene...")
+    lExtension = filePath.rsplit('.', 1)[-1].lower()
+    if lExtension == 'obj':
+        # OBJ files have no animation
+        lSceneIdx = ConvertOBJ(filePath)
+        ignoreScene = False
+    elif lExtension in ('gltf', 'glb', 'json'):
+        # Cached scenes are glTF JSON files, see scenecache.
+        # Animations target the nodes of the scene, it's always converted
+        lResult, lSceneIdx = ConvertGLTF(filePath, ignoreAnimation)
+        ignoreScene = False
+        if not lResult:
+            return
     else:
-        lBasename, lExt = os.path.splitext(ouptutFile)
-
-        # PENDING, if it will affect the conversion after.
-        FbxAxisSystem.OpenGL.ConvertScene(lScene)
-
-        # Do it before SplitMeshesPerMaterial or the vertices of split mesh will be wrong.
-        PrepareBakeTransform(lScene.GetRootNode())
-        lScene.GetRootNode().ConvertPivotAnimationRecursive(None, FbxNode.eDestinationPivot, 60)
-
-        # PENDING Triangulate before SplitMeshesPerMaterial or it will not work.
-        fbxConverter.Triangulate(lScene, True)
-
-        # SplitMeshPerMaterial will fail if the mapped material is not per face (FbxLayerElement::eByPolygon) or if a material is multi-layered.
-        # http://help.autodesk.com/view/FBX/2017/ENU/?guid=__cpp_ref_class_fbx_geometry_converter_html
-        # TODO May have bug
-        # if not fbxConverter.SplitMeshesPerMaterial(lScene, True):
-        #     print('SplitMeshesPerMaterial fail')
-
-        PrepareSceneNode(lScene.GetRootNode())
-
-        if not ignoreScene:
-            lSceneIdx = ConvertScene(lScene, poseTime)
-        if not ignoreAnimation:
-            ConvertAnimation(lScene, animFrameRate, startTime, duration)
-
-        #Merge binary data and write to a binary file
-        lBin = bytearray()
-
-        CreateBufferViews(0, lBin)
-
-        if binary:
-            lBin = EmbedImagesToBinary(lBin, filePath)
-        else:
-            CorrectImagesPaths(filePath)
-
-        lBufferName = lBasename + '.bin'
-        if binary:
-            lib_buffers.append({
-                'byteLength' : len(lBin)
-            })
-        else:
-            lib_buffers.append({
-                'byteLength' : len(lBin),
-                'uri' : os.path.basename(lBufferName)
-            })
-
-        #Output json
-        lJSON = {
-            'asset': {
-                'generator': 'ClayGL - fbx2gltf',
-                'version': '2.0'
-            },
-            'accessors' : lib_accessors,
-            'bufferViews' : lib_buffer_views,
-            'buffers' : lib_buffers,
-            'nodes' : lib_nodes,
-            'scenes' : lib_scenes,
-            'meshes' : lib_meshes,
-        }
-        if len(lib_cameras) > 0:
-            lJSON['cameras'] = lib_cameras
-        if len(lib_skins) > 0:
-            lJSON['skins'] = lib_skins
-        if len(lib_materials) > 0:
-            lJSON['materials'] = lib_materials
-        if len(lib_images) > 0:
-            lJSON['images'] = lib_images
-        if len(lib_samplers) > 0:
-            lJSON['samplers'] = lib_samplers
-        if len(lib_textures) > 0:
-            lJSON['textures'] = lib_textures
-        if len(lib_animations) > 0:
-            lJSON['animations'] = lib_animations
-        #Default scene
-        if not ignoreScene:
-            lJSON['scene'] = lSceneIdx
-
-        if binary:
-            lOutFile = open(ouptutFile, 'wb')
-            lJSONStr = json.dumps(lJSON, sort_keys = True, separators=(',', ':'))
-            lJSONBinary = bytearray(lJSONStr.encode(encoding='UTF-8'))
-            # 4-byte-aligned
-            lAlignedLen = (len(lJSONBinary) + 3) & ~3
-            for i in range(lAlignedLen - len(lJSONBinary)):
-                lJSONBinary.extend(b' ')
-
-            lOut = bytearray()
-            lSize = 12 + 8 + len(lJSONBinary) + 8 + len(lBin)
-            # Magic number
-            lOut.extend(struct.pack('<I', 0x46546C67))
-            lOut.extend(struct.pack('<I', 2))
-            lOut.extend(struct.pack('<I', lSize))
-            lOut.extend(struct.pack('<I', len(lJSONBinary)))
-            lOut.extend(struct.pack('<I', 0x4E4F534A))
-            lOut += lJSONBinary
-            lOut.extend(struct.pack('<I', len(lBin)))
-            lOut.extend(struct.pack('<I', 0x004E4942))
-            lOut += lBin
-            lOutFile.write(lOut)
-            lOutFile.close()
-
-        else:
-            lOutFile = open(ouptutFile, 'w')
-            lBinFile = open(lBasename + ".bin", 'wb')
-            lBinFile.write(lBin)
-            lBinFile.close()
-
-            indent = None
-            seperator = ':'
-
-            if beautify:
-                indent = 2
-                seperator = ': '
-            lOutFile.write(json.dumps(lJSON, indent = indent, sort_keys = True, separators=(',', seperator)))
-            lOutFile.close()
+        lResult, lSceneIdx = ConvertFBX(filePath, ignoreScene, ignoreAnimation, animFrameRate, startTime, duration, poseTime)
+        if not lResult:
+            return
+
+    if not ignoreScene and ENV_BATCH_STATIC_MESHES:
+        BatchStaticMeshes(lSceneIdx)
+        CreateDeferredMeshes()
+    if not ignoreScene and ENV_GPU_INSTANCING > 0:
+        CreateGPUInstances(lSceneIdx, ENV_GPU_INSTANCING)
+    if not ignoreScene:
+        if ENV_COMPACT_SCENE:
+            CompactSceneGraph()
+        scenegraph.EmitNodeTransforms(lib_nodes, lib_animations)
+
+    # Animations are moved out of the scene before its buffer views are created
+    lSplitAnimations = []
+    if ENV_SPLIT_ANIMATIONS:
+        lSplitAnimations = SplitAnimations()
+
+    # Plan the layout of the binary buffer, the data is only written with the output file
+    lSegments = []
+
+    CreateBufferViews(0, lSegments)
+
+    lImageFiles = PrepareImages(filePath, binary)
+    if binary:
+        EmbedImagesToBinary(lSegments, lImageFiles)
+    else:
+        CorrectImagesPaths(filePath, lImageFiles)
+
+    lib_buffers.append(CreateBuffer(ouptutFile, lSegments, binary))
+
+    #Output json
+    lJSON = {
+        'asset': {
+            'generator': 'ClayGL - fbx2gltf',
+            'version': '2.0'
+        },
+        'accessors' : lib_accessors,
+        'bufferViews' : lib_buffer_views,
+        'buffers' : lib_buffers,
+        'nodes' : lib_nodes,
+        'scenes' : lib_scenes,
+        'meshes' : lib_meshes,
+    }
+    if len(lib_cameras) > 0:
+        lJSON['cameras'] = lib_cameras
+    if len(lib_skins) > 0:
+        lJSON['skins'] = lib_skins
+    if len(lib_materials) > 0:
+        lJSON['materials'] = lib_materials
+    if len(lib_images) > 0:
+        lJSON['images'] = lib_images
+    if len(lib_samplers) > 0:
+        lJSON['samplers'] = lib_samplers
+    if len(lib_textures) > 0:
+        lJSON['textures'] = lib_textures
+    if len(lib_animations) > 0:
+        lJSON['animations'] = lib_animations
+    if len(lib_extensions_used) > 0:
+        lJSON['extensionsUsed'] = lib_extensions_used
+    if len(lib_extensions_required) > 0:
+        lJSON['extensionsRequired'] = lib_extensions_required
+    if len(lib_extensions) > 0:
+        lJSON['extensions'] = lib_extensions
+    #Default scene
+    if not ignoreScene:
+        lJSON['scene'] = lSceneIdx
+        if ENV_STATS_PATH:
+            lStatsJSON = lJSON
+            if len(lSplitAnimations) > 0:
+                lStatsJSON = dict(lJSON, animations=[lGLTFAnimation for lGLTFAnimation, lAccessors in lSplitAnimations])
+            WriteStats(lStatsJSON, lSceneIdx, lImageFiles, ENV_STATS_PATH)
+
+    WriteGLTF(ouptutFile, lJSON, lSegments, binary, beautify)
+
+    lUsedPaths = set([ouptutFile])
+    for lGLTFAnimation, lAccessors in lSplitAnimations:
+        lPath = GetAnimationFilePath(ouptutFile, lGLTFAnimation['name'], lUsedPaths)
+        WriteAnimationFile(lPath, lGLTFAnimation, lAccessors, binary, beautify)
+        print('Wrote animation %s to %s' % (lGLTFAnimation['name'], lPath))
 
 if __name__ == "__main__":
 
@@ -1448,8 +2953,36 @@ if __name__ == "__main__":
     parser.add_argument('-t', '--timerange', default='0,1000', type=str, help="Export animation time, in format 'startSecond,endSecond'")
     parser.add_argument('-o', '--output', default='', type=str, help="Ouput glTF file path")
     parser.add_argument('-f', '--framerate', default=20, type=float, help="Animation frame per second")
+    parser.add_argument('--anim-translation-error', default=1e-3, type=float, help="Max translation error of sampled and reduced animation")
+    parser.add_argument('--anim-rotation-error', default=1e-3, type=float, help="Max rotation error of sampled and reduced animation, in radians")
+    parser.add_argument('--anim-scale-error', default=1e-4, type=float, help="Max scale error of sampled and reduced animation")
+    parser.add_argument('--anim-weight-error', default=1e-3, type=float, help="Max morph target weight error of sampled and reduced animation")
     parser.add_argument('-p', '--pose', default=0, type=float, help="Start pose time")
     parser.add_argument('-q', '--quantize', action='store_true', help="Quantize accessors with WEB3D_quantized_attributes extension")
+    parser.add_argument('--mesh-quantization', action='store_true', help="Quantize mesh attributes with KHR_mesh_quantization extension")
+    parser.add_argument('--interleave', action='store_true', help="Interleave vertex attributes of each primitive in one buffer view")
+    parser.add_argument('--split-indices', action='store_true', help="Split primitives of more than 65535 vertices so all indices are 16 bits")
+    parser.add_argument('--generate-normals', action='store_true', help="Generate smooth normals for meshes without normals")
+    parser.add_argument('--crease-angle', default=60, type=float, help="Edges sharper than this angle in degrees keep hard generated normals, 180 to smooth all edges")
+    parser.add_argument('--generate-tangents', action='store_true', help="Generate MikkTSpace tangents for primitives of normal mapped materials")
+    parser.add_argument('--vertex-cache', action='store_true', help="Reorder triangles and vertices of each primitive for the GPU vertex cache")
+    parser.add_argument('--lod', default='', type=str, help="Add MSFT_lod levels simplified to these triangle ratios, in format '0.5,0.25'")
+    parser.add_argument('--simplify', default=1.0, type=float, help="Simplify all meshes to this triangle ratio")
+    parser.add_argument('--batch', action='store_true', help="Merge static meshes sharing a material in world space. Node indices change, don't use it for scene and animation exported in separate runs, use --split-animations instead")
+    parser.add_argument('--compact', action='store_true', help="Remove empty nodes and collapse chains of helper nodes. Node indices change, don't use it for scene and animation exported in separate runs, use --split-animations instead")
+    parser.add_argument('--gpu-instancing', default=0, type=int, help="Draw meshes used by at least this count of static nodes with EXT_mesh_gpu_instancing, 0 to disable")
+    parser.add_argument('--quantize-position-error', default=1e-5, type=float, help="Max quantized position error relative to the bounding box size")
+    parser.add_argument('--quantize-normal-bits', default=10, type=int, help="Bits of quantized normals")
+    parser.add_argument('--quantize-texcoord-bits', default=12, type=int, help="Bits of quantized texcoords")
+    parser.add_argument('--texture-max-size', default=0, type=int, help="Downscale textures larger than this width or height, 0 to keep their size. Needs Pillow")
+    parser.add_argument('--texture-pot', action='store_true', help="Resize textures to powers of two. Needs Pillow")
+    parser.add_argument('--texture-cache', default=ENV_TEXTURE_CACHE_DIR, type=str, help="Directory of the resized textures, reused across conversions")
+    parser.add_argument('--stats', default='', type=str, help="Write bounds, counts and buffer sizes of the scene to this JSON file")
+    parser.add_argument('--split-animations', action='store_true', help="Write each animation to its own file next to the output file, its channels target the nodes of the output file")
+    parser.add_argument('--animation-ranges', default='', type=str, help="Sample an animation from each fbx anim stack for each of these time ranges, in format 'name:startSecond,endSecond;name:startSecond,endSecond'")
+    parser.add_argument('--memory-budget', default=0, type=float, help="Keep about this many MB of buffers and meshes in memory, the rest is spilled to memory mapped temp files. 0 to keep everything in memory")
+    parser.add_argument('--temp-dir', default='', type=str, help="Directory of the temp files spilled above the memory budget, default is the system temp directory")
+    parser.add_argument('--save-cache', default='', type=str, help="Save the scene to this directory before any encoding stage instead of converting it. Convert the scene.json of the directory to export it again without loading the source file")
     parser.add_argument('-b', '--binary', action="store_true", help="Export glTF-binary")
     parser.add_argument('--beautify', action="store_true", help="Beautify json output.")
 
@@ -1477,13 +3010,83 @@ if __name__ == "__main__":
         lOutputDirSpecified = True
 
     # PENDING Not use INFINITY poseTime or some joint transform without animation maybe not right.
-    lPoseTime = FbxTime()
-    lPoseTime.SetSecondDouble(float(args.pose))
+    lPoseTime = None
+    if HAS_FBX_SDK:
+        lPoseTime = FbxTime()
+        lPoseTime.SetSecondDouble(float(args.pose))
 
     excluded = args.exclude.split(',')
 
     ENV_QUANTIZE = args.quantize
+    ENV_MESH_QUANTIZATION = args.mesh_quantization
+    ENV_INTERLEAVE = args.interleave
+    ENV_OPTIMIZE_VERTEX_CACHE = args.vertex_cache
+    ENV_SPLIT_INDICES = args.split_indices
+    ENV_GENERATE_NORMALS = args.generate_normals
+    ENV_CREASE_ANGLE = args.crease_angle
+    ENV_GENERATE_TANGENTS = args.generate_tangents
+    ENV_BATCH_STATIC_MESHES = args.batch
+    ENV_LOD_RATIOS = [float(lRatio) for lRatio in args.lod.split(',') if lRatio]
+    ENV_SIMPLIFY_RATIO = args.simplify
+    ENV_GPU_INSTANCING = args.gpu_instancing
+    ENV_COMPACT_SCENE = args.compact
+    ENV_ANIMATION_TRANSLATION_ERROR = args.anim_translation_error
+    ENV_ANIMATION_ROTATION_ERROR = args.anim_rotation_error
+    ENV_ANIMATION_WEIGHT_ERROR = args.anim_weight_error
+    ENV_ANIMATION_SCALE_ERROR = args.anim_scale_error
+    ENV_QUANTIZE_POSITION_ERROR = args.quantize_position_error
+    ENV_QUANTIZE_NORMAL_BITS = min(max(args.quantize_normal_bits, 1), 16)
+    ENV_QUANTIZE_TEXCOORD_BITS = min(max(args.quantize_texcoord_bits, 1), 16)
     ENV_FLIP_V = not args.noflipv
+    ENV_TEXTURE_MAX_SIZE = max(args.texture_max_size, 0)
+    ENV_TEXTURE_POWER_OF_TWO = args.texture_pot
+    ENV_TEXTURE_CACHE_DIR = args.texture_cache
+    ENV_STATS_PATH = args.stats
+    ENV_SPLIT_ANIMATIONS = args.split_animations
+    ENV_ANIMATION_RANGES = []
+    for lRange in args.animation_ranges.split(';'):
+        if not lRange:
+            continue
+        lRangeError = "Invalid animation range '%s', expected format 'name:startSecond,endSecond;name:startSecond,endSecond'" % lRange
+        if not ':' in lRange:
+            parser.error(lRangeError)
+        lName, lTimes = lRange.rsplit(':', 1)
+        lTimes = lTimes.split(',')
+        if not lName or len(lTimes) != 2:
+            parser.error(lRangeError)
+        try:
+            lStart, lEnd = [float(lTime) for lTime in lTimes]
+        except ValueError:
+            parser.error(lRangeError)
+        if lEnd < lStart:
+            parser.error(lRangeError + ", end before start")
+        ENV_ANIMATION_RANGES.append((lName, lStart, lEnd - lStart))
+    spillbuffer.SetBudget(int(args.memory_budget * 1024 * 1024), args.temp_dir or None)
+
+    if args.save_cache:
+        # Everything the encode stages may change is kept: no quantization, simplification,
+        # scene graph changes, keyframe reduction or texture resizing
+        ENV_QUANTIZE = ENV_MESH_QUANTIZATION = ENV_INTERLEAVE = False
+        ENV_OPTIMIZE_VERTEX_CACHE = ENV_SPLIT_INDICES = False
+        ENV_GENERATE_NORMALS = ENV_GENERATE_TANGENTS = False
+        ENV_BATCH_STATIC_MESHES = ENV_COMPACT_SCENE = False
+        ENV_LOD_RATIOS = []
+        ENV_SIMPLIFY_RATIO = 1.0
+        ENV_GPU_INSTANCING = 0
+        ENV_ANIMATION_TRANSLATION_ERROR = ENV_ANIMATION_ROTATION_ERROR = 0
+        ENV_ANIMATION_SCALE_ERROR = ENV_ANIMATION_WEIGHT_ERROR = 0
+        ENV_TEXTURE_MAX_SIZE = 0
+        ENV_TEXTURE_POWER_OF_TWO = False
+        ENV_STATS_PATH = ''
+        ENV_SPLIT_ANIMATIONS = False
+        os.makedirs(args.save_cache, exist_ok=True)
+        # Converted to a GLB first, its accessors are then decoded to the cache
+        args.output = os.path.join(args.save_cache, 'scene.glb')
+        Convert(args.file, args.output, excluded, 1 / args.framerate, lStartTime, lDuration, lPoseTime, False, True)
+        if os.path.isfile(args.output):
+            scenecache.WriteSceneCache(args.output, args.save_cache)
+            os.remove(args.output)
+        sys.exit(0)
 
     Convert(
         args.file,
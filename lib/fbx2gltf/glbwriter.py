@@ -0,0 +1,85 @@
+# ############################################
+# Streaming writer of the binary buffer, independent from the FBX SDK.
+# The buffer is planned as a list of segments (byteOffset, data, byteLength) where data is
+# a bytes-like object or the path of a file (embedded images). Offsets and chunk lengths
+# are known before writing, so every segment is written directly to the output file
+# without merging them in memory first.
+# ############################################
+import os, struct, shutil
+
+GLB_MAGIC = 0x46546C67
+GLB_VERSION = 2
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+
+def Align(pLength, pAlignment=4):
+    return (pLength + pAlignment - 1) // pAlignment * pAlignment
+
+def GetSegmentsLength(pSegments):
+    if len(pSegments) == 0:
+        return 0
+    lOffset, lData, lLength = pSegments[-1]
+    return lOffset + lLength
+
+# Append data at the next 4-byte-aligned offset of the buffer, returns the byte offset
+def AddSegment(pSegments, pData, pLength=None):
+    if pLength is None:
+        pLength = len(pData)
+    lOffset = Align(GetSegmentsLength(pSegments))
+    pSegments.append((lOffset, pData, pLength))
+    return lOffset
+
+def AddFileSegment(pSegments, pPath):
+    return AddSegment(pSegments, pPath, os.path.getsize(pPath))
+
+def CopyFile(pOut, pPath, pLength):
+    with open(pPath, 'rb') as lIn:
+        if hasattr(os, 'sendfile'):
+            # Kernel copy, the file never goes through python memory
+            pOut.flush()
+            lOffset = 0
+            while lOffset < pLength:
+                lSent = os.sendfile(pOut.fileno(), lIn.fileno(), lOffset, pLength - lOffset)
+                if lSent == 0:
+                    break
+                lOffset += lSent
+            pOut.seek(0, os.SEEK_END)
+            if lOffset == pLength:
+                return
+            lIn.seek(lOffset)
+        shutil.copyfileobj(lIn, pOut)
+
+# Write the segments with zero padding in between, up to pLength bytes
+def WriteSegments(pOut, pSegments, pLength, pPadding=b'\x00'):
+    lPosition = 0
+    for lOffset, lData, lLength in pSegments:
+        if lOffset > lPosition:
+            pOut.write(pPadding * (lOffset - lPosition))
+        if isinstance(lData, str):
+            CopyFile(pOut, lData, lLength)
+        else:
+            pOut.write(memoryview(lData))
+        lPosition = lOffset + lLength
+    if pLength > lPosition:
+        pOut.write(pPadding * (pLength - lPosition))
+
+def WriteBin(pPath, pSegments):
+    with open(pPath, 'wb') as lOut:
+        WriteSegments(lOut, pSegments, GetSegmentsLength(pSegments))
+
+# https://github.com/KhronosGroup/glTF/tree/master/specification/2.0#glb-file-format-specification
+def WriteGLB(pPath, pJSONBinary, pSegments):
+    lJSONLength = Align(len(pJSONBinary))
+    lBinLength = Align(GetSegmentsLength(pSegments))
+    lSize = 12 + 8 + lJSONLength
+    if lBinLength > 0:
+        lSize += 8 + lBinLength
+
+    with open(pPath, 'wb') as lOut:
+        lOut.write(struct.pack('<5I', GLB_MAGIC, GLB_VERSION, lSize, lJSONLength, GLB_CHUNK_JSON))
+        lOut.write(pJSONBinary)
+        # JSON chunk is padded with spaces
+        lOut.write(b' ' * (lJSONLength - len(pJSONBinary)))
+        if lBinLength > 0:
+            lOut.write(struct.pack('<2I', lBinLength, GLB_CHUNK_BIN))
+            WriteSegments(lOut, pSegments, lBinLength)
@@ -0,0 +1,168 @@
+# ############################################
+# Memory mapped reader of glTF 2.0 and GLB files, independent from the FBX SDK.
+# Buffers are mapped instead of read, accessors are numpy views on them and are only
+# copied when they are sparse or normalized.
+# https://github.com/KhronosGroup/glTF/tree/master/specification/2.0
+# ############################################
+import os, json, struct, mmap, base64
+from urllib.parse import unquote
+import numpy as np
+
+GLB_MAGIC = 0x46546C67
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+
+_componentDTypes = {
+    5120: 'i1',
+    5121: 'u1',
+    5122: '<i2',
+    5123: '<u2',
+    5125: '<u4',
+    5126: '<f4'
+}
+
+_typeSizes = {
+    'SCALAR': 1,
+    'VEC2': 2,
+    'VEC3': 3,
+    'VEC4': 4,
+    'MAT2': 4,
+    'MAT3': 9,
+    'MAT4': 16
+}
+
+def MapFile(pPath):
+    with open(pPath, 'rb') as lFile:
+        # Empty files can't be mapped
+        if os.fstat(lFile.fileno()).st_size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(lFile.fileno(), 0, access=mmap.ACCESS_READ))
+
+def ReadDataUri(pUri):
+    lHeader, lData = pUri.split(',', 1)
+    if lHeader.endswith(';base64'):
+        return memoryview(base64.b64decode(lData))
+    return memoryview(unquote(lData).encode('latin-1'))
+
+# JSON and BIN chunks of a GLB file, the BIN chunk is None if there is none
+def ReadGLBChunks(pData):
+    lMagic, lVersion, lLength = struct.unpack_from('<3I', pData, 0)
+    if lMagic != GLB_MAGIC or lVersion != 2:
+        raise ValueError('Not a glTF 2.0 binary file')
+    lJSON = None
+    lBin = None
+    lOffset = 12
+    while lOffset + 8 <= min(lLength, len(pData)):
+        lChunkLength, lChunkType = struct.unpack_from('<2I', pData, lOffset)
+        lChunk = pData[lOffset + 8:lOffset + 8 + lChunkLength]
+        if lChunkType == GLB_CHUNK_JSON and lJSON is None:
+            lJSON = lChunk
+        elif lChunkType == GLB_CHUNK_BIN and lBin is None:
+            lBin = lChunk
+        lOffset += 8 + lChunkLength
+    if lJSON is None:
+        raise ValueError('GLB file has no JSON chunk')
+    return lJSON, lBin
+
+# Path of a relative uri of a file next to the glTF file
+def GetUriPath(pGLTFPath, pUri):
+    return os.path.join(os.path.dirname(os.path.abspath(pGLTFPath)), unquote(pUri))
+
+# Returns the glTF JSON and the data of each of its buffers.
+# Accessors of cached scenes are .npy files instead, see scenecache.
+def ReadGLTF(pPath):
+    lData = MapFile(pPath)
+    lBin = None
+    if len(lData) >= 12 and struct.unpack_from('<I', lData, 0)[0] == GLB_MAGIC:
+        lJSON, lBin = ReadGLBChunks(lData)
+        lGLTF = json.loads(bytes(lJSON).decode('utf-8'))
+    else:
+        lGLTF = json.loads(bytes(lData).decode('utf-8'))
+
+    lBuffers = []
+    for i, lBuffer in enumerate(lGLTF.get('buffers', [])):
+        lUri = lBuffer.get('uri')
+        if lUri is None:
+            # Only the first buffer of a GLB file can be its BIN chunk
+            lBuffers.append(lBin if i == 0 and lBin is not None else memoryview(b''))
+        elif lUri.startswith('data:'):
+            lBuffers.append(ReadDataUri(lUri))
+        else:
+            lBuffers.append(MapFile(GetUriPath(pPath, lUri)))
+    for lAccessor in lGLTF.get('accessors', []):
+        if 'uri' in lAccessor:
+            lAccessor['uri'] = GetUriPath(pPath, lAccessor['uri'])
+    return lGLTF, lBuffers
+
+def GetBufferViewData(pGLTF, pBuffers, pBufferViewIdx):
+    lBufferView = pGLTF['bufferViews'][pBufferViewIdx]
+    lOffset = lBufferView.get('byteOffset', 0)
+    return pBuffers[lBufferView['buffer']][lOffset:lOffset + lBufferView['byteLength']]
+
+def ReadView(pGLTF, pBuffers, pBufferViewIdx, pByteOffset, pDType, pCount, pSize, pByteStride=0):
+    lDType = np.dtype(pDType)
+    return np.ndarray(
+        (pCount, pSize), lDType,
+        GetBufferViewData(pGLTF, pBuffers, pBufferViewIdx), pByteOffset,
+        (pByteStride or lDType.itemsize * pSize, lDType.itemsize)
+    )
+
+def Denormalize(pArray):
+    lMax = float(np.iinfo(pArray.dtype).max)
+    if pArray.dtype.kind == 'i':
+        return np.maximum(pArray / lMax, -1.0)
+    return pArray / lMax
+
+# Decode the integers of a WEB3D_quantized_attributes accessor with its column major
+# (components + 1) x (components + 1) decode matrix
+# https://github.com/KhronosGroup/glTF/tree/master/extensions/2.0/Vendor/WEB3D_quantized_attributes
+def Dequantize(pArray, pDecodeMatrix):
+    lSize = pArray.shape[1]
+    lMatrix = np.asarray(pDecodeMatrix, dtype=np.float64).reshape(lSize + 1, lSize + 1)
+    return np.dot(pArray.astype(np.float64), lMatrix[:lSize, :lSize]) + lMatrix[lSize, :lSize]
+
+# count x components array of an accessor. Normalized and quantized integers are decoded
+# to floats, other integers keep their type.
+def ReadAccessor(pGLTF, pBuffers, pAccessorIdx):
+    lAccessor = pGLTF['accessors'][pAccessorIdx]
+    if 'uri' in lAccessor:
+        # Empty files can't be mapped
+        return np.load(lAccessor['uri'], mmap_mode='r' if lAccessor['count'] > 0 else None)
+    lDType = _componentDTypes[lAccessor['componentType']]
+    lSize = _typeSizes[lAccessor['type']]
+    lCount = lAccessor['count']
+    if 'bufferView' in lAccessor:
+        lByteStride = pGLTF['bufferViews'][lAccessor['bufferView']].get('byteStride', 0)
+        lArray = ReadView(pGLTF, pBuffers, lAccessor['bufferView'], lAccessor.get('byteOffset', 0), lDType, lCount, lSize, lByteStride)
+    else:
+        # Accessor without bufferView is all zeros
+        lArray = np.zeros((lCount, lSize), dtype=lDType)
+
+    lSparse = lAccessor.get('sparse')
+    if lSparse:
+        lIndices = lSparse['indices']
+        lValues = lSparse['values']
+        lArray = lArray.copy()
+        lArray[ReadView(
+            pGLTF, pBuffers, lIndices['bufferView'], lIndices.get('byteOffset', 0),
+            _componentDTypes[lIndices['componentType']], lSparse['count'], 1
+        ).reshape(-1)] = ReadView(
+            pGLTF, pBuffers, lValues['bufferView'], lValues.get('byteOffset', 0),
+            lDType, lSparse['count'], lSize
+        )
+
+    lQuantized = lAccessor.get('extensions', {}).get('WEB3D_quantized_attributes')
+    if lQuantized:
+        return Dequantize(lArray, lQuantized['decodeMatrix'])
+    if lAccessor.get('normalized'):
+        return Denormalize(lArray)
+    return lArray
+
+# Content of an image stored in a buffer view or a data uri, None if it's an external file
+def ReadImageData(pGLTF, pBuffers, pImage):
+    if 'bufferView' in pImage:
+        return GetBufferViewData(pGLTF, pBuffers, pImage['bufferView'])
+    lUri = pImage.get('uri', '')
+    if lUri.startswith('data:'):
+        return ReadDataUri(lUri)
+    return None
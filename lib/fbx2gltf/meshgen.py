@@ -0,0 +1,128 @@
+# ############################################
+# Generation of missing vertex attributes of triangle lists, independent from the FBX SDK.
+# Attributes are computed per triangle corner, then vertices whose corners get different
+# values are split. Results are the original vertex of each new vertex, the new attribute
+# and the new indices, in the order vertices are first used.
+# ############################################
+import numpy as np
+import meshopt
+
+def Normalize(pVectors, pFallback):
+    lLength = np.sqrt((pVectors * pVectors).sum(axis=1)).reshape(-1, 1)
+    return np.where(lLength > 1e-20, pVectors / np.where(lLength > 1e-20, lLength, 1), pFallback)
+
+def GetCornerAngles(pPositions, pTriangles):
+    lAngles = np.empty(pTriangles.shape)
+    for k in range(3):
+        lP = pPositions[pTriangles[:, k]]
+        lA = Normalize(pPositions[pTriangles[:, (k + 1) % 3]] - lP, 0)
+        lB = Normalize(pPositions[pTriangles[:, (k + 2) % 3]] - lP, 0)
+        lAngles[:, k] = np.arccos(np.clip((lA * lB).sum(axis=1), -1, 1))
+    return lAngles
+
+def SumByCorner(pCorners, pValues, pCount):
+    # Sum of the rows of pValues into the rows pCorners of a pCount x n array
+    return np.stack([np.bincount(pCorners, pValues[:, k], pCount) for k in range(pValues.shape[1])], axis=1)
+
+# Pairs of corners (a, b) for all the corners in the same group, including a == b
+def GetGroupPairs(pGroups):
+    lOrder = np.argsort(pGroups, kind='mergesort')
+    lSorted = pGroups[lOrder]
+    lStarts = np.searchsorted(lSorted, lSorted, 'left')
+    lSizes = np.searchsorted(lSorted, lSorted, 'right') - lStarts
+    lA = np.repeat(np.arange(len(pGroups)), lSizes)
+    lOffsets = np.arange(len(lA)) - np.repeat(np.cumsum(lSizes) - lSizes, lSizes)
+    lB = np.repeat(lStarts, lSizes) + lOffsets
+    return lOrder[lA], lOrder[lB]
+
+# Split the vertices whose corners have different values, pKeys are the values as integer rows
+def SplitVertices(pCornerVertices, pKeys):
+    lRows = np.ascontiguousarray(np.hstack([pCornerVertices.reshape(-1, 1).astype(np.int64), pKeys.astype(np.int64)]))
+    lRows = lRows.view(np.dtype((np.void, lRows.dtype.itemsize * lRows.shape[1]))).reshape(-1)
+    lUnique, lFirstCorner, lInverse = np.unique(lRows, return_index=True, return_inverse=True)
+    # Number the new vertices in order of first use
+    lOrder = np.argsort(lFirstCorner, kind='mergesort')
+    lRemap = np.empty(len(lOrder), dtype=np.int64)
+    lRemap[lOrder] = np.arange(len(lOrder))
+    lFirstCorner = lFirstCorner[lOrder]
+    return lFirstCorner, lRemap[lInverse.reshape(-1)]
+
+def FloatKeys(pValues):
+    # Bits of the float32 values, adding 0 so -0.0 and 0.0 are the same key
+    return np.ascontiguousarray(pValues.astype(np.float32) + np.float32(0)).view(np.int32)
+
+# Area and angle weighted normals. Faces around a position are smoothed together, across UV seams,
+# unless the angle between them is larger than pCreaseAngle (in radians).
+def GenerateNormals(pPositions, pIndices, pCreaseAngle=np.pi):
+    lPositions = np.asarray(pPositions, dtype=np.float64)
+    lTriangles = np.asarray(pIndices, dtype=np.int64).reshape(-1, 3)
+    lCornerVertices = lTriangles.reshape(-1)
+    lCornerCount = len(lCornerVertices)
+
+    lP0 = lPositions[lTriangles[:, 0]]
+    lFaceNormals = np.cross(lPositions[lTriangles[:, 1]] - lP0, lPositions[lTriangles[:, 2]] - lP0)
+    lFaceUnits = Normalize(lFaceNormals, 0)
+    # The cross product length is twice the area, weight it by the corner angle
+    lContributions = np.repeat(lFaceNormals, 3, axis=0) * GetCornerAngles(lPositions, lTriangles).reshape(-1, 1)
+
+    lPositionIds, lPositionCount = meshopt.GetPositionIds(lPositions)
+    lCornerPositions = lPositionIds[lCornerVertices]
+    if pCreaseAngle >= np.pi:
+        lNormals = SumByCorner(lCornerPositions, lContributions, lPositionCount)[lCornerPositions]
+    else:
+        lA, lB = GetGroupPairs(lCornerPositions)
+        lSmooth = (lFaceUnits[lA // 3] * lFaceUnits[lB // 3]).sum(axis=1) >= np.cos(pCreaseAngle)
+        lSmooth |= lA == lB
+        lNormals = SumByCorner(lA[lSmooth], lContributions[lB[lSmooth]], lCornerCount)
+    lNormals = Normalize(lNormals, np.repeat(lFaceUnits, 3, axis=0))
+    lNormals = Normalize(lNormals, [0, 0, 1])
+
+    lFirstCorner, lIndices = SplitVertices(lCornerVertices, FloatKeys(lNormals))
+    return lCornerVertices[lFirstCorner], lNormals[lFirstCorner], lIndices
+
+# Tangents in the MikkTSpace convention used by glTF: xyz is orthogonal to the normal, w is the
+# handedness so bitangent = cross(normal, tangent.xyz) * w. Face tangents are projected on the
+# vertex normals and angle weighted, vertices of mirrored UVs are split by handedness.
+def GenerateTangents(pPositions, pNormals, pTexcoords, pIndices):
+    lPositions = np.asarray(pPositions, dtype=np.float64)
+    lNormals = np.asarray(pNormals, dtype=np.float64)
+    lTexcoords = np.asarray(pTexcoords, dtype=np.float64)
+    lTriangles = np.asarray(pIndices, dtype=np.int64).reshape(-1, 3)
+    lCornerVertices = lTriangles.reshape(-1)
+    lCornerCount = len(lCornerVertices)
+
+    lP0 = lPositions[lTriangles[:, 0]]
+    lT0 = lTexcoords[lTriangles[:, 0]]
+    lD1 = lPositions[lTriangles[:, 1]] - lP0
+    lD2 = lPositions[lTriangles[:, 2]] - lP0
+    lUV1 = lTexcoords[lTriangles[:, 1]] - lT0
+    lUV2 = lTexcoords[lTriangles[:, 2]] - lT0
+    # Directions of increasing u and v on each face, up to the sign of the texture area
+    lSignedArea = lUV1[:, 0] * lUV2[:, 1] - lUV2[:, 0] * lUV1[:, 1]
+    lSign = np.where(lSignedArea < 0, -1.0, 1.0).reshape(-1, 1)
+    lFaceTangents = lSign * (lUV2[:, 1:2] * lD1 - lUV1[:, 1:2] * lD2)
+    lFaceBitangents = lSign * (lUV1[:, 0:1] * lD2 - lUV2[:, 0:1] * lD1)
+
+    lCornerNormals = lNormals[lCornerVertices]
+    lCornerTangents = np.repeat(lFaceTangents, 3, axis=0)
+    lCornerBitangents = np.repeat(lFaceBitangents, 3, axis=0)
+    lCornerTangents -= lCornerNormals * (lCornerNormals * lCornerTangents).sum(axis=1).reshape(-1, 1)
+    lCornerTangents = Normalize(lCornerTangents, 0)
+    lHandedness = np.where((np.cross(lCornerNormals, lCornerTangents) * lCornerBitangents).sum(axis=1) < 0, -1, 1)
+
+    # Corners of the same vertex and handedness share their tangent
+    lFirstCorner, lIndices = SplitVertices(lCornerVertices, lHandedness.reshape(-1, 1))
+    lContributions = lCornerTangents * GetCornerAngles(lPositions, lTriangles).reshape(-1, 1)
+    lTangents = SumByCorner(lIndices, lContributions, len(lFirstCorner))
+
+    # Any direction orthogonal to the normal when the UVs are degenerate
+    lVertexNormals = lNormals[lCornerVertices[lFirstCorner]]
+    lFallback = np.cross(lVertexNormals, [0, 0, 1])
+    lFallback = np.where((lFallback * lFallback).sum(axis=1).reshape(-1, 1) > 1e-12, lFallback, np.cross(lVertexNormals, [0, 1, 0]))
+    lTangents -= lVertexNormals * (lVertexNormals * lTangents).sum(axis=1).reshape(-1, 1)
+    lTangents = Normalize(lTangents, Normalize(lFallback, [1, 0, 0]))
+
+    lResult = np.empty((len(lFirstCorner), 4))
+    lResult[:, :3] = lTangents
+    lResult[:, 3] = lHandedness[lFirstCorner]
+    return lCornerVertices[lFirstCorner], lResult, lIndices
@@ -0,0 +1,396 @@
+# ############################################
+# Mesh optimization of triangle lists, independent from the FBX SDK.
+# Indices are numpy arrays of a triangle list, vertices are referenced by index.
+# ############################################
+import collections
+import heapq
+import numpy as np
+
+# Vertex cache optimization, see Tom Forsyth, Linear-Speed Vertex Cache Optimisation
+# https://tomforsyth1000.github.io/papers/fast_vert_cache_opt.html
+VERTEX_CACHE_SIZE = 16
+_cacheDecayPower = 1.5
+_lastTriScore = 0.75
+_valenceBoostScale = 2.0
+_valenceBoostPower = 0.5
+_maxValence = 64
+
+def _CreateCacheScoreTable(pCacheSize):
+    lTable = []
+    for i in range(pCacheSize):
+        if i < 3:
+            # Vertices of the last triangle are penalized so it's not used again directly
+            lTable.append(_lastTriScore)
+        else:
+            lTable.append((1.0 - (i - 3) / float(pCacheSize - 3)) ** _cacheDecayPower)
+    return lTable
+
+_cacheScoreTable = _CreateCacheScoreTable(VERTEX_CACHE_SIZE)
+_valenceScoreTable = [0.0] + [_valenceBoostScale * i ** -_valenceBoostPower for i in range(1, _maxValence + 1)]
+
+def _VertexScore(pCachePosition, pRemaining):
+    if pRemaining == 0:
+        return -1.0
+    lScore = _valenceScoreTable[min(pRemaining, _maxValence)]
+    if pCachePosition >= 0:
+        lScore += _cacheScoreTable[pCachePosition]
+    return lScore
+
+def GetVertexTriangles(pIndices, pVertexCount):
+    # Triangles of each vertex as a compressed list, triangles of vertex v are lTriangles[lOffsets[v]:lOffsets[v + 1]]
+    lValence = np.bincount(pIndices, minlength=pVertexCount)
+    lOffsets = np.zeros(pVertexCount + 1, dtype=np.int64)
+    np.cumsum(lValence, out=lOffsets[1:])
+    lTriangles = np.argsort(pIndices, kind='mergesort') // 3
+    return lTriangles, lOffsets, lValence
+
+def OptimizeVertexCache(pIndices, pVertexCount):
+    lIndices = np.asarray(pIndices, dtype=np.int64)
+    lTriangleCount = len(lIndices) // 3
+    if lTriangleCount == 0:
+        return np.asarray(pIndices).copy()
+
+    lVertexTriangles, lOffsets, lValence = GetVertexTriangles(lIndices, pVertexCount)
+    lVertexTriangles = lVertexTriangles.tolist()
+    lOffsets = lOffsets.tolist()
+    lRemaining = lValence.tolist()
+    lTriangles = lIndices.reshape(-1, 3).tolist()
+
+    lCachePosition = [-1] * pVertexCount
+    lVertexScores = [_VertexScore(-1, lRemaining[v]) for v in range(pVertexCount)]
+    lTriangleScores = [lVertexScores[a] + lVertexScores[b] + lVertexScores[c] for a, b, c in lTriangles]
+    lEmitted = [False] * lTriangleCount
+
+    lCache = []
+    lOrder = []
+    lBest = lTriangleScores.index(max(lTriangleScores))
+    lCursor = 0
+    for lStep in range(lTriangleCount):
+        if lBest < 0:
+            # No triangle uses the cached vertices, continue with the next one in input order
+            while lEmitted[lCursor]:
+                lCursor += 1
+            lBest = lCursor
+
+        lTriangle = lTriangles[lBest]
+        lEmitted[lBest] = True
+        lOrder.append(lBest)
+        for v in lTriangle:
+            lRemaining[v] -= 1
+
+        lNewCache = list(lTriangle)
+        for v in lCache:
+            if not v in lTriangle:
+                lNewCache.append(v)
+        lEvicted = lNewCache[VERTEX_CACHE_SIZE:]
+        lCache = lNewCache[:VERTEX_CACHE_SIZE]
+        for v in lEvicted:
+            lCachePosition[v] = -1
+        for i in range(len(lCache)):
+            lCachePosition[lCache[i]] = i
+
+        for v in lCache + lEvicted:
+            lScore = _VertexScore(lCachePosition[v], lRemaining[v])
+            lDiff = lScore - lVertexScores[v]
+            if lDiff != 0:
+                lVertexScores[v] = lScore
+                for t in lVertexTriangles[lOffsets[v]:lOffsets[v + 1]]:
+                    if not lEmitted[t]:
+                        lTriangleScores[t] += lDiff
+
+        lBest = -1
+        lBestScore = -1.0
+        for v in lCache:
+            for t in lVertexTriangles[lOffsets[v]:lOffsets[v + 1]]:
+                if not lEmitted[t] and lTriangleScores[t] > lBestScore:
+                    lBest = t
+                    lBestScore = lTriangleScores[t]
+
+    lOrder = np.array(lOrder, dtype=np.int64)
+    return np.asarray(pIndices).reshape(-1, 3)[lOrder].reshape(-1)
+
+def OptimizeVertexFetchRemap(pIndices, pVertexCount):
+    # New position of each vertex so vertices are stored in the order they're first used.
+    # Unused vertices are kept at the end.
+    lFirstUse = np.full(pVertexCount, len(pIndices), dtype=np.int64)
+    lUsed, lFirstIndex = np.unique(pIndices, return_index=True)
+    lFirstUse[lUsed] = lFirstIndex
+    lOrder = np.argsort(lFirstUse, kind='mergesort')
+    lRemap = np.empty(pVertexCount, dtype=np.int64)
+    lRemap[lOrder] = np.arange(pVertexCount)
+    return lRemap
+
+def ComputeACMR(pIndices, pCacheSize=VERTEX_CACHE_SIZE):
+    # Average cache miss ratio per triangle with a FIFO cache
+    lTriangleCount = len(pIndices) // 3
+    if lTriangleCount == 0:
+        return 0.0
+    lCache = set()
+    lFifo = collections.deque()
+    lMisses = 0
+    for v in np.asarray(pIndices).tolist():
+        if not v in lCache:
+            lMisses += 1
+            lCache.add(v)
+            lFifo.append(v)
+            if len(lFifo) > pCacheSize:
+                lCache.discard(lFifo.popleft())
+    return lMisses / float(lTriangleCount)
+
+def _SpreadBits(pValues):
+    # Insert two zero bits between each of the 10 low bits
+    lValues = pValues.astype(np.uint32) & 0x3ff
+    lValues = (lValues | (lValues << 16)) & 0x030000ff
+    lValues = (lValues | (lValues << 8)) & 0x0300f00f
+    lValues = (lValues | (lValues << 4)) & 0x030c30c3
+    lValues = (lValues | (lValues << 2)) & 0x09249249
+    return lValues
+
+def MortonOrder(pPoints):
+    # Order of the points along a Z-order curve of their bounding box, so close points are close in the order
+    lPoints = np.asarray(pPoints, dtype=np.float64)
+    if len(lPoints) == 0:
+        return np.zeros(0, dtype=np.int64)
+    lMin = lPoints.min(axis=0)
+    lSize = (lPoints.max(axis=0) - lMin).max()
+    if lSize == 0:
+        lSize = 1.0
+    lCells = np.floor((lPoints - lMin) / lSize * 1023).astype(np.uint32)
+    lCodes = _SpreadBits(lCells[:, 0]) | (_SpreadBits(lCells[:, 1]) << 1) | (_SpreadBits(lCells[:, 2]) << 2)
+    return np.argsort(lCodes, kind='mergesort')
+
+def SplitIndices(pIndices, pMaxVertices):
+    # Split the triangles in consecutive runs using at most pMaxVertices distinct vertices each.
+    # Returns the triangle ranges [start, end) of the runs.
+    lTriangles = np.asarray(pIndices).reshape(-1, 3).tolist()
+    lRanges = []
+    lStart = 0
+    lUsed = set()
+    for t in range(len(lTriangles)):
+        lNewVertices = [v for v in set(lTriangles[t]) if not v in lUsed]
+        if len(lUsed) + len(lNewVertices) > pMaxVertices:
+            lRanges.append((lStart, t))
+            lStart = t
+            lUsed = set()
+            lNewVertices = set(lTriangles[t])
+        lUsed.update(lNewVertices)
+    if len(lTriangles) > lStart:
+        lRanges.append((lStart, len(lTriangles)))
+    return lRanges
+
+def GetPositionIds(pPositions):
+    # Id of each vertex shared by the vertices at the same position, vertices are split on UV seams or hard edges
+    lPositions = np.ascontiguousarray(pPositions, dtype=np.float64)
+    lRows = lPositions.view(np.dtype((np.void, lPositions.dtype.itemsize * lPositions.shape[1])))
+    lUnique, lIds = np.unique(lRows, return_inverse=True)
+    return lIds.reshape(-1), len(lUnique)
+
+# Coefficients of the symmetric 4x4 quadric matrix kept for each position
+_quadricPairs = [(0, 0), (0, 1), (0, 2), (0, 3), (1, 1), (1, 2), (1, 3), (2, 2), (2, 3), (3, 3)]
+
+def ComputeQuadrics(pPositions, pTriangles):
+    # Area weighted plane quadrics of the triangles around each position, as the 10 coefficients of _quadricPairs
+    lP0 = pPositions[pTriangles[:, 0]]
+    lNormals = np.cross(pPositions[pTriangles[:, 1]] - lP0, pPositions[pTriangles[:, 2]] - lP0)
+    lArea = np.linalg.norm(lNormals, axis=1)
+    lNormals = lNormals / np.where(lArea == 0, 1, lArea).reshape(-1, 1)
+    lPlanes = np.empty((len(pTriangles), 4))
+    lPlanes[:, :3] = lNormals
+    lPlanes[:, 3] = -(lNormals * lP0).sum(axis=1)
+    lQuadrics = np.zeros((len(pPositions), len(_quadricPairs)))
+    for i, (a, b) in enumerate(_quadricPairs):
+        lTriangleQuadrics = lPlanes[:, a] * lPlanes[:, b] * lArea / 2
+        for k in range(3):
+            lQuadrics[:, i] += np.bincount(pTriangles[:, k], lTriangleQuadrics, len(pPositions))
+    return lQuadrics
+
+def QuadricErrors(pQuadrics, pPoints):
+    # Error of each quadric at each point, for arrays of both
+    q = pQuadrics
+    x, y, z = pPoints[:, 0], pPoints[:, 1], pPoints[:, 2]
+    return np.maximum(
+        q[:, 0] * x * x + 2 * q[:, 1] * x * y + 2 * q[:, 2] * x * z + 2 * q[:, 3] * x
+        + q[:, 4] * y * y + 2 * q[:, 5] * y * z + 2 * q[:, 6] * y
+        + q[:, 7] * z * z + 2 * q[:, 8] * z + q[:, 9], 0.0
+    )
+
+def QuadricError(q, p):
+    x, y, z = p
+    return max(
+        q[0] * x * x + 2 * q[1] * x * y + 2 * q[2] * x * z + 2 * q[3] * x
+        + q[4] * y * y + 2 * q[5] * y * z + 2 * q[6] * y
+        + q[7] * z * z + 2 * q[8] * z + q[9], 0.0
+    )
+
+def GetBorderPositions(pTriangles, pPositionCount):
+    # Positions on an edge used by only one triangle of the welded mesh
+    lEdges = np.concatenate([pTriangles[:, [0, 1]], pTriangles[:, [1, 2]], pTriangles[:, [2, 0]]])
+    lEdges = np.sort(lEdges, axis=1)
+    lKeys = lEdges[:, 0].astype(np.int64) * pPositionCount + lEdges[:, 1]
+    lUniqueKeys, lInverse, lCounts = np.unique(lKeys, return_inverse=True, return_counts=True)
+    lBorder = np.zeros(pPositionCount, dtype=bool)
+    lBorder[lEdges[lCounts[lInverse.reshape(-1)] == 1].reshape(-1)] = True
+    return lBorder
+
+def _Sub(a, b):
+    return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+def _Cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+def _Dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def _TriangleQuality(a, b, c, pNormal):
+    # 1 for equilateral triangles, 0 for degenerate ones
+    lEdges = _Dot(_Sub(b, a), _Sub(b, a)) + _Dot(_Sub(c, b), _Sub(c, b)) + _Dot(_Sub(a, c), _Sub(a, c))
+    return 2 * 3 ** 0.5 * _Dot(pNormal, pNormal) ** 0.5 / max(lEdges, 1e-30)
+
+# Quadric error edge collapse simplification, see Garland and Heckbert, Surface Simplification Using Quadric Error Metrics.
+# Edges are collapsed between positions of the welded mesh. Vertices at the same position with the same pAttributes
+# (e.g. texcoords) move together, so hard normals and flat shading don't stop the simplification. Vertices of an
+# attribute seam move along the seam onto the vertex on their side, collapses across a seam and the borders of the
+# welded mesh are not allowed. Moved corners take a vertex of the position they move to, the others are kept.
+# pCollapsePenalty(pFrom, pTo) is an optional extra cost for arrays of vertex indices, e.g. for different skin weights.
+# Returns the indices of the simplified triangles, referencing the input vertices.
+def SimplifyMesh(pPositions, pIndices, pTargetTriangleCount, pCollapsePenalty=None, pAttributes=[]):
+    lPositions = np.asarray(pPositions, dtype=np.float64)
+    lTriangleArray = np.asarray(pIndices, dtype=np.int64).reshape(-1, 3)
+    lTriangleCount = len(lTriangleArray)
+    if lTriangleCount <= pTargetTriangleCount or lTriangleCount == 0:
+        return np.asarray(pIndices).copy()
+
+    # Vertices by position, and by position and attributes
+    lPositionIds, lPositionCount = GetPositionIds(lPositions)
+    lKeys = [lPositionIds.reshape(-1, 1).astype(np.float64)]
+    lKeys += [np.asarray(lAttribute, dtype=np.float64).reshape(len(lPositions), -1) for lAttribute in pAttributes]
+    lGroupIds, lGroupCount = GetPositionIds(np.hstack(lKeys))
+    lGroupVertices = np.zeros(lGroupCount, dtype=np.int64)
+    lGroupVertices[lGroupIds[::-1]] = np.arange(len(lPositions))[::-1]
+    lGroupPositions = lPositionIds[lGroupVertices]
+    lPositionVertices = np.zeros(lPositionCount, dtype=np.int64)
+    lPositionVertices[lPositionIds[::-1]] = np.arange(len(lPositions))[::-1]
+    lWelded = lPositions[lPositionVertices]
+
+    lPositionTriangleArray = lPositionIds[lTriangleArray]
+    lQuadrics = ComputeQuadrics(lWelded, lPositionTriangleArray)
+    lLocked = GetBorderPositions(lPositionTriangleArray, lPositionCount).tolist()
+
+    lPenalties = {}
+    def ComputeCosts(pFrom, pTo):
+        lCosts = QuadricErrors(lQuadrics[pFrom] + lQuadrics[pTo], lWelded[pTo])
+        if pCollapsePenalty:
+            lPenalty = pCollapsePenalty(lPositionVertices[pFrom], lPositionVertices[pTo])
+            lPenalties.update(zip(zip(pFrom.tolist(), pTo.tolist()), lPenalty.tolist()))
+            lCosts = lCosts + lPenalty
+        return lCosts.tolist()
+
+    # Directed edges of the welded mesh, with their costs evaluated at once
+    lEdges = np.concatenate([lPositionTriangleArray[:, [a, b]] for a in range(3) for b in range(3) if a != b])
+    lEdges = lEdges[lEdges[:, 0] != lEdges[:, 1]]
+    lEdges = np.unique(lEdges[:, 0] * lPositionCount + lEdges[:, 1])
+    lFrom = lEdges // lPositionCount
+    lTo = lEdges % lPositionCount
+    lMovable = ~np.asarray(lLocked, dtype=bool)[lFrom]
+    lFrom = lFrom[lMovable]
+    lTo = lTo[lMovable]
+    lHeap = list(zip(ComputeCosts(lFrom, lTo), lFrom.tolist(), lTo.tolist()))
+    heapq.heapify(lHeap)
+
+    lWeldedList = lWelded.tolist()
+    lGroupPositions = lGroupPositions.tolist()
+    lGroupVertices = lGroupVertices.tolist()
+    lTriangles = lGroupIds[lTriangleArray].tolist()
+    lCorners = lTriangleArray.tolist()
+    lAlive = [True] * lTriangleCount
+    lPositionTriangles = [set() for p in range(lPositionCount)]
+    for t in range(lTriangleCount):
+        for g in lTriangles[t]:
+            lPositionTriangles[lGroupPositions[g]].add(t)
+    lRemoved = [False] * lPositionCount
+
+    def GetPartners(p, q):
+        # Group of q each group of p moves to, the one sharing a triangle with it. None if a group of p
+        # has no such group (the edge crosses a seam) or several of them.
+        lPartners = {}
+        for t in lPositionTriangles[p]:
+            lGroups = lTriangles[t]
+            lTo = [g for g in lGroups if lGroupPositions[g] == q]
+            if len(lTo) == 0:
+                continue
+            for g in lGroups:
+                if lGroupPositions[g] == p and lPartners.setdefault(g, lTo[0]) != lTo[0]:
+                    return None
+        for t in lPositionTriangles[p]:
+            for g in lTriangles[t]:
+                if lGroupPositions[g] == p and not g in lPartners:
+                    return None
+        return lPartners
+
+    def Flips(p, q):
+        # Triangles moved by the collapse must not flip, turn by more than ~75 degrees, or become slivers
+        for t in lPositionTriangles[p]:
+            lTrianglePositions = [lGroupPositions[g] for g in lTriangles[t]]
+            if q in lTrianglePositions:
+                continue
+            a, b, c = [lWeldedList[w] for w in lTrianglePositions]
+            lBefore = _Cross(_Sub(b, a), _Sub(c, a))
+            lQualityBefore = _TriangleQuality(a, b, c, lBefore)
+            a, b, c = [lWeldedList[q] if w == p else lWeldedList[w] for w in lTrianglePositions]
+            lAfter = _Cross(_Sub(b, a), _Sub(c, a))
+            if _Dot(lBefore, lAfter) <= 0.25 * (_Dot(lBefore, lBefore) * _Dot(lAfter, lAfter)) ** 0.5:
+                return True
+            if _TriangleQuality(a, b, c, lAfter) < min(0.5 * lQualityBefore, 0.05):
+                return True
+        return False
+
+    def PushEdges(q):
+        lNeighbours = set()
+        for t in lPositionTriangles[q]:
+            lNeighbours.update(lGroupPositions[g] for g in lTriangles[t])
+        lNeighbours.discard(q)
+        lPairs = []
+        for w in lNeighbours:
+            if not lLocked[w]:
+                lPairs.append((w, q))
+            if not lLocked[q]:
+                lPairs.append((q, w))
+        if len(lPairs) == 0:
+            return
+        lPairs = np.array(lPairs, dtype=np.int64)
+        for lCost, (w, v) in zip(ComputeCosts(lPairs[:, 0], lPairs[:, 1]), lPairs.tolist()):
+            heapq.heappush(lHeap, (lCost, w, v))
+
+    while lTriangleCount > pTargetTriangleCount and len(lHeap) > 0:
+        lCost, p, q = heapq.heappop(lHeap)
+        if lRemoved[p] or lRemoved[q] or len(lPositionTriangles[p] & lPositionTriangles[q]) == 0:
+            continue
+        # Costs are only evaluated again when popped, quadrics of the positions may have grown since pushed
+        lNewCost = QuadricError((lQuadrics[p] + lQuadrics[q]).tolist(), lWeldedList[q]) + lPenalties.get((p, q), 0.0)
+        if lNewCost > lCost * (1 + 1e-6) + 1e-12:
+            heapq.heappush(lHeap, (lNewCost, p, q))
+            continue
+        lPartners = GetPartners(p, q)
+        if lPartners is None or Flips(p, q):
+            continue
+
+        for t in list(lPositionTriangles[p]):
+            lGroups = lTriangles[t]
+            if any(lGroupPositions[g] == q for g in lGroups):
+                lAlive[t] = False
+                lTriangleCount -= 1
+                for g in lGroups:
+                    lPositionTriangles[lGroupPositions[g]].discard(t)
+                continue
+            for k in range(3):
+                if lGroupPositions[lGroups[k]] == p:
+                    lGroups[k] = lPartners[lGroups[k]]
+                    lCorners[t][k] = lGroupVertices[lGroups[k]]
+            lPositionTriangles[q].add(t)
+        lPositionTriangles[p] = set()
+        lRemoved[p] = True
+        lQuadrics[q] += lQuadrics[p]
+        PushEdges(q)
+
+    lIndices = [lCorners[t] for t in range(len(lCorners)) if lAlive[t]]
+    return np.array(lIndices, dtype=np.asarray(pIndices).dtype).reshape(-1)
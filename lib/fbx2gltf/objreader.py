@@ -0,0 +1,193 @@
+# ############################################
+# Streaming reader of Wavefront OBJ and MTL files, independent from the FBX SDK.
+# Lines are read in chunks, the numbers of each chunk are parsed at once by numpy.
+# Faces are fan triangulated and grouped by object and material. Corners are rows of
+# 0-based (position, texcoord, normal) indices, -1 when the face has no texcoord or normal.
+# http://paulbourke.net/dataformats/obj/
+# ############################################
+import os
+import numpy as np
+
+# Bytes of lines read at once
+CHUNK_SIZE = 1 << 24
+
+def ParseFloats(pLines, pStride):
+    lValues = np.fromstring(' '.join(pLines), dtype=np.float64, sep=' ')
+    if len(lValues) == len(pLines) * pStride:
+        return lValues.reshape(-1, pStride)
+    # Lines with optional components (w, vertex colors), parse them one by one
+    lArray = np.zeros((len(pLines), pStride))
+    for i in range(len(pLines)):
+        lLineValues = [float(x) for x in pLines[i].split()[:pStride]]
+        lArray[i, :len(lLineValues)] = lLineValues
+    return lArray
+
+def ParseCorners(pTokens):
+    # 'v', 'v/vt', 'v//vn' or 'v/vt/vn' tokens, missing indices are 0
+    lTokens = np.char.replace(np.array(pTokens), '//', '/0/')
+    lSlashes = np.char.count(lTokens, '/')
+    lStride = lSlashes[0] + 1
+    # Faces of a group may use different formats, all tokens must have the stride of the first one
+    if np.all(lSlashes == lSlashes[0]):
+        lValues = np.fromstring(' '.join(lTokens).replace('/', ' '), dtype=np.int64, sep=' ')
+    else:
+        lValues = []
+    if len(lValues) == len(pTokens) * lStride:
+        lCorners = np.zeros((len(pTokens), 3), dtype=np.int64)
+        lCorners[:, :lStride] = lValues.reshape(-1, lStride)
+        return lCorners
+    # Formats are mixed, parse the tokens one by one
+    lCorners = np.zeros((len(pTokens), 3), dtype=np.int64)
+    for i in range(len(pTokens)):
+        for k, lIndex in enumerate(pTokens[i].split('/')[:3]):
+            if lIndex:
+                lCorners[i, k] = int(lIndex)
+    return lCorners
+
+# Triangle corners of the faces, pBases are the counts of positions, texcoords and normals before each face
+def TriangulateFaces(pFaces, pBases):
+    lTokens = []
+    lCounts = np.empty(len(pFaces), dtype=np.int64)
+    for i in range(len(pFaces)):
+        lFaceTokens = pFaces[i].split()
+        lCounts[i] = len(lFaceTokens)
+        lTokens += lFaceTokens
+    if len(lTokens) == 0:
+        return np.empty((0, 3), dtype=np.int64)
+
+    lCorners = ParseCorners(lTokens)
+    # 1-based indices to 0-based, negative indices are relative to the end of the lists read so far
+    lBases = np.repeat(np.asarray(pBases, dtype=np.int64), lCounts, axis=0)
+    lCorners = np.where(lCorners < 0, lBases + lCorners, lCorners - 1)
+
+    # Fan of each polygon: (0, i, i + 1)
+    lTriangleCounts = np.maximum(lCounts - 2, 0)
+    lStarts = np.repeat(np.cumsum(lCounts) - lCounts, lTriangleCounts)
+    lLocal = np.arange(lTriangleCounts.sum()) - np.repeat(np.cumsum(lTriangleCounts) - lTriangleCounts, lTriangleCounts) + 1
+    lTriangles = np.stack([lStarts, lStarts + lLocal, lStarts + lLocal + 1], axis=1)
+    return lCorners[lTriangles.reshape(-1)]
+
+# Returns positions, texcoords, normals, the (object name, material name, corners) groups in
+# order of first use, and the paths of the material libraries.
+def ReadOBJ(pPath):
+    lPositions = []
+    lTexcoords = []
+    lNormals = []
+    lGroups = {}
+    lGroupKeys = []
+    lMaterialLibs = []
+    lCounts = [0, 0, 0]
+
+    lObjectName = os.path.splitext(os.path.basename(pPath))[0]
+    lMaterialName = None
+    lFaces = []
+    lFaceBases = []
+
+    def FlushFaces():
+        if len(lFaces) == 0:
+            return
+        lKey = (lObjectName, lMaterialName)
+        if not lKey in lGroups:
+            lGroups[lKey] = []
+            lGroupKeys.append(lKey)
+        lGroups[lKey].append(TriangulateFaces(lFaces, lFaceBases))
+        del lFaces[:]
+        del lFaceBases[:]
+
+    with open(pPath, 'r', encoding='utf-8', errors='replace') as lFile:
+        lLines = lFile.readlines(CHUNK_SIZE)
+        while lLines:
+            lV = []
+            lVt = []
+            lVn = []
+            for lLine in lLines:
+                lParts = lLine.split(None, 1)
+                if len(lParts) == 0:
+                    continue
+                lKeyword = lParts[0]
+                lRest = lParts[1] if len(lParts) > 1 else ''
+                if lKeyword == 'v':
+                    lV.append(lRest)
+                    lCounts[0] += 1
+                elif lKeyword == 'vt':
+                    lVt.append(lRest)
+                    lCounts[1] += 1
+                elif lKeyword == 'vn':
+                    lVn.append(lRest)
+                    lCounts[2] += 1
+                elif lKeyword == 'f':
+                    lFaces.append(lRest)
+                    lFaceBases.append(list(lCounts))
+                elif lKeyword == 'usemtl':
+                    FlushFaces()
+                    lMaterialName = lRest.strip()
+                elif lKeyword in ('o', 'g'):
+                    FlushFaces()
+                    if lRest.strip():
+                        lObjectName = lRest.strip()
+                elif lKeyword == 'mtllib':
+                    lMaterialLibs.append(os.path.join(os.path.dirname(pPath), lRest.strip()))
+            FlushFaces()
+            if len(lV) > 0:
+                lPositions.append(ParseFloats(lV, 3))
+            if len(lVt) > 0:
+                lTexcoords.append(ParseFloats(lVt, 2))
+            if len(lVn) > 0:
+                lNormals.append(ParseFloats(lVn, 3))
+            lLines = lFile.readlines(CHUNK_SIZE)
+
+    def Concatenate(pArrays, pStride):
+        if len(pArrays) == 0:
+            return np.empty((0, pStride))
+        return np.concatenate(pArrays)
+
+    lGroupsList = [(lKey[0], lKey[1], np.concatenate(lGroups[lKey])) for lKey in lGroupKeys]
+    return Concatenate(lPositions, 3), Concatenate(lTexcoords, 2), Concatenate(lNormals, 3), lGroupsList, lMaterialLibs
+
+# Options of texture maps and their count of arguments
+_textureOptions = {
+    '-blendu': 1, '-blendv': 1, '-bm': 1, '-boost': 1, '-cc': 1, '-clamp': 1, '-imfchan': 1,
+    '-mm': 2, '-o': 3, '-s': 3, '-t': 3, '-texres': 1, '-type': 1
+}
+# Options with 1 to 3 arguments, 'u [v [w]]'
+_textureVectorOptions = ['-o', '-s', '-t']
+
+def IsFloat(pToken):
+    try:
+        float(pToken)
+        return True
+    except ValueError:
+        return False
+
+def GetTexturePath(pValue):
+    lTokens = pValue.split()
+    i = 0
+    while i < len(lTokens) and lTokens[i] in _textureOptions:
+        lCount = _textureOptions[lTokens[i]]
+        i += 1
+        if lTokens[i - 1] in _textureVectorOptions:
+            # Optional arguments end at the first token that is not a number
+            lEnd = min(i + lCount, len(lTokens))
+            while i < lEnd and IsFloat(lTokens[i]):
+                i += 1
+        else:
+            i += lCount
+    # File names may have spaces
+    return ' '.join(lTokens[i:])
+
+# Materials by name, as dicts of lower case keywords to the rest of their line
+def ReadMTL(pPath):
+    lMaterials = {}
+    lMaterial = None
+    with open(pPath, 'r', encoding='utf-8', errors='replace') as lFile:
+        for lLine in lFile:
+            lParts = lLine.split(None, 1)
+            if len(lParts) == 0 or lParts[0].startswith('#'):
+                continue
+            lRest = lParts[1].strip() if len(lParts) > 1 else ''
+            if lParts[0] == 'newmtl':
+                lMaterial = {}
+                lMaterials[lRest] = lMaterial
+            elif lMaterial is not None:
+                lMaterial[lParts[0].lower()] = lRest
+    return lMaterials
@@ -0,0 +1,67 @@
+# ############################################
+# Cached scene of a conversion, independent from the FBX SDK.
+# The scene extracted from a source file, before any encoding stage, is saved as a glTF JSON
+# whose accessors are decoded .npy files (one for each mesh attribute, index list, morph target,
+# skin and animation channel) and whose images are files. Converting the JSON again maps the
+# arrays with gltfreader, so only the encode stages run instead of loading the source file.
+# ############################################
+import os, json
+import numpy as np
+import gltfreader
+import textures
+
+SCENE_FILE = 'scene.json'
+
+_componentTypes = {
+    'i1': 5120,
+    'u1': 5121,
+    'i2': 5122,
+    'u2': 5123,
+    'u4': 5125,
+    'f4': 5126
+}
+
+# Save the glTF or GLB file at pGLTFPath as a cached scene in pCacheDir, returns the path of the scene JSON
+def WriteSceneCache(pGLTFPath, pCacheDir):
+    lGLTF, lBuffers = gltfreader.ReadGLTF(pGLTFPath)
+    os.makedirs(os.path.join(pCacheDir, 'accessors'), exist_ok=True)
+
+    lAccessors = []
+    for i in range(len(lGLTF.get('accessors', []))):
+        lAccessor = lGLTF['accessors'][i]
+        lArray = gltfreader.ReadAccessor(lGLTF, lBuffers, i)
+        # Normalized integers are decoded, sparse accessors are dense
+        if lArray.dtype.kind == 'f':
+            lArray = lArray.astype('<f4')
+        lArray = np.ascontiguousarray(lArray)
+        lUri = 'accessors/%d.npy' % i
+        np.save(os.path.join(pCacheDir, lUri), lArray)
+        lCachedAccessor = {
+            'uri': lUri,
+            'componentType': _componentTypes[lArray.dtype.str[1:]],
+            'type': lAccessor['type'],
+            'count': lAccessor['count']
+        }
+        for lKey in ('min', 'max', 'name'):
+            if lKey in lAccessor:
+                lCachedAccessor[lKey] = lAccessor[lKey]
+        lAccessors.append(lCachedAccessor)
+    lGLTF['accessors'] = lAccessors
+
+    for lImage in lGLTF.get('images', []):
+        lData = gltfreader.ReadImageData(lGLTF, lBuffers, lImage)
+        if lData is None:
+            continue
+        lPath = textures.CacheImageData(lData, os.path.join(pCacheDir, 'images'))
+        lImage.pop('bufferView', None)
+        lImage['uri'] = 'images/' + os.path.basename(lPath)
+
+    lGLTF.pop('bufferViews', None)
+    lGLTF.pop('buffers', None)
+    # The scene is written last, so a cache is never used before all its arrays are written
+    lScenePath = os.path.join(pCacheDir, SCENE_FILE)
+    lTempPath = '%s.%d.tmp' % (lScenePath, os.getpid())
+    with open(lTempPath, 'w') as lSceneFile:
+        lSceneFile.write(json.dumps(lGLTF, sort_keys = True, separators=(',', ':')))
+    os.replace(lTempPath, lScenePath)
+    return lScenePath
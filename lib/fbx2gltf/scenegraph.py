@@ -0,0 +1,251 @@
+# ############################################
+# Helpers on the glTF scene graph (lists of node and animation dicts), independent from the FBX SDK.
+# Matrices are 4x4 numpy arrays in the layout of glTF node.matrix reshaped row by row,
+# which is the row vector convention of fbx, so world = local . parent world.
+# ############################################
+import numpy as np
+
+def GetParentIndices(pNodes):
+    lParents = [-1] * len(pNodes)
+    for i in range(len(pNodes)):
+        for lChildIdx in pNodes[i].get('children', []):
+            lParents[lChildIdx] = i
+    return lParents
+
+def QuatToMatrix(pQuaternion):
+    x, y, z, w = pQuaternion
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y + z * w), 2 * (x * z - y * w)],
+        [2 * (x * y - z * w), 1 - 2 * (x * x + z * z), 2 * (y * z + x * w)],
+        [2 * (x * z + y * w), 2 * (y * z - x * w), 1 - 2 * (x * x + y * y)]
+    ])
+
+def ComposeMatrix(pTranslation, pRotation, pScale):
+    lMatrix = np.identity(4)
+    lMatrix[:3, :3] = QuatToMatrix(pRotation) * np.reshape(pScale, (3, 1))
+    lMatrix[3, :3] = pTranslation
+    return lMatrix
+
+def GetLocalMatrix(pNode):
+    if 'matrix' in pNode:
+        return np.array(pNode['matrix'], dtype=np.float64).reshape(4, 4)
+    return ComposeMatrix(
+        pNode.get('translation', [0, 0, 0]),
+        pNode.get('rotation', [0, 0, 0, 1]),
+        pNode.get('scale', [1, 1, 1])
+    )
+
+def GetWorldMatrices(pNodes, pRootNodes):
+    lWorldMatrices = [None] * len(pNodes)
+    lStack = [(lNodeIdx, np.identity(4)) for lNodeIdx in pRootNodes]
+    while len(lStack) > 0:
+        lNodeIdx, lParentMatrix = lStack.pop()
+        lWorldMatrix = np.dot(GetLocalMatrix(pNodes[lNodeIdx]), lParentMatrix)
+        lWorldMatrices[lNodeIdx] = lWorldMatrix
+        for lChildIdx in pNodes[lNodeIdx].get('children', []):
+            lStack.append((lChildIdx, lWorldMatrix))
+    return lWorldMatrices
+
+def MatricesToQuats(pRotations):
+    # n x 3 x 3 rotation matrices in row vector convention to n x 4 xyzw quaternions
+    lR = np.transpose(pRotations, (0, 2, 1))
+    lTrace = lR[:, 0, 0] + lR[:, 1, 1] + lR[:, 2, 2]
+    lQuats = np.empty((len(lR), 4))
+    lQuats[:, 3] = np.sqrt(np.maximum(0, 1 + lTrace)) / 2
+    lQuats[:, 0] = np.sqrt(np.maximum(0, 1 + lR[:, 0, 0] - lR[:, 1, 1] - lR[:, 2, 2])) / 2
+    lQuats[:, 1] = np.sqrt(np.maximum(0, 1 - lR[:, 0, 0] + lR[:, 1, 1] - lR[:, 2, 2])) / 2
+    lQuats[:, 2] = np.sqrt(np.maximum(0, 1 - lR[:, 0, 0] - lR[:, 1, 1] + lR[:, 2, 2])) / 2
+    lQuats[:, 0] = np.copysign(lQuats[:, 0], lR[:, 2, 1] - lR[:, 1, 2])
+    lQuats[:, 1] = np.copysign(lQuats[:, 1], lR[:, 0, 2] - lR[:, 2, 0])
+    lQuats[:, 2] = np.copysign(lQuats[:, 2], lR[:, 1, 0] - lR[:, 0, 1])
+    return lQuats / np.linalg.norm(lQuats, axis=1).reshape(-1, 1)
+
+def DecomposeMatrices(pMatrices, pTolerance=1e-5):
+    # Translation, rotation and scale of n x 4 x 4 matrices,
+    # and whether each matrix is represented exactly by them (no shear or projection).
+    lMatrices = np.asarray(pMatrices, dtype=np.float64).reshape(-1, 4, 4)
+    lTranslations = lMatrices[:, 3, :3].copy()
+    lScales = np.sqrt((lMatrices[:, :3, :3] ** 2).sum(axis=2))
+    # Mirrored transforms get a negative scale on x
+    lScales[:, 0] *= np.where(np.linalg.det(lMatrices[:, :3, :3]) < 0, -1, 1)
+    lSafeScales = np.where(lScales == 0, 1, lScales)
+    lRotations = lMatrices[:, :3, :3] / lSafeScales.reshape(-1, 3, 1)
+    lQuats = MatricesToQuats(lRotations)
+
+    lValid = np.ones(len(lMatrices), dtype=bool)
+    for i in range(len(lMatrices)):
+        lComposed = ComposeMatrix(lTranslations[i], lQuats[i], lScales[i])
+        lSize = max(np.abs(lMatrices[i]).max(), 1.0)
+        lValid[i] = np.abs(lComposed - lMatrices[i]).max() <= pTolerance * lSize
+    return lTranslations, lQuats, lScales, lValid
+
+def GetAnimatedNodes(pAnimations):
+    lAnimatedNodes = set()
+    for lAnimation in pAnimations:
+        for lChannel in lAnimation['channels']:
+            lAnimatedNodes.add(lChannel['target']['node'])
+    return lAnimatedNodes
+
+def HasAnimatedAncestor(pNodeIdx, pParents, pAnimatedNodes):
+    while pNodeIdx >= 0:
+        if pNodeIdx in pAnimatedNodes:
+            return True
+        pNodeIdx = pParents[pNodeIdx]
+    return False
+
+def GetJointNodes(pSkins):
+    lJointNodes = set()
+    for lSkin in pSkins:
+        lJointNodes.update(lSkin['joints'])
+        if 'skeleton' in lSkin:
+            lJointNodes.add(lSkin['skeleton'])
+    return lJointNodes
+
+# Remove the nodes in pRemoved and remap the node indices of scenes, children, skins, animations and MSFT_lod levels.
+# Removed nodes must not be skin joints, animation targets or LOD levels, their children are removed from the hierarchy.
+def RemoveNodes(pNodes, pScenes, pSkins, pAnimations, pRemoved):
+    lRemap = []
+    lKeptNodes = []
+    for i in range(len(pNodes)):
+        if i in pRemoved:
+            lRemap.append(-1)
+        else:
+            lRemap.append(len(lKeptNodes))
+            lKeptNodes.append(pNodes[i])
+
+    for lNode in lKeptNodes:
+        lLOD = lNode.get('extensions', {}).get('MSFT_lod')
+        if lLOD:
+            lLOD['ids'] = [lRemap[i] for i in lLOD['ids']]
+        if 'children' in lNode:
+            lNode['children'] = [lRemap[i] for i in lNode['children'] if lRemap[i] >= 0]
+            if len(lNode['children']) == 0:
+                del lNode['children']
+    for lScene in pScenes:
+        lScene['nodes'] = [lRemap[i] for i in lScene['nodes'] if lRemap[i] >= 0]
+    for lSkin in pSkins:
+        lSkin['joints'] = [lRemap[i] for i in lSkin['joints']]
+        if 'skeleton' in lSkin:
+            lSkin['skeleton'] = lRemap[lSkin['skeleton']]
+    for lAnimation in pAnimations:
+        for lChannel in lAnimation['channels']:
+            lChannel['target']['node'] = lRemap[lChannel['target']['node']]
+
+    pNodes[:] = lKeptNodes
+    return lRemap
+
+def IsEmptyNode(pNode):
+    for lKey in ('mesh', 'camera', 'skin', 'children', 'extensions'):
+        if lKey in pNode:
+            return False
+    return True
+
+# Remove the leaf nodes without content, repeatedly so parents left without children are removed too.
+def RemoveEmptyNodes(pNodes, pScenes, pSkins, pAnimations):
+    lKeptNodes = GetJointNodes(pSkins) | GetAnimatedNodes(pAnimations)
+    lRemovedCount = 0
+    while True:
+        lRemoved = set(i for i in range(len(pNodes)) if not i in lKeptNodes and IsEmptyNode(pNodes[i]))
+        if len(lRemoved) == 0:
+            return lRemovedCount
+        lRemap = RemoveNodes(pNodes, pScenes, pSkins, pAnimations, lRemoved)
+        lKeptNodes = set(lRemap[i] for i in lKeptNodes)
+        lRemovedCount += len(lRemoved)
+
+# Remove the meshes not used by any node and remap the mesh indices of nodes.
+def RemoveUnusedMeshes(pNodes, pMeshes):
+    lUsedMeshes = set()
+    for lNode in pNodes:
+        if 'mesh' in lNode:
+            lUsedMeshes.add(lNode['mesh'])
+    lRemap = [-1] * len(pMeshes)
+    lKeptMeshes = []
+    for i in range(len(pMeshes)):
+        if i in lUsedMeshes:
+            lRemap[i] = len(lKeptMeshes)
+            lKeptMeshes.append(pMeshes[i])
+    for lNode in pNodes:
+        if 'mesh' in lNode:
+            lNode['mesh'] = lRemap[lNode['mesh']]
+    pMeshes[:] = lKeptMeshes
+    return lRemap
+
+def IsIdentity(pMatrix, pTolerance=1e-7):
+    return np.abs(pMatrix - np.identity(4)).max() <= pTolerance
+
+# Collapse the empty nodes with a single child into the child, so chains of helper nodes become one node.
+# The helper transform is baked in the child's matrix, unless the child is animated and the transform not identity.
+def CollapseEmptyNodes(pNodes, pScenes, pSkins, pAnimations):
+    lAnimatedNodes = GetAnimatedNodes(pAnimations)
+    lKeptNodes = GetJointNodes(pSkins) | lAnimatedNodes
+    lParents = GetParentIndices(pNodes)
+    lRemoved = set()
+    for i in range(len(pNodes)):
+        lNode = pNodes[i]
+        if i in lKeptNodes or len(lNode.get('children', [])) != 1:
+            continue
+        if not IsEmptyNode(dict((k, v) for k, v in lNode.items() if k != 'children')):
+            continue
+        lChildIdx = lNode['children'][0]
+        lChild = pNodes[lChildIdx]
+        lMatrix = GetLocalMatrix(lNode)
+        if not IsIdentity(lMatrix):
+            if lChildIdx in lAnimatedNodes:
+                continue
+            lChildMatrix = np.dot(GetLocalMatrix(lChild), lMatrix)
+            for lKey in ('translation', 'rotation', 'scale'):
+                lChild.pop(lKey, None)
+            lChild['matrix'] = lChildMatrix.ravel().tolist()
+
+        lParentIdx = lParents[i]
+        if lParentIdx >= 0:
+            lSiblings = pNodes[lParentIdx]['children']
+            lSiblings[lSiblings.index(i)] = lChildIdx
+        else:
+            for lScene in pScenes:
+                lScene['nodes'] = [lChildIdx if lNodeIdx == i else lNodeIdx for lNodeIdx in lScene['nodes']]
+        lParents[lChildIdx] = lParentIdx
+        del lNode['children']
+        lRemoved.add(i)
+
+    if len(lRemoved) > 0:
+        RemoveNodes(pNodes, pScenes, pSkins, pAnimations, lRemoved)
+    return len(lRemoved)
+
+def RoundFloats(pValues, pDefault, pDigits=8, pTolerance=1e-7):
+    # Snap values within tolerance of their default, and drop the digits under float32 precision
+    lValues = []
+    for lValue, lDefault in zip(pValues, pDefault):
+        if abs(lValue - lDefault) <= pTolerance:
+            lValue = lDefault
+        lValues.append(float('%.*g' % (pDigits, lValue)))
+    return lValues
+
+# Write the local transform of every node as translation, rotation and scale, only the ones that are not default.
+# Matrices that can't be decomposed (sheared) are kept, unless the node is animated since glTF forbids matrix on animated nodes.
+def EmitNodeTransforms(pNodes, pAnimations):
+    lAnimatedNodes = GetAnimatedNodes(pAnimations)
+    for i in range(len(pNodes)):
+        lNode = pNodes[i]
+        if not 'matrix' in lNode:
+            continue
+        lMatrix = GetLocalMatrix(lNode)
+        del lNode['matrix']
+        if IsIdentity(lMatrix):
+            continue
+        lTranslations, lRotations, lScales, lValid = DecomposeMatrices([lMatrix])
+        if not lValid[0] and not i in lAnimatedNodes:
+            lNode['matrix'] = RoundFloats(lMatrix.ravel().tolist(), np.identity(4).ravel().tolist())
+            continue
+        lRotation = lRotations[0]
+        # Same rotation, w positive so identity is [0, 0, 0, 1]
+        if lRotation[3] < 0:
+            lRotation = -lRotation
+        for lKey, lValue, lDefault in (
+            ('translation', lTranslations[0], [0, 0, 0]),
+            ('rotation', lRotation, [0, 0, 0, 1]),
+            ('scale', lScales[0], [1, 1, 1])
+        ):
+            lValue = RoundFloats(lValue.tolist(), lDefault)
+            if lValue != lDefault:
+                lNode[lKey] = lValue
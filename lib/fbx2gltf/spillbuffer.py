@@ -0,0 +1,107 @@
+# ############################################
+# Memory budget of a conversion, independent from the FBX SDK.
+# Binary buffers grow in memory until the bytes kept by all of them are above the budget,
+# then a buffer that grows again moves to its own temp file and is appended there. Spilled
+# buffers are written to the output as file segments, see glbwriter.
+# Arrays kept until the end of the conversion are counted the same way, above the budget
+# they are copied to memory mapped .npy temp files.
+# ############################################
+import os, atexit, shutil, tempfile
+import numpy as np
+
+# Bytes kept in memory before spilling to temp files, 0 is unlimited
+_budget = 0
+# Parent of the temp directory of this process, None for the system temp directory
+_tempRoot = None
+_tempDir = None
+_bufferBytes = 0
+_arrayBytes = 0
+
+def SetBudget(pBytes, pTempRoot=None):
+    global _budget, _tempRoot
+    _budget = max(pBytes, 0)
+    _tempRoot = pTempRoot
+
+def HasBudget():
+    return _budget > 0
+
+def IsOverBudget(pLength):
+    return _budget > 0 and _bufferBytes + _arrayBytes + pLength > _budget
+
+# Temp directory of this process, removed at exit
+def GetTempDir():
+    global _tempDir
+    if _tempDir is None:
+        if _tempRoot:
+            os.makedirs(_tempRoot, exist_ok=True)
+        _tempDir = tempfile.mkdtemp(prefix='fbx2gltf-', dir=_tempRoot)
+        atexit.register(shutil.rmtree, _tempDir, True)
+    return _tempDir
+
+# Append only buffer, used like a bytearray by the converter
+class SpillBuffer(object):
+
+    def __init__(self):
+        self._data = bytearray()
+        self._path = None
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def IsSpilled(self):
+        return self._path is not None
+
+    def extend(self, pData):
+        global _bufferBytes
+        lLength = len(pData)
+        if self._path is None and IsOverBudget(lLength):
+            self.Spill()
+        if self._path is None:
+            self._data.extend(pData)
+            _bufferBytes += lLength
+        else:
+            # Opened for each write, so thousands of spilled buffers don't keep files open
+            with open(self._path, 'ab') as lFile:
+                lFile.write(pData)
+        self._length += lLength
+
+    def Spill(self):
+        global _bufferBytes
+        lFile, self._path = tempfile.mkstemp(suffix='.bin', dir=GetTempDir())
+        with os.fdopen(lFile, 'wb') as lOut:
+            lOut.write(self._data)
+        _bufferBytes -= len(self._data)
+        self._data = None
+
+    # Data of a glbwriter segment: the bytes, or the path of the temp file
+    def GetSegmentData(self):
+        if self._path is None:
+            return self._data
+        return self._path
+
+    # 1D array of pCount elements at pByteOffset, memory mapped if the buffer is spilled
+    def ReadArray(self, pDType, pCount, pByteOffset):
+        if self._path is None:
+            return np.frombuffer(self._data, dtype=pDType, count=pCount, offset=pByteOffset)
+        if pCount == 0:
+            return np.empty(0, dtype=pDType)
+        return np.memmap(self._path, dtype=pDType, mode='r', offset=pByteOffset, shape=(pCount,))
+
+# Returns pArray, or a memory mapped copy of it if keeping it in memory is above the budget
+def SpillArray(pArray):
+    global _arrayBytes
+    if not IsOverBudget(pArray.nbytes) or pArray.nbytes == 0:
+        _arrayBytes += pArray.nbytes
+        return pArray
+    lFile, lPath = tempfile.mkstemp(suffix='.npy', dir=GetTempDir())
+    os.close(lFile)
+    lMapped = np.lib.format.open_memmap(lPath, mode='w+', dtype=pArray.dtype, shape=pArray.shape)
+    lMapped[...] = pArray
+    lMapped.flush()
+    return lMapped
+
+# The arrays given to SpillArray are not kept anymore
+def ReleaseArrays():
+    global _arrayBytes
+    _arrayBytes = 0
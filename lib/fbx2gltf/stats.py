@@ -0,0 +1,131 @@
+# ############################################
+# Statistics of a converted glTF scene, independent from the FBX SDK.
+# Bounds come from the min/max of the POSITION accessors, transformed to world space
+# by the node matrices, so no vertex data is read. Skinned meshes ignore their node matrix,
+# their box is transformed by the inverse bind and world matrix of each joint instead.
+# ############################################
+import numpy as np
+import scenegraph
+
+GL_TRIANGLES = 4
+GL_TRIANGLE_STRIP = 5
+GL_TRIANGLE_FAN = 6
+
+def GetAccessorBounds(pAccessor):
+    lQuantized = pAccessor.get('extensions', {}).get('WEB3D_quantized_attributes')
+    if lQuantized:
+        return np.array(lQuantized['decodedMin'], dtype=np.float64), np.array(lQuantized['decodedMax'], dtype=np.float64)
+    if 'min' not in pAccessor or 'max' not in pAccessor:
+        return None
+    return np.array(pAccessor['min'], dtype=np.float64), np.array(pAccessor['max'], dtype=np.float64)
+
+# Local bounds of a primitive, grown by its morph targets as if all weights were 1
+def GetPrimitiveBounds(pPrimitive, pAccessors):
+    lBounds = GetAccessorBounds(pAccessors[pPrimitive['attributes']['POSITION']])
+    if lBounds is None:
+        return None
+    lMin, lMax = lBounds
+    for lTarget in pPrimitive.get('targets', []):
+        if 'POSITION' not in lTarget:
+            continue
+        lTargetBounds = GetAccessorBounds(pAccessors[lTarget['POSITION']])
+        if lTargetBounds is not None:
+            lMin = lMin + np.minimum(lTargetBounds[0], 0)
+            lMax = lMax + np.maximum(lTargetBounds[1], 0)
+    return lMin, lMax
+
+def GetBoxCorners(pMin, pMax):
+    lCorners = np.ones((8, 4))
+    for i in range(8):
+        lCorners[i, :3] = [pMax[k] if i & (1 << k) else pMin[k] for k in range(3)]
+    return lCorners
+
+def CountTriangles(pPrimitive, pAccessors):
+    if 'indices' in pPrimitive:
+        lCount = pAccessors[pPrimitive['indices']]['count']
+    else:
+        lCount = pAccessors[pPrimitive['attributes']['POSITION']]['count']
+    lMode = pPrimitive.get('mode', GL_TRIANGLES)
+    if lMode == GL_TRIANGLES:
+        return lCount // 3
+    if lMode in (GL_TRIANGLE_STRIP, GL_TRIANGLE_FAN):
+        return max(lCount - 2, 0)
+    return 0
+
+# Bind pose matrices of the joints of a skin that are in the scene, inverse bind matrix x joint world matrix.
+# The skinned vertices are weighted averages of the vertex transformed by these matrices, so the box of the
+# transformed corners holds them. Joints that no vertex is bound to may grow it.
+def GetSkinMatrices(pSkin, pInverseBindMatrices, pWorldMatrices):
+    lMatrices = []
+    for k in range(len(pSkin['joints'])):
+        lJointMatrix = pWorldMatrices[pSkin['joints'][k]]
+        if lJointMatrix is None:
+            continue
+        if pInverseBindMatrices is None:
+            lMatrices.append(lJointMatrix)
+        else:
+            lMatrices.append(np.dot(pInverseBindMatrices[k], lJointMatrix))
+    return np.array(lMatrices).reshape(-1, 4, 4)
+
+# Bounds and counts of what a viewer draws for the scene. Nodes out of the scene hierarchy, like
+# MSFT_lod levels, are not drawn. pInstanceMatrices has the EXT_mesh_gpu_instancing transforms by node,
+# pInverseBindMatrices has the inverse bind matrices of the skins by skin index.
+def ComputeSceneStats(pGLTF, pSceneIdx, pInstanceMatrices={}, pBufferBytes={}, pInverseBindMatrices={}):
+    lNodes = pGLTF.get('nodes', [])
+    lAccessors = pGLTF.get('accessors', [])
+    lMeshes = pGLTF.get('meshes', [])
+    lWorldMatrices = scenegraph.GetWorldMatrices(lNodes, pGLTF['scenes'][pSceneIdx].get('nodes', []))
+
+    lCorners = []
+    lTriangles = 0
+    lVertices = 0
+    lDrawCalls = 0
+    for i in range(len(lNodes)):
+        if lWorldMatrices[i] is None or 'mesh' not in lNodes[i]:
+            continue
+        if 'skin' in lNodes[i]:
+            lMatrices = GetSkinMatrices(pGLTF['skins'][lNodes[i]['skin']], pInverseBindMatrices.get(lNodes[i]['skin']), lWorldMatrices)
+        elif i in pInstanceMatrices:
+            lMatrices = np.array([np.dot(lInstance, lWorldMatrices[i]) for lInstance in pInstanceMatrices[i]])
+        else:
+            lMatrices = np.array([lWorldMatrices[i]])
+        lInstanceCount = len(lMatrices)
+        if 'skin' in lNodes[i]:
+            lInstanceCount = 1
+        if lInstanceCount == 0:
+            continue
+        for lPrimitive in lMeshes[lNodes[i]['mesh']]['primitives']:
+            lDrawCalls += 1
+            lTriangles += CountTriangles(lPrimitive, lAccessors) * lInstanceCount
+            lVertices += lAccessors[lPrimitive['attributes']['POSITION']]['count'] * lInstanceCount
+            lBounds = GetPrimitiveBounds(lPrimitive, lAccessors)
+            if lBounds is not None and len(lMatrices) > 0:
+                lCorners.append(np.einsum('ij,njk->nik', GetBoxCorners(*lBounds), lMatrices)[:, :, :3].reshape(-1, 3))
+
+    lStats = {
+        'triangles': lTriangles,
+        'vertices': lVertices,
+        'drawCalls': lDrawCalls,
+        'nodes': len(lNodes),
+        'meshes': len(lMeshes),
+        'materials': len(pGLTF.get('materials', [])),
+        'textures': len(pGLTF.get('textures', [])),
+        'images': len(pGLTF.get('images', [])),
+        'animations': len(pGLTF.get('animations', [])),
+        'bufferBytes': pBufferBytes
+    }
+    if len(lCorners) > 0:
+        lCorners = np.concatenate(lCorners)
+        lMin = lCorners.min(axis=0)
+        lMax = lCorners.max(axis=0)
+        lCenter = (lMin + lMax) / 2
+        lStats['bounds'] = {
+            'min': lMin.tolist(),
+            'max': lMax.tolist()
+        }
+        # Sphere around the box center holding all the transformed primitive boxes
+        lStats['boundingSphere'] = {
+            'center': lCenter.tolist(),
+            'radius': float(np.sqrt(((lCorners - lCenter) ** 2).sum(axis=1)).max())
+        }
+    return lStats
@@ -0,0 +1,138 @@
+# ############################################
+# Texture pipeline, independent from the FBX SDK.
+# Image files are hashed, sniffed and optionally resized on a thread pool. Resized images
+# are cached by the hash of their content so every distinct image is only resized once.
+# Resizing needs Pillow, without it images are passed through untouched.
+# ############################################
+import os, hashlib, shutil, math
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MAX_WORKERS = 8
+_readSize = 1 << 20
+
+def HashFile(pPath):
+    lHash = hashlib.sha1()
+    with open(pPath, 'rb') as lFile:
+        lChunk = lFile.read(_readSize)
+        while lChunk:
+            lHash.update(lChunk)
+            lChunk = lFile.read(_readSize)
+    return lHash.hexdigest()
+
+# glTF only supports PNG and JPEG, sniffed from the content since extensions lie
+def GetDataMimeType(pHeader):
+    if pHeader.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if pHeader.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    return None
+
+def GetMimeType(pPath):
+    with open(pPath, 'rb') as lFile:
+        return GetDataMimeType(lFile.read(8))
+
+_fileExtensions = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg'
+}
+
+# Image content from memory (embedded in a GLB) written to the cache directory, named by its hash
+def CacheImageData(pData, pCacheDir):
+    lCachePath = os.path.join(pCacheDir, hashlib.sha1(pData).hexdigest() + _fileExtensions.get(GetDataMimeType(bytes(pData[:8])), ''))
+    if os.path.isfile(lCachePath):
+        return lCachePath
+    os.makedirs(pCacheDir, exist_ok=True)
+    lTempPath = '%s.%d.tmp' % (lCachePath, os.getpid())
+    with open(lTempPath, 'wb') as lFile:
+        lFile.write(pData)
+    os.replace(lTempPath, lCachePath)
+    return lCachePath
+
+def NearestPowerOfTwo(pSize):
+    return 2 ** int(round(math.log(max(pSize, 1), 2)))
+
+def GetTextureSize(pWidth, pHeight, pMaxSize, pPowerOfTwo):
+    lScale = 1.0
+    if pMaxSize > 0 and max(pWidth, pHeight) > pMaxSize:
+        lScale = pMaxSize / float(max(pWidth, pHeight))
+    lWidth = max(int(round(pWidth * lScale)), 1)
+    lHeight = max(int(round(pHeight * lScale)), 1)
+    if pPowerOfTwo:
+        lWidth = NearestPowerOfTwo(lWidth)
+        lHeight = NearestPowerOfTwo(lHeight)
+        while pMaxSize > 0 and max(lWidth, lHeight) > pMaxSize and max(lWidth, lHeight) > 1:
+            lWidth = max(lWidth // 2, 1)
+            lHeight = max(lHeight // 2, 1)
+    return lWidth, lHeight
+
+# Resized or converted image in the cache directory, None if the image can be used as is
+def ResizeImage(pPath, pDigest, pMimeType, pMaxSize, pPowerOfTwo, pCacheDir):
+    if Image is None:
+        return None
+    lImage = Image.open(pPath)
+    lSize = GetTextureSize(lImage.size[0], lImage.size[1], pMaxSize, pPowerOfTwo)
+    if lSize == lImage.size and pMimeType is not None:
+        return None
+
+    # JPEG stays JPEG, every other format becomes PNG
+    lIsJPEG = pMimeType == 'image/jpeg'
+    lCachePath = os.path.join(pCacheDir, '%s_%dx%d.%s' % (pDigest, lSize[0], lSize[1], 'jpg' if lIsJPEG else 'png'))
+    if os.path.isfile(lCachePath):
+        return lCachePath
+
+    if lIsJPEG:
+        lImage = lImage.convert('RGB')
+    elif lImage.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+        lImage = lImage.convert('RGBA')
+    if lSize != lImage.size:
+        lImage = lImage.resize(lSize, Image.LANCZOS)
+    os.makedirs(pCacheDir, exist_ok=True)
+    # Write next to the cache entry first so concurrent conversions never read a partial file
+    lTempPath = '%s.%d.tmp' % (lCachePath, os.getpid())
+    if lIsJPEG:
+        lImage.save(lTempPath, 'JPEG', quality=90)
+    else:
+        lImage.save(lTempPath, 'PNG', optimize=True)
+    os.replace(lTempPath, lCachePath)
+    return lCachePath
+
+def ProcessTexture(pPath, pMaxSize, pPowerOfTwo, pCacheDir):
+    if not pPath or not os.path.isfile(pPath) or os.path.getsize(pPath) == 0:
+        return None
+    lDigest = HashFile(pPath)
+    lMimeType = GetMimeType(pPath)
+    if pMaxSize > 0 or pPowerOfTwo or lMimeType is None:
+        try:
+            lResizedPath = ResizeImage(pPath, lDigest, lMimeType, pMaxSize, pPowerOfTwo, pCacheDir)
+        except (IOError, OSError) as e:
+            print('Can\'t resize texture file ' + pPath + ': ' + str(e))
+            lResizedPath = None
+        if lResizedPath:
+            return lResizedPath, lDigest, GetMimeType(lResizedPath)
+    return pPath, lDigest, lMimeType
+
+# (path, content hash, mime type) of every image file, None for missing files.
+# The path is the resized image in the cache directory if it was resized.
+def ProcessTextures(pPaths, pMaxSize=0, pPowerOfTwo=False, pCacheDir=None):
+    if (pMaxSize > 0 or pPowerOfTwo) and Image is None:
+        print('Pillow is not installed, textures are not resized')
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as lExecutor:
+        return list(lExecutor.map(lambda lPath: ProcessTexture(lPath, pMaxSize, pPowerOfTwo, pCacheDir), pPaths))
+
+# Copy (source, destination) pairs, creating the destination directories
+def CopyFiles(pCopies):
+    def Copy(pCopy):
+        lSource, lDestination = pCopy
+        if os.path.abspath(lSource) == os.path.abspath(lDestination):
+            return
+        lDir = os.path.dirname(lDestination)
+        if lDir:
+            os.makedirs(lDir, exist_ok=True)
+        shutil.copyfile(lSource, lDestination)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as lExecutor:
+        list(lExecutor.map(Copy, pCopies))
@@ -32,6 +32,32 @@ print(r.status_code)
 print(r.text)
 
 
+# Upload a GLB file to optimize it again
+print("Upload GLB file + arguments")
+url = 'http://0.0.0.0:'+PORT+'/v1/models'  # API endpoint
+filename = 'test.glb'
+file = open(filename, 'rb')  # File to upload
+try:
+    r = requests.post(url=url, files={'file': file}, data={'compress': 'true', 'binary': 'true'})
+except requests.exceptions.RequestException as e:  # This is the correct syntax
+    print(e)
+print(r.status_code)
+print(r.text)
+
+
+# Upload an OBJ file with faces in different formats, expect 4 triangles in the stats
+print("Upload OBJ file with mixed face formats")
+url = 'http://0.0.0.0:'+PORT+'/v1/models'  # API endpoint
+obj = ('v 0 0 0\nv 1 0 0\nv 0 1 0\nvt 0 0\nvt 1 0\nvt 0 1\nvn 0 0 1\n'
+       'f 1/1 2/2 3/3\nf 1 2 3\nf 1/1/1 2/2/1 3/3/1\nf 3//1 2//1 1//1\n')
+try:
+    r = requests.post(url=url, files={'file': ('mixed.obj', obj)})
+except requests.exceptions.RequestException as e:  # This is the correct syntax
+    print(e)
+print(r.status_code)
+print(r.text)
+
+
 # Upload a supported file by sending the url
 print("Post source_path to supported file")
 url = 'http://0.0.0.0:'+PORT+'/v1/models'  # API endpoint
@@ -62,6 +88,48 @@ data = r.json()
 model_id = data['model_id']
 
 
+# Upload a supported file by sending the url + levels of detail
+print("Post source_path to supported file + levels of detail")
+url = 'http://0.0.0.0:'+PORT+'/v1/models'  # API endpoint
+source_path = 'https://purplepill.io/wp-includes/3d/test.fbx'
+try:
+    r = requests.post(url=url, data={'source_path': source_path, 'lod': '0.5,0.25'})
+except http.client.HTTPException as e:
+    print(e)
+except requests.exceptions.RequestException as e:  # This is the correct syntax
+    print(e)
+print(r.status_code)
+print(r.text)
+
+
+# Upload a supported file by sending the url + animations in separate files
+print("Post source_path to supported file + split animations")
+url = 'http://0.0.0.0:'+PORT+'/v1/models'  # API endpoint
+source_path = 'https://purplepill.io/wp-includes/3d/test.fbx'
+try:
+    r = requests.post(url=url, data={'source_path': source_path, 'split_animations': 'true', 'binary': 'true'})
+except http.client.HTTPException as e:
+    print(e)
+except requests.exceptions.RequestException as e:  # This is the correct syntax
+    print(e)
+print(r.status_code)
+print(r.text)
+
+
+# Upload a supported file with invalid levels of detail
+print("Post source_path to supported file + invalid levels of detail")
+url = 'http://0.0.0.0:'+PORT+'/v1/models'  # API endpoint
+source_path = 'https://purplepill.io/wp-includes/3d/test.fbx'
+try:
+    r = requests.post(url=url, data={'source_path': source_path, 'lod': '2,abc'})
+except http.client.HTTPException as e:
+    print(e)
+except requests.exceptions.RequestException as e:  # This is the correct syntax
+    print(e)
+print(r.status_code)
+print(r.text)
+
+
 # Upload a file that is too large
 print("Upload a file that is too large")
 url = 'http://0.0.0.0:'+PORT+'/v1/models'  # API endpoint
@@ -109,6 +177,17 @@ print(r.status_code)
 print(r.text)
 
 
+# Convert an existing model again with other options
+print("Export existing model with id %s + arguments" % model_id)
+url = 'http://0.0.0.0:'+PORT+'/v1/models/' + model_id + '/exports'  # API endpoint
+try:
+    r = requests.post(url=url, data={'lod': '0.5'})
+except requests.exceptions.RequestException as e:  # This is the correct syntax
+    print(e)
+print(r.status_code)
+print(r.text)
+
+
 # Delete existing model
 print("Delete existing model with id %s" % model_id)
 url = 'http://0.0.0.0:'+PORT+'/v1/models/' + model_id  # API endpoint